@@ -1,19 +1,72 @@
-from flask import Flask, jsonify, request, Response, stream_with_context, current_app
+from __future__ import annotations
+
+from flask import Flask, jsonify, request, Response, stream_with_context, current_app, g, has_request_context, copy_current_request_context
 from flask_cors import CORS
 import json
 import os
 from dotenv import load_dotenv
 from functools import wraps
+from operator import attrgetter
+import atexit
+import contextvars
 import hashlib
+import hmac
+import importlib.util
+import heapq
+import itertools
+import math
+import mmap
+import queue
+import random
+import threading
 import time
+import uuid
 import logging
-from typing import Any, Dict, Generator, Iterable, List, Optional, Sequence, Tuple
-import firebase_admin
-from firebase_admin import auth, credentials, firestore as admin_firestore, messaging
-from groq import Groq
-from datetime import datetime, timezone
+import re
+import signal
+import struct
+import sys
+import tempfile
+import zlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Generator, Iterable, Iterator, List, Optional, Sequence, Tuple
+from datetime import datetime, timedelta, timezone
+from types import ModuleType
+from flask.json.provider import DefaultJSONProvider
 from werkzeug.security import generate_password_hash
 
+try:
+    import orjson  # in requirements.txt; the stdlib encoder below is the fallback
+except ImportError:
+    orjson = None
+
+
+class _LazyModule(ModuleType):
+    """Module placeholder that performs the real import on first attribute access."""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._module: Optional[ModuleType] = None
+
+    def __getattr__(self, attr: str) -> Any:
+        module = self.__dict__.get("_module")
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self._module = module
+        return getattr(module, attr)
+
+
+# Firebase Admin (with google-cloud-firestore), Groq and httpx make up most of the
+# import time, so they load on first use (see benchmarks/startup_benchmark.py).
+firebase_admin = _LazyModule("firebase_admin")
+auth = _LazyModule("firebase_admin.auth")
+credentials = _LazyModule("firebase_admin.credentials")
+admin_firestore = _LazyModule("firebase_admin.firestore")
+messaging = _LazyModule("firebase_admin.messaging")
+groq = _LazyModule("groq")
+httpx = _LazyModule("httpx")
+
 # Helper function for distance calculation
 def haversine(lat1, lon1, lat2, lon2):
     from math import radians, cos, sin, asin, sqrt
@@ -31,9 +84,10 @@ load_dotenv()
 # Configure logging
 logging.basicConfig(
     level=logging.INFO if os.environ.get("FLASK_ENV") == "production" else logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    format='%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
 )
 logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger(f"{__name__}.trace")
 
 # Groq configuration
 GROQ_DEFAULT_MODEL = os.environ.get("GROQ_MODEL", "gemma2-9b-it")
@@ -44,12 +98,184 @@ GROQ_EMOTION_MODEL = os.environ.get("GROQ_EMOTION_MODEL", GROQ_DEFAULT_MODEL)
 GROQ_EMOTION_TEMPERATURE = float(os.environ.get("GROQ_EMOTION_TEMPERATURE", "0"))
 GROQ_EMOTION_TOP_P = float(os.environ.get("GROQ_EMOTION_TOP_P", "0.1"))
 GROQ_EMOTION_MAX_TOKENS = int(os.environ.get("GROQ_EMOTION_MAX_TOKENS", "256"))
+GROQ_MAX_RETRIES = int(os.environ.get("GROQ_MAX_RETRIES", "2"))
+GROQ_RETRY_BASE_DELAY_SECONDS = float(os.environ.get("GROQ_RETRY_BASE_DELAY_SECONDS", "0.25"))
+GROQ_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("GROQ_BREAKER_FAILURE_THRESHOLD", "5"))
+GROQ_BREAKER_RESET_SECONDS = float(os.environ.get("GROQ_BREAKER_RESET_SECONDS", "30"))
+GROQ_DEFAULT_DEADLINE_SECONDS = float(os.environ.get("GROQ_DEFAULT_DEADLINE_SECONDS", "20"))
+# Total LLM time budget per request, keyed by Flask endpoint name.
+GROQ_ROUTE_DEADLINES: Dict[str, float] = {
+    "ask_assistant": 25.0,
+    "ask_assistant_stream": 60.0,
+    "send_sos": 8.0,
+    "get_nearest_users": 6.0,
+    "get_nearby_alerts": 6.0,
+    "send_conversation_message": 5.0,
+    "respond_to_alert": 5.0,
+    "analyze_emotion": 5.0,
+    **{
+        endpoint: float(seconds)
+        for endpoint, seconds in json.loads(os.environ.get("GROQ_ROUTE_DEADLINES") or "{}").items()
+    },
+}
+LLM_MAX_IN_FLIGHT = int(os.environ.get("LLM_MAX_IN_FLIGHT", "4"))
+# Lower value = served first when the gateway is saturated.
+LLM_FEATURE_PRIORITIES: Dict[str, int] = {
+    "sos_analysis": 0,
+    "ask": 1,
+    "emotion": 2,
+    "geospatial": 3,
+    "feed_summary": 4,
+    "chat_summary": 4,
+    "general": 5,
+}
+# Candidate models per feature, most preferred first. The router falls back along the list when
+# a model misses the feature's latency SLO or error budget.
+LLM_FEATURE_MODELS: Dict[str, List[str]] = {
+    "emotion": [GROQ_EMOTION_MODEL],
+    **{
+        feature: list(models)
+        for feature, models in json.loads(os.environ.get("LLM_FEATURE_MODELS") or "{}").items()
+    },
+}
+# p95 latency target per feature, in milliseconds (time to first byte for streams).
+LLM_FEATURE_SLO_MS: Dict[str, float] = {
+    "sos_analysis": 3000.0,
+    "emotion": 1500.0,
+    "geospatial": 3000.0,
+    "feed_summary": 4000.0,
+    "chat_summary": 8000.0,
+    "ask": 10000.0,
+    "general": 10000.0,
+    **{
+        feature: float(ms)
+        for feature, ms in json.loads(os.environ.get("LLM_FEATURE_SLO_MS") or "{}").items()
+    },
+}
+LLM_MAX_ERROR_RATE = float(os.environ.get("LLM_MAX_ERROR_RATE", "0.2"))
+LLM_ROUTER_WINDOW_SECONDS = float(os.environ.get("LLM_ROUTER_WINDOW_SECONDS", "300"))
+LLM_ROUTER_MIN_SAMPLES = int(os.environ.get("LLM_ROUTER_MIN_SAMPLES", "5"))
+# Secondary model raced against the primary for SOS analysis; empty disables hedging.
+SOS_HEDGE_MODEL = os.environ.get("SOS_HEDGE_MODEL", "")
+SOS_HEDGE_DELAY_MS = float(os.environ.get("SOS_HEDGE_DELAY_MS", "1500"))
+# Estimated-token ceiling for each analyzer prompt; list sections are trimmed to fit.
+PROMPT_TOKEN_BUDGETS: Dict[str, int] = {
+    "emotion": 700,
+    "geospatial": 800,
+    "sos_analysis": 900,
+    "feed_summary": 1500,
+    **{
+        feature: int(tokens)
+        for feature, tokens in json.loads(os.environ.get("PROMPT_TOKEN_BUDGETS") or "{}").items()
+    },
+}
+PROMPT_DEFAULT_TOKEN_BUDGET = int(os.environ.get("PROMPT_DEFAULT_TOKEN_BUDGET", "1000"))
+# Cap for a single free-text field (an SOS message, the message being classified).
+PROMPT_MAX_FIELD_TOKENS = int(os.environ.get("PROMPT_MAX_FIELD_TOKENS", "300"))
+ASK_CACHE_ENABLED = os.environ.get("ASK_CACHE_ENABLED", "0") == "1"
+ASK_CACHE_TTL_SECONDS = float(os.environ.get("ASK_CACHE_TTL_SECONDS", "3600"))
+ASK_CACHE_MAX_ENTRIES = int(os.environ.get("ASK_CACHE_MAX_ENTRIES", "2000"))
+# Minimum shingle Jaccard similarity for a near-duplicate hit; 0 (the default) disables the
+# similarity tier so the cache only serves exact repeats.
+ASK_CACHE_SIMILARITY_THRESHOLD = float(os.environ.get("ASK_CACHE_SIMILARITY_THRESHOLD", "0"))
+ASK_HISTORY_TURNS = int(os.environ.get("ASK_HISTORY_TURNS", "6"))
+ASK_SUMMARY_BATCH_TURNS = int(os.environ.get("ASK_SUMMARY_BATCH_TURNS", "6"))
+ASK_SUMMARY_MAX_TOKENS = int(os.environ.get("ASK_SUMMARY_MAX_TOKENS", "256"))
+ASK_CONTEXT_TOKEN_BUDGET = int(os.environ.get("ASK_CONTEXT_TOKEN_BUDGET", str(GROQ_DEFAULT_MAX_TOKENS)))
 MAX_DIRECT_MESSAGE_LENGTH = int(os.environ.get("MAX_DIRECT_MESSAGE_LENGTH", "4000"))
 DEFAULT_CONVERSATION_LIMIT = int(os.environ.get("DEFAULT_CONVERSATION_LIMIT", "50"))
 DEFAULT_MESSAGE_LIMIT = int(os.environ.get("DEFAULT_MESSAGE_LIMIT", "50"))
-
-_groq_client: Optional[Groq] = None
+DEFAULT_CHAT_HISTORY_LIMIT = int(os.environ.get("DEFAULT_CHAT_HISTORY_LIMIT", "50"))
+CHAT_WRITE_BUFFER_ENABLED = os.environ.get("CHAT_WRITE_BUFFER_ENABLED", "1") == "1"
+CHAT_WRITE_FLUSH_SECONDS = float(os.environ.get("CHAT_WRITE_FLUSH_SECONDS", "0.5"))
+CHAT_WRITE_BATCH_SIZE = int(os.environ.get("CHAT_WRITE_BATCH_SIZE", "50"))
+CHAT_WRITE_QUEUE_MAX = int(os.environ.get("CHAT_WRITE_QUEUE_MAX", "5000"))
+SSE_COALESCE_SECONDS = float(os.environ.get("SSE_COALESCE_SECONDS", "0.05"))
+SSE_COALESCE_MAX_BYTES = int(os.environ.get("SSE_COALESCE_MAX_BYTES", "512"))
+SSE_HEARTBEAT_SECONDS = float(os.environ.get("SSE_HEARTBEAT_SECONDS", "15"))
+SSE_BUFFER_CHUNKS = int(os.environ.get("SSE_BUFFER_CHUNKS", "256"))
+# Encode responses with orjson when it is installed; the stdlib encoder is the fallback.
+JSON_FAST_ENCODER = os.environ.get("JSON_FAST_ENCODER", "1") == "1"
+NDJSON_MIMETYPE = "application/x-ndjson"
+LOCATION_FRESHNESS_MINUTES = float(os.environ.get("LOCATION_FRESHNESS_MINUTES", "30"))
+# Serve nearest-neighbour lookups from a memory-mapped location table kept by `flask location-index`.
+LOCATION_INDEX_ENABLED = os.environ.get("LOCATION_INDEX_ENABLED", "0") == "1"
+LOCATION_INDEX_PATH = os.environ.get("LOCATION_INDEX_PATH") or os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "gemini-alert-locations.idx"
+)
+LOCATION_INDEX_CAPACITY = int(os.environ.get("LOCATION_INDEX_CAPACITY", "200000"))
+# Readers fall back to Firestore when the updater has not written a heartbeat for this long.
+LOCATION_INDEX_STALE_SECONDS = float(os.environ.get("LOCATION_INDEX_STALE_SECONDS", "30"))
+LOCATION_INDEX_POLL_SECONDS = float(os.environ.get("LOCATION_INDEX_POLL_SECONDS", "2"))
+# Compact on-disk copy of the table, reloaded on updater start so a restart only reads recent changes.
+LOCATION_INDEX_SNAPSHOT_PATH = os.environ.get("LOCATION_INDEX_SNAPSHOT_PATH") or os.path.join(
+    tempfile.gettempdir(), "gemini-alert-locations.snap"
+)
+LOCATION_INDEX_SNAPSHOT_SECONDS = float(os.environ.get("LOCATION_INDEX_SNAPSHOT_SECONDS", "60"))
+DEFAULT_ALERT_MAX_AGE_MINUTES = float(os.environ.get("DEFAULT_ALERT_MAX_AGE_MINUTES", "180"))
+NEARBY_ALERT_QUERY_LIMIT = int(os.environ.get("NEARBY_ALERT_QUERY_LIMIT", "200"))
+# Larger client radii are clamped so one poll cannot turn into a scan of every active alert.
+NEARBY_ALERT_MAX_RADIUS_KM = float(os.environ.get("NEARBY_ALERT_MAX_RADIUS_KM", "50"))
+# Alerts store a geohash of this many characters (~5 m cells) so area queries can use a range filter.
+ALERT_GEOHASH_PRECISION = 9
+ALERT_INACTIVITY_MINUTES = float(os.environ.get("ALERT_INACTIVITY_MINUTES", "180"))
+ALERT_ACTIVE_CAP = int(os.environ.get("ALERT_ACTIVE_CAP", "500"))
+ALERT_ARCHIVE_COLLECTION = os.environ.get("ALERT_ARCHIVE_COLLECTION", "archivedAlerts")
+ALERT_LIFECYCLE_BATCH_SIZE = int(os.environ.get("ALERT_LIFECYCLE_BATCH_SIZE", "100"))
+MAINTENANCE_TOKEN = os.environ.get("MAINTENANCE_TOKEN", "")
+SOS_CLUSTER_RADIUS_KM = float(os.environ.get("SOS_CLUSTER_RADIUS_KM", "0.5"))
+SOS_CLUSTER_WINDOW_MINUTES = float(os.environ.get("SOS_CLUSTER_WINDOW_MINUTES", "15"))
+SOS_CLUSTER_MAX_MERGED_CHARS = int(os.environ.get("SOS_CLUSTER_MAX_MERGED_CHARS", "2000"))
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get("IDEMPOTENCY_MAX_KEYS", "10000"))
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1") == "1"
+GLOBAL_RATE_PER_SECOND = float(os.environ.get("GLOBAL_RATE_PER_SECOND", "50"))
+GLOBAL_RATE_BURST = float(os.environ.get("GLOBAL_RATE_BURST", "100"))
+# Share of the global bucket that only critical (SOS / alert response) traffic may spend.
+CRITICAL_RESERVE_FRACTION = float(os.environ.get("CRITICAL_RESERVE_FRACTION", "0.3"))
+# Firestore rejects batches above 500 writes; leave headroom for an alert's responses.
+FIRESTORE_BATCH_WRITE_LIMIT = 450
+# A failed Firebase Admin init is retried after this delay, doubling per failure up to the maximum.
+FIRESTORE_INIT_RETRY_SECONDS = float(os.environ.get("FIRESTORE_INIT_RETRY_SECONDS", "5"))
+FIRESTORE_INIT_RETRY_MAX_SECONDS = float(os.environ.get("FIRESTORE_INIT_RETRY_MAX_SECONDS", "300"))
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+# Shared directory for per-worker metric snapshots; set it when running several gunicorn workers.
+METRICS_DIR = os.environ.get("METRICS_DIR", "")
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "5"))
+# /metrics is refused until a token is configured; scrapers send it as X-Metrics-Token.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "1") == "1"
+# Append OTLP/JSON span batches to this file; when empty they are logged on the "app.trace" logger.
+TRACE_EXPORT_PATH = os.environ.get("TRACE_EXPORT_PATH", "")
+# Only export traces of requests at least this slow; 0 exports every request.
+TRACE_EXPORT_MIN_MS = float(os.environ.get("TRACE_EXPORT_MIN_MS", "1000"))
+TRACE_SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "gemini-alert-backend")
+PROFILE_DIR = os.environ.get("PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "gemini-alert-profiles")
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "120"))
+PROFILE_MAX_ACTIVE = int(os.environ.get("PROFILE_MAX_ACTIVE", "2"))
+# Serve from the in-memory stand-ins in local_backends.py for load tests and offline development.
+# Any bearer token is accepted as a uid, so this refuses to start unless FLASK_ENV=development is set.
+LOCAL_BACKENDS = os.environ.get("LOCAL_BACKENDS", "0") == "1"
+# Keyword arguments for local_backends.seed_dataset, e.g. {"users": 1000, "alerts": 100}.
+LOCAL_SEED: Dict[str, Any] = json.loads(os.environ.get("LOCAL_SEED") or "{}")
+LOCAL_GROQ_LATENCY_SECONDS = float(os.environ.get("LOCAL_GROQ_LATENCY_SECONDS", "0.3"))
+LOCAL_GROQ_TOKEN_LATENCY_SECONDS = float(os.environ.get("LOCAL_GROQ_TOKEN_LATENCY_SECONDS", "0.01"))
+LOCAL_FCM_LATENCY_SECONDS = float(os.environ.get("LOCAL_FCM_LATENCY_SECONDS", "0.02"))
+
+GROQ_POOL_MAX_CONNECTIONS = int(os.environ.get("GROQ_POOL_MAX_CONNECTIONS", "20"))
+GROQ_POOL_MAX_KEEPALIVE = int(os.environ.get("GROQ_POOL_MAX_KEEPALIVE", "10"))
+GROQ_KEEPALIVE_EXPIRY_SECONDS = float(os.environ.get("GROQ_KEEPALIVE_EXPIRY_SECONDS", "120"))
+GROQ_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("GROQ_CONNECT_TIMEOUT_SECONDS", "5"))
+GROQ_READ_TIMEOUT_SECONDS = float(os.environ.get("GROQ_READ_TIMEOUT_SECONDS", "60"))
+GROQ_HTTP2 = os.environ.get("GROQ_HTTP2", "0") == "1"
+GROQ_WARMUP = os.environ.get("GROQ_WARMUP", "1") == "1"
+
+_groq_client: Optional[groq.Groq] = None
 _groq_available: bool = False
+_groq_client_override: Optional[Any] = None
+_groq_warmed = False
+_groq_client_lock = threading.Lock()
 
 
 def _parse_allowed_origins(raw_value: Optional[str]) -> List[str]:
@@ -84,27 +310,1048 @@ def _normalise_content(content) -> str:
     return str(content)
 
 
+_METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+_METRIC_DEFINITIONS: Dict[str, Tuple[str, str]] = {
+    "http_requests_total": ("counter", "HTTP requests by route, method and status."),
+    "http_request_duration_seconds": ("histogram", "Time to response headers by route and method."),
+    "http_requests_in_flight": ("gauge", "Requests currently being served, including open streams."),
+    "sse_streams_active": ("gauge", "Server-sent event streams currently open."),
+    "firestore_operations_total": ("counter", "Firestore calls by operation, collection and outcome."),
+    "firestore_operation_duration_seconds": ("histogram", "Firestore call latency by operation and collection."),
+    "groq_requests_total": ("counter", "Groq calls by feature, model, mode and outcome."),
+    "groq_request_duration_seconds": (
+        "histogram",
+        "Groq latency by feature, model and mode (complete, or stream time to first byte).",
+    ),
+    "groq_tokens_total": ("counter", "Tokens reported by Groq by feature and kind."),
+    "fcm_sends_total": ("counter", "FCM sends by result."),
+    "fcm_send_duration_seconds": ("histogram", "FCM send latency."),
+}
+
+
+def _metric_key(labels: Dict[str, Any]) -> str:
+    return json.dumps(sorted((str(k), str(v)) for k, v in labels.items()))
+
+
+class _Metrics:
+    """Process-local counters, gauges and histograms with optional cross-worker aggregation.
+
+    With ``METRICS_DIR`` set, each worker periodically writes its state to
+    ``<METRICS_DIR>/<pid>.json`` and ``/metrics`` sums every worker's file.
+    Counters and histograms of exited workers are kept; their gauges are not.
+    """
+
+    def __init__(self, directory: str, flush_seconds: float):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._values: Dict[str, Dict[str, Any]] = {name: {} for name in _METRIC_DEFINITIONS}
+        self._flusher_pid: Optional[int] = None
+
+    def inc(self, name: str, labels: Dict[str, Any], value: float = 1.0) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = _metric_key(labels)
+        with self._lock:
+            series = self._values[name]
+            series[key] = series.get(key, 0.0) + value
+        self._ensure_flusher()
+
+    def observe(self, name: str, labels: Dict[str, Any], seconds: float) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = _metric_key(labels)
+        with self._lock:
+            series = self._values[name]
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = {"buckets": [0] * len(_METRIC_BUCKETS), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(_METRIC_BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][index] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+        self._ensure_flusher()
+
+    @contextmanager
+    def track_in_progress(self, name: str, labels: Optional[Dict[str, Any]] = None):
+        self.inc(name, labels or {})
+        try:
+            yield
+        finally:
+            self.inc(name, labels or {}, -1.0)
+
+    @contextmanager
+    def time(self, name: str, labels: Dict[str, Any], counter: Optional[str] = None):
+        """Observe the block's duration; ``counter`` also counts it with an ``outcome`` label."""
+        started = time.monotonic()
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        finally:
+            self.observe(name, labels, time.monotonic() - started)
+            if counter:
+                self.inc(counter, {**labels, "outcome": outcome})
+
+    def dump(self) -> Dict[str, Any]:
+        with self._lock:
+            return json.loads(json.dumps(self._values))
+
+    def _ensure_flusher(self) -> None:
+        if not self.directory or self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name="metrics-flusher", daemon=True).start()
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.directory:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{os.getpid()}.json")
+            temp_path = f"{path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as handle:
+                json.dump(self.dump(), handle)
+            os.replace(temp_path, path)
+        except OSError as exc:
+            logger.warning("Failed to write metrics snapshot: %s", exc)
+
+    def _collect(self) -> List[Tuple[Dict[str, Any], bool]]:
+        """Return ``(values, alive)`` for this worker and every worker snapshot on disk."""
+        if not self.directory:
+            return [(self.dump(), True)]
+        self.flush()
+        snapshots = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                pid = int(filename[:-5])
+                with open(os.path.join(self.directory, filename), encoding="utf-8") as handle:
+                    values = json.load(handle)
+            except (ValueError, OSError):
+                continue
+            snapshots.append((values, _process_alive(pid)))
+        return snapshots
+
+    def render(self) -> str:
+        merged: Dict[str, Dict[str, Any]] = {name: {} for name in _METRIC_DEFINITIONS}
+        for values, alive in self._collect():
+            for name, series in values.items():
+                kind = _METRIC_DEFINITIONS.get(name, ("", ""))[0]
+                if not kind or (kind == "gauge" and not alive):
+                    continue
+                target = merged[name]
+                for key, value in series.items():
+                    if kind == "histogram":
+                        current = target.setdefault(key, {"buckets": [0] * len(_METRIC_BUCKETS), "sum": 0.0, "count": 0})
+                        current["buckets"] = [a + b for a, b in zip(current["buckets"], value["buckets"])]
+                        current["sum"] += value["sum"]
+                        current["count"] += value["count"]
+                    else:
+                        target[key] = target.get(key, 0.0) + value
+
+        lines: List[str] = []
+        for name, (kind, help_text) in _METRIC_DEFINITIONS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in sorted(merged[name].items()):
+                labels = json.loads(key)
+                if kind == "histogram":
+                    for bound, count in zip(_METRIC_BUCKETS, value["buckets"]):
+                        lines.append(f"{name}_bucket{_format_labels(labels + [['le', repr(bound)]])} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(labels + [['le', '+Inf']])} {value['count']}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {value['sum']:.6f}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+                else:
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: List[List[str]]) -> str:
+    if not labels:
+        return ""
+
+    def escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+
+def _process_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+_metrics = _Metrics(METRICS_DIR, METRICS_FLUSH_SECONDS)
+_firestore_call_depth = threading.local()
+
+
+class _Trace:
+    """Spans collected for one request; exported as a single OTLP/JSON batch when it ends."""
+
+    def __init__(self, request_id: str, trace_id: str, remote_parent_id: Optional[str] = None):
+        self.request_id = request_id
+        self.trace_id = trace_id
+        self.root_span_id = uuid.uuid4().hex[:16]
+        self.remote_parent_id = remote_parent_id
+        self.started_ns = time.time_ns()
+        self._lock = threading.Lock()
+        self.spans: List[Dict[str, Any]] = []
+
+    def add(self, span_record: Dict[str, Any]) -> None:
+        with self._lock:
+            self.spans.append(span_record)
+
+    def stage_timings(self) -> List[Tuple[str, float]]:
+        """Total milliseconds per direct child of the request span, in first-seen order."""
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for span_record in self.spans:
+                if span_record["parentSpanId"] == self.root_span_id:
+                    name = span_record["name"]
+                    duration = (span_record["endNs"] - span_record["startNs"]) / 1e6
+                    totals[name] = totals.get(name, 0.0) + duration
+        return list(totals.items())
+
+
+# Context variables (not thread locals) so the active trace follows work handed to helper threads.
+_current_trace: contextvars.ContextVar[Optional[_Trace]] = contextvars.ContextVar("current_trace", default=None)
+_current_span_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_span_id", default=None)
+
+
+def current_request_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.request_id if trace else None
+
+
+_base_record_factory = logging.getLogRecordFactory()
+
+
+def _record_with_request_id(*args, **kwargs) -> logging.LogRecord:
+    # Set on every record, so handlers added later (gunicorn's) can use %(request_id)s too.
+    record = _base_record_factory(*args, **kwargs)
+    record.request_id = current_request_id() or "-"
+    return record
+
+
+logging.setLogRecordFactory(_record_with_request_id)
+
+
+def _record_span(
+    name: str,
+    start_ns: int,
+    end_ns: int,
+    *,
+    parent_id: Optional[str] = None,
+    error: Optional[BaseException] = None,
+    attributes: Optional[Dict[str, Any]] = None,
+) -> None:
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    trace.add(
+        {
+            "name": name,
+            "spanId": uuid.uuid4().hex[:16],
+            "parentSpanId": parent_id or _current_span_id.get() or trace.root_span_id,
+            "startNs": start_ns,
+            "endNs": end_ns,
+            "error": f"{type(error).__name__}: {error}" if error is not None else None,
+            "attributes": attributes or {},
+        }
+    )
+
+
+@contextmanager
+def span(name: str, **attributes: Any):
+    """Time a stage of the current request. A no-op outside a traced request."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    span_id = uuid.uuid4().hex[:16]
+    parent_id = _current_span_id.get() or trace.root_span_id
+    token = _current_span_id.set(span_id)
+    start_ns = time.time_ns()
+    error: Optional[BaseException] = None
+    try:
+        yield
+    except BaseException as exc:
+        error = exc
+        raise
+    finally:
+        _current_span_id.reset(token)
+        trace.add(
+            {
+                "name": name,
+                "spanId": span_id,
+                "parentSpanId": parent_id,
+                "startNs": start_ns,
+                "endNs": time.time_ns(),
+                "error": f"{type(error).__name__}: {error}" if error is not None else None,
+                "attributes": attributes,
+            }
+        )
+
+
+class _SamplingProfiler:
+    """Samples the stacks of one request's threads and aggregates them as folded stacks.
+
+    The output (``frame;frame;frame count`` per line) loads directly into
+    flamegraph.pl, speedscope or inferno.
+    """
+
+    _active = 0
+    _active_lock = threading.Lock()
+
+    def __init__(self, profile_id: str, interval_seconds: float, max_seconds: float):
+        self.profile_id = profile_id
+        self.interval_seconds = max(0.001, interval_seconds)
+        self.max_seconds = max_seconds
+        self.samples = 0
+        self._threads: Dict[int, str] = {}
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    @classmethod
+    def try_start(cls, profile_id: str) -> Optional["_SamplingProfiler"]:
+        with cls._active_lock:
+            if cls._active >= PROFILE_MAX_ACTIVE:
+                return None
+            cls._active += 1
+        profiler = cls(profile_id, PROFILE_SAMPLE_INTERVAL_MS / 1000, PROFILE_MAX_SECONDS)
+        profiler.add_current_thread("request")
+        profiler._sampler = threading.Thread(target=profiler._run, name="request-profiler", daemon=True)
+        profiler._sampler.start()
+        return profiler
+
+    def add_current_thread(self, label: Optional[str] = None) -> None:
+        with self._lock:
+            self._threads[threading.get_ident()] = label or threading.current_thread().name
+
+    @staticmethod
+    def _frame_label(code) -> str:
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _run(self) -> None:
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stop.wait(self.interval_seconds) and time.monotonic() < deadline:
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self._threads.items())
+            for ident, label in threads:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_label(frame.f_code))
+                    frame = frame.f_back
+                key = ";".join([label, *reversed(stack)])
+                with self._lock:
+                    self._counts[key] = self._counts.get(key, 0) + 1
+            self.samples += 1
+
+    def stop(self) -> str:
+        """Stop sampling, write ``<PROFILE_DIR>/<profile_id>.folded`` and return its path."""
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join(timeout=1.0)
+        with _SamplingProfiler._active_lock:
+            _SamplingProfiler._active -= 1
+        with self._lock:
+            folded = "\n".join(f"{stack} {count}" for stack, count in sorted(self._counts.items()))
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{self.profile_id}.folded")
+        with open(path, "w", encoding="utf-8") as handle:
+            handle.write(folded + "\n")
+        return path
+
+
+_current_profiler: contextvars.ContextVar[Optional[_SamplingProfiler]] = contextvars.ContextVar(
+    "current_profiler", default=None
+)
+
+
+def _start_thread(target: Callable[[], None], name: str) -> threading.Thread:
+    """Start a daemon thread that carries the caller's trace, request ID and profiler."""
+    context = contextvars.copy_context()
+
+    def run() -> None:
+        profiler = _current_profiler.get()
+        if profiler is not None:
+            profiler.add_current_thread()
+        target()
+
+    thread = threading.Thread(target=context.run, args=(run,), name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _export_trace(trace: _Trace, root_name: str, end_ns: int, attributes: Dict[str, Any]) -> None:
+    if (end_ns - trace.started_ns) / 1e6 < TRACE_EXPORT_MIN_MS:
+        return
+    root = {
+        "name": root_name,
+        "spanId": trace.root_span_id,
+        "parentSpanId": trace.remote_parent_id or "",
+        "startNs": trace.started_ns,
+        "endNs": end_ns,
+        "error": None,
+        "attributes": attributes,
+    }
+    spans = []
+    for record in [root, *trace.spans]:
+        otlp_span = {
+            "traceId": trace.trace_id,
+            "spanId": record["spanId"],
+            "parentSpanId": record["parentSpanId"],
+            "name": record["name"],
+            "kind": 2 if record is root else 1,
+            "startTimeUnixNano": str(record["startNs"]),
+            "endTimeUnixNano": str(record["endNs"]),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)}
+                for key, value in {**record["attributes"], "request.id": trace.request_id}.items()
+                if value is not None
+            ],
+            "status": {"code": 2, "message": record["error"]} if record["error"] else {"code": 1},
+        }
+        spans.append(otlp_span)
+    batch = json.dumps(
+        {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+                    "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+                }
+            ]
+        },
+        separators=(",", ":"),
+    )
+    if TRACE_EXPORT_PATH:
+        try:
+            with open(TRACE_EXPORT_PATH, "a", encoding="utf-8") as handle:
+                handle.write(batch + "\n")
+            return
+        except OSError as exc:
+            logger.warning("Failed to write trace to %s: %s", TRACE_EXPORT_PATH, exc)
+    trace_logger.info(batch)
+
+
+@contextmanager
+def _firestore_call(op: str, collection: str):
+    """Time one logical Firestore call; calls nested inside it (set -> batch commit) are not counted again."""
+    depth = getattr(_firestore_call_depth, "value", 0)
+    if depth:
+        yield
+        return
+    _firestore_call_depth.value = 1
+    try:
+        with span(f"firestore.{op}", collection=collection), _metrics.time(
+            "firestore_operation_duration_seconds",
+            {"op": op, "collection": collection},
+            counter="firestore_operations_total",
+        ):
+            yield
+    finally:
+        _firestore_call_depth.value = 0
+
+
+def _measured_stream(results: Iterable[Any], collection: str) -> Generator[Any, None, None]:
+    """Yield query results, recording one metric sample and span when the stream ends."""
+    started = time.monotonic()
+    started_ns = time.time_ns()
+    parent_id = _current_span_id.get()
+    # Query time includes paging through the results, so it is recorded when the stream ends.
+    outcome = "error"
+    error: Optional[BaseException] = None
+    count = 0
+    try:
+        for snapshot in results:
+            count += 1
+            yield _MeasuredSnapshot(snapshot, collection)
+        outcome = "ok"
+    except GeneratorExit:
+        # The caller stopped early (e.g. after enough matches); that is not a failure.
+        outcome = "ok"
+        raise
+    except BaseException as exc:
+        error = exc
+        raise
+    finally:
+        labels = {"op": "query", "collection": collection}
+        _metrics.observe("firestore_operation_duration_seconds", labels, time.monotonic() - started)
+        _metrics.inc("firestore_operations_total", {**labels, "outcome": outcome})
+        _record_span(
+            "firestore.query",
+            started_ns,
+            time.time_ns(),
+            parent_id=parent_id,
+            error=error,
+            attributes={"collection": collection, "documents": count},
+        )
+
+
+def _unwrap_firestore(value: Any) -> Any:
+    return value._target if isinstance(value, _MeasuredFirestoreObject) else value
+
+
+class _MeasuredFirestoreObject:
+    """Proxy around a Firestore client object; attributes it does not measure pass straight through."""
+
+    __slots__ = ("_target", "_collection")
+
+    def __init__(self, target: Any, collection: str = "*"):
+        self._target = target
+        self._collection = collection
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._target, name)
+
+    def __eq__(self, other: Any) -> bool:
+        return self._target == _unwrap_firestore(other)
+
+    def __hash__(self) -> int:
+        return hash(self._target)
+
+
+class _MeasuredQuery(_MeasuredFirestoreObject):
+    __slots__ = ()
+    _BUILDERS = frozenset(
+        ("where", "order_by", "limit", "limit_to_last", "offset", "select",
+         "start_at", "start_after", "end_at", "end_before")
+    )
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._target, name)
+        if name not in self._BUILDERS:
+            return attr
+
+        def build(*args, **kwargs):
+            # Cursors may be snapshots from a measured stream; the client wants its own type.
+            args = [_unwrap_firestore(arg) for arg in args]
+            return _MeasuredQuery(attr(*args, **kwargs), self._collection)
+
+        return build
+
+    def stream(self, *args, **kwargs):
+        return _measured_stream(self._target.stream(*args, **kwargs), self._collection)
+
+    def get(self, *args, **kwargs):
+        return list(self.stream(*args, **kwargs))
+
+    def count(self, *args, **kwargs) -> "_MeasuredAggregation":
+        return _MeasuredAggregation(self._target.count(*args, **kwargs), self._collection)
+
+
+class _MeasuredAggregation(_MeasuredFirestoreObject):
+    __slots__ = ()
+
+    def get(self, *args, **kwargs):
+        with _firestore_call("count", self._collection):
+            return self._target.get(*args, **kwargs)
+
+
+class _MeasuredCollection(_MeasuredQuery):
+    __slots__ = ()
+
+    def document(self, *args, **kwargs) -> "_MeasuredDocument":
+        return _MeasuredDocument(self._target.document(*args, **kwargs), self._collection)
+
+    def add(self, *args, **kwargs):
+        with _firestore_call("add", self._collection):
+            return self._target.add(*args, **kwargs)
+
+
+class _MeasuredDocument(_MeasuredFirestoreObject):
+    __slots__ = ()
+
+    def collection(self, name: str) -> _MeasuredCollection:
+        return _MeasuredCollection(self._target.collection(name), name)
+
+    def _call(self, op: str, *args, **kwargs):
+        with _firestore_call(op, self._collection):
+            return getattr(self._target, op)(*args, **kwargs)
+
+    def get(self, *args, **kwargs):
+        return _MeasuredSnapshot(self._call("get", *args, **kwargs), self._collection)
+
+    def set(self, *args, **kwargs):
+        return self._call("set", *args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        return self._call("update", *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._call("delete", *args, **kwargs)
+
+    def create(self, *args, **kwargs):
+        return self._call("create", *args, **kwargs)
+
+
+class _MeasuredSnapshot(_MeasuredFirestoreObject):
+    """Query result whose ``reference`` stays measured, so per-document follow-ups are counted."""
+
+    __slots__ = ()
+
+    @property
+    def reference(self) -> _MeasuredDocument:
+        return _MeasuredDocument(self._target.reference, self._collection)
+
+
+class _MeasuredBatch(_MeasuredFirestoreObject):
+    __slots__ = ()
+
+    def set(self, reference, *args, **kwargs):
+        return self._target.set(_unwrap_firestore(reference), *args, **kwargs)
+
+    def update(self, reference, *args, **kwargs):
+        return self._target.update(_unwrap_firestore(reference), *args, **kwargs)
+
+    def delete(self, reference, *args, **kwargs):
+        return self._target.delete(_unwrap_firestore(reference), *args, **kwargs)
+
+    def create(self, reference, *args, **kwargs):
+        return self._target.create(_unwrap_firestore(reference), *args, **kwargs)
+
+    def commit(self, *args, **kwargs):
+        with _firestore_call("batch_commit", "*"):
+            return self._target.commit(*args, **kwargs)
+
+
+class _InstrumentedFirestore(_MeasuredFirestoreObject):
+    """Wraps this app's Firestore client so every call made through ``get_db()`` is measured.
+
+    Only objects handed out by the wrapper are instrumented; other Firestore clients in
+    the process are left alone. Query results keep a measured ``reference``, so reads
+    and writes through ``snapshot.reference`` (alert responses, archiving, SOS merges)
+    are counted too.
+    """
+
+    __slots__ = ()
+
+    def collection(self, name: str) -> _MeasuredCollection:
+        return _MeasuredCollection(self._target.collection(name), name)
+
+    def batch(self) -> _MeasuredBatch:
+        return _MeasuredBatch(self._target.batch())
+
+    def get_all(self, references, *args, **kwargs):
+        references = [_unwrap_firestore(reference) for reference in references]
+        collection = references[0]._path[-2] if references and len(getattr(references[0], "_path", ())) >= 2 else "*"
+        with _firestore_call("get_all", collection):
+            # Drained inside the timer: get_all streams its results lazily.
+            return list(self._target.get_all(references, *args, **kwargs))
+
+
+class _GroqTransportStats:
+    """Counts Groq HTTP requests against new TCP connections and TLS handshakes via httpcore trace events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {
+            "requests": 0,
+            "http2Requests": 0,
+            "newConnections": 0,
+            "tlsHandshakes": 0,
+            "connectFailures": 0,
+            "clientsCreated": 0,
+            "warmups": 0,
+            "warmupFailures": 0,
+        }
+        self._tls_seconds = 0.0
+        self._tls_started: Dict[int, float] = {}
+
+    def increment(self, key: str) -> None:
+        with self._lock:
+            self._counts[key] += 1
+
+    def trace(self, event_name: str, info: Dict[str, Any]) -> None:
+        if event_name in ("http11.send_request_headers.started", "http2.send_request_headers.started"):
+            self.increment("requests")
+            if event_name.startswith("http2"):
+                self.increment("http2Requests")
+        elif event_name == "connection.connect_tcp.complete":
+            self.increment("newConnections")
+        elif event_name == "connection.connect_tcp.failed":
+            self.increment("connectFailures")
+        elif event_name == "connection.start_tls.started":
+            with self._lock:
+                self._tls_started[threading.get_ident()] = time.monotonic()
+        elif event_name == "connection.start_tls.complete":
+            with self._lock:
+                self._counts["tlsHandshakes"] += 1
+                started = self._tls_started.pop(threading.get_ident(), None)
+                if started is not None:
+                    self._tls_seconds += time.monotonic() - started
+
+    def attach(self, request: httpx.Request) -> None:
+        # httpx event hook: ask httpcore to report connection events for this request.
+        request.extensions["trace"] = self.trace
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+            tls_seconds = self._tls_seconds
+        requests = counts["requests"]
+        counts["reusedConnections"] = max(0, requests - counts["newConnections"])
+        counts["reuseRatio"] = round(counts["reusedConnections"] / requests, 3) if requests else None
+        counts["avgTlsHandshakeMs"] = (
+            round(tls_seconds * 1000 / counts["tlsHandshakes"], 1) if counts["tlsHandshakes"] else None
+        )
+        counts["config"] = {
+            "maxConnections": GROQ_POOL_MAX_CONNECTIONS,
+            "maxKeepalive": GROQ_POOL_MAX_KEEPALIVE,
+            "keepaliveExpirySeconds": GROQ_KEEPALIVE_EXPIRY_SECONDS,
+            "http2": _groq_http2_enabled(),
+        }
+        return counts
+
+
+_groq_transport_stats = _GroqTransportStats()
+
+
+def _groq_http2_enabled() -> bool:
+    # HTTP/2 needs the optional h2 package (pip install "httpx[http2]").
+    return GROQ_HTTP2 and importlib.util.find_spec("h2") is not None
+
+
 def _init_groq_client() -> None:
+    """Record whether Groq is configured; the client itself is built lazily in each worker."""
     global _groq_client, _groq_available
-    api_key = os.environ.get("GROQ_API_KEY")
-    if not api_key:
+    _groq_client = None
+    if not os.environ.get("GROQ_API_KEY"):
         logger.warning("Groq API key not found. AI features disabled.")
-        _groq_client = None
         _groq_available = False
         return
+    if GROQ_HTTP2 and not _groq_http2_enabled():
+        logger.warning("GROQ_HTTP2=1 but the h2 package is not installed; using HTTP/1.1.")
+    _groq_available = True
+    logger.info("Groq client configured (model=%s)", GROQ_DEFAULT_MODEL)
+
+
+def _build_groq_client() -> groq.Groq:
+    http_client = httpx.Client(
+        http2=_groq_http2_enabled(),
+        limits=httpx.Limits(
+            max_connections=GROQ_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=GROQ_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=GROQ_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+        timeout=httpx.Timeout(GROQ_READ_TIMEOUT_SECONDS, connect=GROQ_CONNECT_TIMEOUT_SECONDS),
+        event_hooks={"request": [_groq_transport_stats.attach]},
+    )
+    # Retries are handled by _call_groq so they respect the request deadline and breaker.
+    return groq.Groq(api_key=os.environ.get("GROQ_API_KEY"), max_retries=0, http_client=http_client)
+
 
+def _get_groq_client() -> Optional[groq.Groq]:
+    """Return this worker's Groq client, creating it (and its connection pool) on first use."""
+    global _groq_client, _groq_available
+    if _groq_client is not None or not _groq_available:
+        return _groq_client
+    with _groq_client_lock:
+        if _groq_client is None:
+            try:
+                _groq_client = _build_groq_client()
+                _groq_transport_stats.increment("clientsCreated")
+            except Exception as exc:
+                logger.error("Failed to initialise Groq client: %s", exc)
+                _groq_available = False
+    return _groq_client
+
+
+def _reset_groq_client_after_fork() -> None:
+    # A pooled socket shared with the parent would interleave bytes from two processes.
+    global _groq_client, _groq_client_lock, _groq_warmed
+    _groq_client = _groq_client_override
+    _groq_warmed = False
+    _groq_client_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_groq_client_after_fork)
+
+
+def warm_groq_client() -> bool:
+    """Open a pooled connection (TCP + TLS) to Groq before the first real request needs it."""
+    client = _get_groq_client()
+    if client is None:
+        return False
+    _groq_transport_stats.increment("warmups")
     try:
-        _groq_client = Groq(api_key=api_key)
-        _groq_available = True
-        logger.info("Groq client configured (model=%s)", GROQ_DEFAULT_MODEL)
+        client.models.list(timeout=httpx.Timeout(GROQ_CONNECT_TIMEOUT_SECONDS * 2, connect=GROQ_CONNECT_TIMEOUT_SECONDS))
     except Exception as exc:
-        logger.error("Failed to initialise Groq client: %s", exc)
-        _groq_client = None
-        _groq_available = False
+        _groq_transport_stats.increment("warmupFailures")
+        logger.warning("Groq warm-up failed: %s", exc)
+        return False
+    return True
+
+
+class GroqUnavailableError(RuntimeError):
+    """Raised when a Groq call is refused by the circuit breaker or has no deadline budget left."""
+
+
+class _CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._trips = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self, now: float) -> None:
+        if self._state == "open" and now - self._opened_at >= self.reset_seconds:
+            self._state = "half_open"
+            self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh(time.monotonic())
+            return self._state
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            self._refresh(time.monotonic())
+            if self._state == "closed":
+                return True
+            if self._state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = "closed"
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        """End a call that says nothing about the dependency's health, leaving the state alone."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == "half_open" or self._failures >= self.failure_threshold:
+                if self._state != "open":
+                    self._trips += 1
+                    logger.warning("Circuit breaker %s opened after %d failures", self.name, self._failures)
+                self._state = "open"
+                self._opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            self._refresh(now)
+            return {
+                "state": self._state,
+                "consecutiveFailures": self._failures,
+                "trips": self._trips,
+                "retryInSeconds": (
+                    round(max(0.0, self.reset_seconds - (now - self._opened_at)), 1)
+                    if self._state == "open"
+                    else 0
+                ),
+            }
+
+
+_groq_breaker = _CircuitBreaker("groq", GROQ_BREAKER_FAILURE_THRESHOLD, GROQ_BREAKER_RESET_SECONDS)
 
 
 def groq_available() -> bool:
-    return _groq_available and _groq_client is not None
+    return _groq_available and _groq_breaker.state != "open"
+
+
+def _groq_deadline() -> float:
+    """Absolute (monotonic) deadline for LLM work in the current request."""
+    if not has_request_context():
+        return time.monotonic() + GROQ_DEFAULT_DEADLINE_SECONDS
+    deadline = g.get("groq_deadline")
+    if deadline is None:
+        budget = GROQ_ROUTE_DEADLINES.get(request.endpoint or "", GROQ_DEFAULT_DEADLINE_SECONDS)
+        deadline = time.monotonic() + budget
+        g.groq_deadline = deadline
+    return deadline
+
+
+def _is_retryable_groq_error(exc: Exception) -> bool:
+    return isinstance(
+        exc,
+        (
+            groq.APITimeoutError,
+            groq.APIConnectionError,
+            groq.RateLimitError,
+            groq.InternalServerError,
+        ),
+    )
+
+
+class _ModelRouter:
+    """Tracks rolling latency and error rate per model and picks a model per feature.
+
+    Samples older than ``LLM_ROUTER_WINDOW_SECONDS`` are forgotten, so a model that
+    was passed over is tried again once its bad samples age out.
+    """
+
+    def __init__(self, window_seconds: float, min_samples: int):
+        self.window_seconds = window_seconds
+        self.min_samples = max(1, min_samples)
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = {}
+        self._choices: Dict[str, str] = {}
+
+    def record(self, model: str, latency_seconds: float, ok: bool) -> None:
+        with self._lock:
+            samples = self._samples.setdefault(model, deque(maxlen=1000))
+            samples.append((time.monotonic(), latency_seconds, ok))
+
+    def stats(self, model: str) -> Dict[str, Any]:
+        cutoff = time.monotonic() - self.window_seconds
+        with self._lock:
+            samples = self._samples.get(model)
+            while samples and samples[0][0] < cutoff:
+                samples.popleft()
+            window = list(samples or ())
+        latencies = sorted(latency for _, latency, ok in window if ok)
+
+        def percentile(fraction: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000, 1)
+
+        errors = sum(1 for _, _, ok in window if not ok)
+        return {
+            "samples": len(window),
+            "p50Ms": percentile(0.5),
+            "p95Ms": percentile(0.95),
+            "errorRate": round(errors / len(window), 3) if window else None,
+        }
+
+    def candidates(self, feature: str) -> List[str]:
+        return LLM_FEATURE_MODELS.get(feature) or [GROQ_DEFAULT_MODEL]
+
+    def _meets_slo(self, feature: str, stats: Dict[str, Any]) -> bool:
+        if stats["samples"] < self.min_samples:
+            # Not enough evidence yet; give the model the benefit of the doubt.
+            return True
+        slo_ms = LLM_FEATURE_SLO_MS.get(feature, LLM_FEATURE_SLO_MS["general"])
+        p95 = stats["p95Ms"]
+        return stats["errorRate"] <= LLM_MAX_ERROR_RATE and p95 is not None and p95 <= slo_ms
+
+    def choose(self, feature: str, *, exclude: Sequence[str] = ()) -> Optional[str]:
+        candidates = [model for model in self.candidates(feature) if model not in exclude]
+        if not candidates:
+            return None
+        ranked = [(model, self.stats(model)) for model in candidates]
+        chosen = next((model for model, stats in ranked if self._meets_slo(feature, stats)), None)
+        if chosen is None:
+            # Nobody meets the SLO: take the healthiest, then fastest, model.
+            chosen = min(
+                ranked,
+                key=lambda item: (
+                    (item[1]["errorRate"] or 0) > LLM_MAX_ERROR_RATE,
+                    item[1]["p95Ms"] if item[1]["p95Ms"] is not None else float("inf"),
+                ),
+            )[0]
+        with self._lock:
+            self._choices[feature] = chosen
+        return chosen
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            models = list(self._samples)
+            choices = dict(self._choices)
+        return {
+            "models": {model: self.stats(model) for model in models},
+            "choices": choices,
+        }
+
+
+_model_router = _ModelRouter(LLM_ROUTER_WINDOW_SECONDS, LLM_ROUTER_MIN_SAMPLES)
+
+
+def _call_groq(create_kwargs: Dict[str, Any], *, idempotent: bool = True):
+    """Create a completion within the request deadline, retrying transient failures with jitter."""
+    deadline = _groq_deadline()
+    attempts = 1 + (max(0, GROQ_MAX_RETRIES) if idempotent else 0)
+    last_error: Optional[Exception] = None
+
+    for attempt in range(attempts):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        client = _get_groq_client()
+        if client is None:
+            raise GroqUnavailableError("Groq client is not configured")
+        if not _groq_breaker.allow_request():
+            raise GroqUnavailableError("Groq circuit breaker is open")
+        attempt_started = time.monotonic()
+        try:
+            response = client.chat.completions.create(
+                timeout=httpx.Timeout(remaining, connect=min(remaining, GROQ_CONNECT_TIMEOUT_SECONDS)),
+                **create_kwargs,
+            )
+        except Exception as exc:
+            if not _is_retryable_groq_error(exc):
+                if isinstance(exc, groq.APIStatusError) and 400 <= exc.status_code < 500:
+                    # The API answered (bad request, auth, ...); that is not an availability failure.
+                    _groq_breaker.record_success()
+                else:
+                    # A local bug or an unexpected error proves nothing either way.
+                    _groq_breaker.release_probe()
+                raise
+            # Only availability and latency failures count against the model, not bad requests.
+            _model_router.record(create_kwargs.get("model", ""), time.monotonic() - attempt_started, False)
+            _groq_breaker.record_failure()
+            last_error = exc
+            logger.warning("Groq call failed (attempt %d/%d): %s", attempt + 1, attempts, exc)
+            delay = random.uniform(0, GROQ_RETRY_BASE_DELAY_SECONDS * (2 ** attempt))
+            if attempt + 1 >= attempts or time.monotonic() + delay >= deadline:
+                break
+            time.sleep(delay)
+            continue
+        _groq_breaker.record_success()
+        _model_router.record(create_kwargs.get("model", ""), time.monotonic() - attempt_started, True)
+        return response
+
+    if last_error is not None:
+        raise last_error
+    raise GroqUnavailableError("Groq deadline exceeded before the call could be made")
 
 
 def _build_messages(
@@ -121,6 +1368,85 @@ def _build_messages(
     return messages
 
 
+def _estimate_tokens(text: str) -> int:
+    """Cheap tokenizer-free estimate (~4 characters per token for English text)."""
+    return (len(text or "") + 3) // 4
+
+
+class _PromptBuilder:
+    """Assembles an analyzer prompt within the feature's token budget.
+
+    Plain text parts are always kept (long fields can be capped with ``max_tokens``).
+    List sections share whatever budget is left, in the order they were added. Within
+    a section, items are admitted by ``priority`` (lowest first) and printed in their
+    original order, with a note saying how many were left out.
+    """
+
+    def __init__(self, feature: str, budget: Optional[int] = None):
+        self.feature = feature
+        self.budget = budget if budget is not None else PROMPT_TOKEN_BUDGETS.get(feature, PROMPT_DEFAULT_TOKEN_BUDGET)
+        self._parts: List[Tuple[str, Any]] = []
+        self.stats = {"estimatedTokens": 0, "droppedItems": 0, "truncatedFields": 0}
+
+    def text(self, value: str, *, max_tokens: Optional[int] = None) -> "_PromptBuilder":
+        value = value or ""
+        if max_tokens is not None and _estimate_tokens(value) > max_tokens:
+            tail = "\n" if value.endswith("\n") else ""
+            value = value[: max_tokens * 4].rstrip() + " [truncated]" + tail
+            self.stats["truncatedFields"] += 1
+        self._parts.append(("text", value))
+        return self
+
+    def section(
+        self,
+        heading: str,
+        items: Sequence[str],
+        *,
+        priority: Optional[Callable[[int], Any]] = None,
+        max_items: Optional[int] = None,
+        separator: str = "\n",
+    ) -> "_PromptBuilder":
+        """``priority`` maps an item's index to its sort key; by default earlier items win."""
+        self._parts.append(("section", (heading, list(items), priority, max_items, separator)))
+        return self
+
+    def build(self) -> str:
+        fixed = sum(_estimate_tokens(value) for kind, value in self._parts if kind == "text")
+        remaining = self.budget - fixed
+        rendered: List[str] = []
+        for kind, value in self._parts:
+            if kind == "text":
+                rendered.append(value)
+                continue
+            heading, items, priority, max_items, separator = value
+            if not items:
+                continue
+            order = sorted(range(len(items)), key=priority) if priority else range(len(items))
+            remaining -= _estimate_tokens(heading)
+            chosen = set()
+            for index in order:
+                if max_items is not None and len(chosen) >= max_items:
+                    break
+                cost = _estimate_tokens(items[index]) + 1
+                if cost > remaining:
+                    # Cheaper lower-priority items could still fit, but keep the cut by priority.
+                    break
+                chosen.add(index)
+                remaining -= cost
+            if not chosen:
+                self.stats["droppedItems"] += len(items)
+                continue
+            lines = [items[index] for index in range(len(items)) if index in chosen]
+            omitted = len(items) - len(chosen)
+            if omitted:
+                self.stats["droppedItems"] += omitted
+                lines.append(f"(+{omitted} more omitted)")
+            rendered.append(heading + separator.join(lines) + "\n")
+        prompt = "".join(rendered)
+        self.stats["estimatedTokens"] = _estimate_tokens(prompt)
+        return prompt
+
+
 def _extract_json_payload(text: str) -> Tuple[Optional[dict], str]:
     if not text:
         return None, ""
@@ -148,10 +1474,71 @@ def _timestamp_to_ms(value: Any) -> Optional[int]:
     return None
 
 
+def _freshness_cutoff(max_age_seconds: float) -> datetime:
+    return datetime.now(timezone.utc) - timedelta(seconds=max(0.0, max_age_seconds))
+
+
 def _stable_hash(value: str) -> str:
     return hashlib.sha1(value.encode("utf-8")).hexdigest()
 
 
+class _TTLCache:
+    """Thread-safe LRU mapping whose entries also expire after ``ttl_seconds``."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, now: float) -> None:
+        while self._entries:
+            key, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            self._entries.pop(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= now:
+                self._entries.pop(key, None)
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = (now + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            self._evict(now)
+
+    def setdefault(self, key: str, value: Any) -> Tuple[bool, Any]:
+        """Store ``value`` unless a live entry exists; returns (inserted, current value)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                return False, entry[1]
+            self._entries[key] = (now + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            self._evict(now)
+            return True, value
+
+    def pop(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
 def _normalize_participant_ids(participant_ids: Sequence[str]) -> List[str]:
     normalized = []
     for participant_id in participant_ids:
@@ -179,9 +1566,9 @@ def _conversation_key(participant_ids: Sequence[str]) -> str:
 
 
 def _conversation_doc_ref(participant_ids: Sequence[str]):
-    if not db:
+    if get_db() is None:
         return None
-    return db.collection("conversations").document(_conversation_key(participant_ids))
+    return get_db().collection("conversations").document(_conversation_key(participant_ids))
 
 
 def _message_doc_payload(
@@ -255,25 +1642,62 @@ def _conversation_summary_from_snapshot(snapshot, user_id: Optional[str] = None)
     }
 
 
+class _MessageRecord:
+    """One conversation message as read from Firestore; ``to_json`` builds the API shape."""
+
+    __slots__ = (
+        "message_id", "conversation_id", "sender_id", "sender_name", "recipient_ids",
+        "text", "message_type", "timestamp_ms", "source_alert_id", "emotion",
+    )
+
+    def __init__(self, snapshot):
+        data = snapshot.to_dict() or {}
+        emotion = data.get("emotionAnalysis")
+        if isinstance(emotion, dict):
+            emotion = dict(emotion)
+            emotion["analyzedAt"] = _timestamp_to_ms(emotion.get("analyzedAt"))
+        self.message_id = snapshot.id
+        self.conversation_id = data.get("conversationId")
+        self.sender_id = data.get("senderId")
+        self.sender_name = data.get("senderName")
+        self.recipient_ids = data.get("recipientIds") or []
+        self.text = data.get("text")
+        self.message_type = data.get("messageType", "text")
+        self.timestamp_ms = _timestamp_to_ms(data.get("timestamp"))
+        self.source_alert_id = data.get("sourceAlertId")
+        self.emotion = emotion
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "id": self.message_id,
+            "messageId": self.message_id,
+            "conversationId": self.conversation_id,
+            "senderId": self.sender_id,
+            "senderName": self.sender_name,
+            "recipientIds": self.recipient_ids,
+            "text": self.text,
+            "messageType": self.message_type,
+            "timestamp": self.timestamp_ms,
+            "sourceAlertId": self.source_alert_id,
+            "emotionAnalysis": self.emotion,
+        }
+
+
 def _serialize_message_snapshot(snapshot) -> Dict[str, Any]:
-    data = snapshot.to_dict() or {}
-    emotion = data.get("emotionAnalysis")
-    if isinstance(emotion, dict):
-        emotion = dict(emotion)
-        emotion["analyzedAt"] = _timestamp_to_ms(emotion.get("analyzedAt"))
-    return {
-        "id": snapshot.id,
-        "messageId": snapshot.id,
-        "conversationId": data.get("conversationId"),
-        "senderId": data.get("senderId"),
-        "senderName": data.get("senderName"),
-        "recipientIds": data.get("recipientIds") or [],
-        "text": data.get("text"),
-        "messageType": data.get("messageType", "text"),
-        "timestamp": _timestamp_to_ms(data.get("timestamp")),
-        "sourceAlertId": data.get("sourceAlertId"),
-        "emotionAnalysis": emotion,
-    }
+    return _MessageRecord(snapshot).to_json()
+
+
+def _serialize_profile(user_data: Dict[str, Any]) -> Dict[str, Any]:
+    # /api/location stores a GeoPoint and server timestamps on the user document.
+    profile: Dict[str, Any] = {}
+    for key, value in user_data.items():
+        if isinstance(value, admin_firestore.GeoPoint):
+            profile[key] = {"latitude": value.latitude, "longitude": value.longitude}
+        elif isinstance(value, datetime):
+            profile[key] = _timestamp_to_ms(value)
+        else:
+            profile[key] = value
+    return profile
 
 
 def _serialize_emotion_analysis(analysis: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
@@ -296,9 +1720,9 @@ def _get_user_display_name(user_id: str) -> str:
 
 
 def _get_device_token_collection(user_id: str):
-    if not db:
+    if get_db() is None:
         return None
-    return db.collection("users").document(user_id).collection("deviceTokens")
+    return get_db().collection("users").document(user_id).collection("deviceTokens")
 
 
 def _normalize_token_record(token_snapshot) -> Optional[Dict[str, Any]]:
@@ -419,7 +1843,16 @@ def _send_push_notification_to_token(
         notification=messaging.Notification(**payload),
         data=message_data or None,
     )
-    response = messaging.send(message)
+    started = time.monotonic()
+    try:
+        with span("fcm.send"):
+            response = _push_sender(message)
+    except Exception as exc:
+        _metrics.inc("fcm_sends_total", {"result": "invalid_token" if _is_invalid_fcm_token_error(exc) else "error"})
+        raise
+    finally:
+        _metrics.observe("fcm_send_duration_seconds", {}, time.monotonic() - started)
+    _metrics.inc("fcm_sends_total", {"result": "success"})
     return {"token": token, "messageId": response, "success": True}
 
 
@@ -609,9 +2042,10 @@ def analyze_emotion_for_message(
         sender = entry.get("senderName") or entry.get("senderId") or "unknown"
         text = (entry.get("text") or "").strip()
         if text:
-            context_lines.append(f"- {sender}: {text}")
+            context_lines.append(f"- {sender}: {text[: PROMPT_MAX_FIELD_TOKENS * 4]}")
 
-    prompt = (
+    builder = _PromptBuilder("emotion")
+    builder.text(
         "You are a deterministic emotion classification engine for support and crisis conversations.\n"
         "Return ONLY valid JSON with these keys:\n"
         "- emotionScale: integer from 0 to 5\n"
@@ -630,10 +2064,15 @@ def analyze_emotion_for_message(
         "4 = calm, reassured, or cooperative.\n"
         "5 = very calm, stable, and grounded.\n\n"
         f"Previous scale: {prior_scale if prior_scale is not None else 'unknown'}\n"
-        f"Current message: {message_text}\n"
     )
-    if context_lines:
-        prompt += "Recent conversation context:\n" + "\n".join(context_lines) + "\n"
+    builder.text(f"Current message: {message_text}\n", max_tokens=PROMPT_MAX_FIELD_TOKENS)
+    # The most recent context matters most; older lines go first when the budget is tight.
+    builder.section(
+        "Recent conversation context:\n",
+        context_lines,
+        priority=lambda index: -index,
+    )
+    prompt = builder.build()
 
     try:
         analysis = groq_generate_chat(
@@ -644,9 +2083,13 @@ def analyze_emotion_for_message(
             temperature=GROQ_EMOTION_TEMPERATURE,
             top_p=GROQ_EMOTION_TOP_P,
             max_tokens=GROQ_EMOTION_MAX_TOKENS,
+            feature="emotion",
+            prompt_stats=builder.stats,
         )
         payload, _ = _extract_json_payload(analysis.get("content") or "")
         parsed = _parse_emotion_analysis(payload, message_text)
+        if payload:
+            parsed["model"] = analysis.get("model") or parsed["model"]
     except Exception as exc:
         logger.warning("Emotion analysis failed; falling back to heuristic analysis: %s", exc)
         parsed = _heuristic_emotion_analysis(message_text, prior_scale)
@@ -696,7 +2139,7 @@ def _ensure_conversation(
     source_alert_id: Optional[str] = None,
     conversation_type: str = "direct",
 ) -> Dict[str, Any]:
-    if not db:
+    if get_db() is None:
         raise RuntimeError("Firestore is not available")
 
     normalized = _normalize_participant_ids(participant_ids)
@@ -735,15 +2178,15 @@ def _ensure_conversation(
 
 
 def _conversation_messages_ref(conversation_id: str):
-    if not db:
+    if get_db() is None:
         return None
-    return db.collection("conversations").document(conversation_id).collection("messages")
+    return get_db().collection("conversations").document(conversation_id).collection("messages")
 
 
 def _load_conversation_snapshot(conversation_id: str):
-    if not db:
+    if get_db() is None:
         return None
-    return db.collection("conversations").document(conversation_id).get()
+    return get_db().collection("conversations").document(conversation_id).get()
 
 
 def _get_latest_conversation_message(conversation_id: str) -> Optional[Dict[str, Any]]:
@@ -785,7 +2228,7 @@ def _append_conversation_message(
     message_ref = messages_ref.document()
     message_ref.set(payload)
 
-    conversation_ref = db.collection("conversations").document(conversation_id)
+    conversation_ref = get_db().collection("conversations").document(conversation_id)
     conversation_update: Dict[str, Any] = {
         "lastMessage": text,
         "lastMessageSenderId": sender_id,
@@ -802,6 +2245,161 @@ def _append_conversation_message(
     return serialized
 
 
+class _PendingCompletion:
+    def __init__(self):
+        self.event = threading.Event()
+        self.response: Any = None
+        self.error: Optional[Exception] = None
+
+
+class _LLMGateway:
+    """Caps in-flight LLM calls, admits waiters by feature priority and coalesces identical prompts."""
+
+    def __init__(self, max_in_flight: int):
+        self.max_in_flight = max(1, max_in_flight)
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting: List[Tuple[int, int]] = []
+        self._sequence = itertools.count()
+        self._pending: Dict[str, _PendingCompletion] = {}
+        self._usage: Dict[str, Dict[str, int]] = {}
+        self._recent_calls: deque = deque(maxlen=20)
+
+    def _feature_usage(self, feature: str) -> Dict[str, int]:
+        usage = self._usage.get(feature)
+        if usage is None:
+            usage = self._usage[feature] = {
+                "calls": 0,
+                "coalesced": 0,
+                "errors": 0,
+                "queueTimeouts": 0,
+                "queueWaitMs": 0,
+                "promptTokens": 0,
+                "completionTokens": 0,
+                "estimatedPromptTokens": 0,
+                "droppedPromptItems": 0,
+                "truncatedPromptFields": 0,
+                "hedged": 0,
+                "hedgeWins": 0,
+                "hedgeCancels": 0,
+            }
+        return usage
+
+    @contextmanager
+    def slot(self, feature: str, deadline: float):
+        ticket = (LLM_FEATURE_PRIORITIES.get(feature, LLM_FEATURE_PRIORITIES["general"]), next(self._sequence))
+        started = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            while self._in_flight >= self.max_in_flight or self._waiting[0] != ticket:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._feature_usage(feature)["queueTimeouts"] += 1
+                    self._cond.notify_all()
+                    raise GroqUnavailableError("Timed out waiting for an LLM gateway slot")
+                self._cond.wait(remaining)
+            heapq.heappop(self._waiting)
+            self._in_flight += 1
+            self._feature_usage(feature)["queueWaitMs"] += int((time.monotonic() - started) * 1000)
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def record_usage(self, feature: str, usage: Any) -> None:
+        if usage is None:
+            return
+        with self._cond:
+            feature_usage = self._feature_usage(feature)
+            prompt_tokens = int(getattr(usage, "prompt_tokens", 0) or 0)
+            completion_tokens = int(getattr(usage, "completion_tokens", 0) or 0)
+            feature_usage["promptTokens"] += prompt_tokens
+            feature_usage["completionTokens"] += completion_tokens
+        _metrics.inc("groq_tokens_total", {"feature": feature, "kind": "prompt"}, prompt_tokens)
+        _metrics.inc("groq_tokens_total", {"feature": feature, "kind": "completion"}, completion_tokens)
+
+    def record_call(self, feature: str, prompt_stats: Optional[Dict[str, int]], usage: Any) -> None:
+        """Keep a per-call record of estimated versus reported prompt size and completion tokens."""
+        prompt_stats = prompt_stats or {}
+        entry = {
+            "feature": feature,
+            "estimatedPromptTokens": prompt_stats.get("estimatedTokens"),
+            "promptTokens": getattr(usage, "prompt_tokens", None),
+            "completionTokens": getattr(usage, "completion_tokens", None),
+            "droppedItems": prompt_stats.get("droppedItems", 0),
+            "truncatedFields": prompt_stats.get("truncatedFields", 0),
+        }
+        with self._cond:
+            feature_usage = self._feature_usage(feature)
+            feature_usage["estimatedPromptTokens"] += entry["estimatedPromptTokens"] or 0
+            feature_usage["droppedPromptItems"] += entry["droppedItems"]
+            feature_usage["truncatedPromptFields"] += entry["truncatedFields"]
+            self._recent_calls.append(entry)
+        logger.debug("LLM call %s", entry)
+
+    def record_event(self, feature: str, field: str) -> None:
+        with self._cond:
+            self._feature_usage(feature)[field] += 1
+
+    def complete(self, feature: str, create_kwargs: Dict[str, Any]):
+        """Run a non-streaming completion, sharing the result with identical in-flight requests."""
+        key = _stable_hash(json.dumps(create_kwargs, sort_keys=True, default=str))
+        with self._cond:
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._pending[key] = _PendingCompletion()
+
+        if not leader:
+            self.record_event(feature, "coalesced")
+            if not pending.event.wait(max(0.0, _groq_deadline() - time.monotonic())):
+                raise GroqUnavailableError("Timed out waiting for a coalesced LLM completion")
+            if pending.error is not None:
+                raise pending.error
+            return pending.response
+
+        try:
+            # The span includes time spent queued for a gateway slot.
+            with span("groq.complete", feature=feature, model=create_kwargs.get("model")), self.slot(
+                feature, _groq_deadline()
+            ):
+                self.record_event(feature, "calls")
+                with _metrics.time(
+                    "groq_request_duration_seconds",
+                    {"feature": feature, "model": create_kwargs.get("model"), "mode": "complete"},
+                    counter="groq_requests_total",
+                ):
+                    pending.response = _call_groq(create_kwargs)
+            self.record_usage(feature, getattr(pending.response, "usage", None))
+            return pending.response
+        except Exception as exc:
+            pending.error = exc
+            self.record_event(feature, "errors")
+            raise
+        finally:
+            with self._cond:
+                self._pending.pop(key, None)
+            pending.event.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "inFlight": self._in_flight,
+                "queued": len(self._waiting),
+                "maxInFlight": self.max_in_flight,
+                "features": {feature: dict(usage) for feature, usage in self._usage.items()},
+                "recentCalls": list(self._recent_calls),
+            }
+
+
+_llm_gateway = _LLMGateway(LLM_MAX_IN_FLIGHT)
+
+
 def groq_generate_chat(
     user_prompt: str,
     system_prompt: Optional[str] = None,
@@ -809,53 +2407,182 @@ def groq_generate_chat(
     temperature: Optional[float] = None,
     top_p: Optional[float] = None,
     max_tokens: Optional[int] = None,
+    *,
+    feature: str = "general",
+    prompt_stats: Optional[Dict[str, int]] = None,
+    model: Optional[str] = None,
 ) -> Dict[str, Optional[str]]:
+    """Run a non-streaming completion; ``model`` defaults to the router's choice for ``feature``."""
     if not groq_available():
         raise RuntimeError("Groq client is not configured.")
 
+    model = model or _model_router.choose(feature)
     messages = _build_messages(user_prompt, system_prompt, context_messages)
-    response = _groq_client.chat.completions.create(
-        model=GROQ_DEFAULT_MODEL,
-        messages=messages,
-        temperature=temperature if temperature is not None else GROQ_DEFAULT_TEMPERATURE,
-        top_p=top_p if top_p is not None else GROQ_DEFAULT_TOP_P,
-        max_tokens=max_tokens if max_tokens is not None else GROQ_DEFAULT_MAX_TOKENS,
-        stream=False,
+    response = _llm_gateway.complete(
+        feature,
+        {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature if temperature is not None else GROQ_DEFAULT_TEMPERATURE,
+            "top_p": top_p if top_p is not None else GROQ_DEFAULT_TOP_P,
+            "max_tokens": max_tokens if max_tokens is not None else GROQ_DEFAULT_MAX_TOKENS,
+            "stream": False,
+        },
     )
 
+    _llm_gateway.record_call(feature, prompt_stats, getattr(response, "usage", None))
     choice = response.choices[0].message if response.choices else None
     content = _normalise_content(getattr(choice, "content", None)) if choice else ""
 
     return {
         "content": content,
         "reasoning": None,
+        "model": model,
     }
 
 
+def groq_generate_chat_hedged(
+    user_prompt: str,
+    *,
+    feature: str,
+    hedge_model: Optional[str],
+    hedge_delay_seconds: float,
+    prompt_stats: Optional[Dict[str, int]] = None,
+) -> Dict[str, Optional[str]]:
+    """Send the prompt to the routed model and, if it has not answered after
+    ``hedge_delay_seconds``, race the same prompt on ``hedge_model``.
+
+    Both calls stream internally so the first successful answer wins and the other
+    one is cancelled: its HTTP response is closed, which stops generation upstream,
+    and its gateway slot is released.
+    """
+    primary = _model_router.choose(feature)
+    if not hedge_model or hedge_model == primary:
+        return groq_generate_chat(user_prompt, feature=feature, prompt_stats=prompt_stats, model=primary)
+
+    results: queue.Queue = queue.Queue()
+    deadline = _groq_deadline()
+    cancel = threading.Event()
+
+    def launch(model: str) -> None:
+        def run() -> None:
+            if has_request_context():
+                g.groq_deadline = deadline
+            stream = groq_stream_chat(user_prompt, feature=feature, model=model, prompt_stats=prompt_stats)
+            parts: List[str] = []
+            try:
+                for chunk in stream:
+                    if cancel.is_set():
+                        _llm_gateway.record_event(feature, "hedgeCancels")
+                        return
+                    parts.append(chunk["content"])
+            except Exception as exc:
+                results.put((model, None, exc))
+                return
+            finally:
+                # Closing mid-stream drops the HTTP response and releases the gateway slot.
+                stream.close()
+            results.put((model, {"content": "".join(parts).strip(), "reasoning": None, "model": model}, None))
+
+        if has_request_context():
+            run = copy_current_request_context(run)
+        _start_thread(run, f"llm-hedge-{model}")
+
+    launch(primary)
+    pending = 1
+    hedged = False
+    errors: List[Exception] = []
+    try:
+        while pending:
+            timeout = hedge_delay_seconds if not hedged else deadline - time.monotonic()
+            try:
+                model, result, error = results.get(timeout=max(0.0, timeout))
+            except queue.Empty:
+                if hedged:
+                    break
+                model = None
+            if model is not None:
+                pending -= 1
+                if error is None:
+                    if model == hedge_model:
+                        _llm_gateway.record_event(feature, "hedgeWins")
+                    return result
+                errors.append(error)
+            if not hedged and (model is None or pending == 0):
+                # The primary is slow (or already failed): race the hedge model.
+                hedged = True
+                _llm_gateway.record_event(feature, "hedged")
+                launch(hedge_model)
+                pending += 1
+    finally:
+        # Whichever call is still running lost the race (or the deadline passed).
+        cancel.set()
+
+    if errors:
+        raise errors[-1]
+    raise GroqUnavailableError("Hedged completion exceeded its deadline")
+
+
 def groq_stream_chat(
     user_prompt: str,
     system_prompt: Optional[str] = None,
     context_messages: Optional[List[Dict[str, str]]] = None,
+    *,
+    feature: str = "ask",
+    model: Optional[str] = None,
+    prompt_stats: Optional[Dict[str, int]] = None,
 ) -> Generator[Dict[str, str], None, None]:
     if not groq_available():
         raise RuntimeError("Groq client is not configured.")
 
+    model = model or _model_router.choose(feature)
     messages = _build_messages(user_prompt, system_prompt, context_messages)
-    stream = _groq_client.chat.completions.create(
-        model=GROQ_DEFAULT_MODEL,
-        messages=messages,
-        temperature=GROQ_DEFAULT_TEMPERATURE,
-        top_p=GROQ_DEFAULT_TOP_P,
-        max_tokens=GROQ_DEFAULT_MAX_TOKENS,
-        stream=True,
-    )
+    # The gateway slot is held for the whole stream; streams are never coalesced.
+    with _llm_gateway.slot(feature, _groq_deadline()):
+        _llm_gateway.record_event(feature, "calls")
+        # Streams are not replayed: a retry after partial output would duplicate text.
+        with span("groq.stream_open", feature=feature, model=model), _metrics.time(
+            "groq_request_duration_seconds",
+            {"feature": feature, "model": model, "mode": "stream"},
+            counter="groq_requests_total",
+        ):
+            stream = _call_groq(
+                {
+                    "model": model,
+                    "messages": messages,
+                    "temperature": GROQ_DEFAULT_TEMPERATURE,
+                    "top_p": GROQ_DEFAULT_TOP_P,
+                    "max_tokens": GROQ_DEFAULT_MAX_TOKENS,
+                    "stream": True,
+                },
+                idempotent=False,
+            )
 
-    for chunk in stream:
-        if not chunk.choices:
-            continue
-        delta = chunk.choices[0].delta
-        if getattr(delta, "content", None):
-            yield {"type": "content", "content": _normalise_content(delta.content)}
+        usage = None
+        try:
+            for chunk in stream:
+                # Groq reports token usage on the final chunk under x_groq.
+                chunk_usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+                if chunk_usage is not None:
+                    usage = chunk_usage
+                    _llm_gateway.record_usage(feature, usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if getattr(delta, "content", None):
+                    yield {"type": "content", "content": _normalise_content(delta.content), "model": model}
+            if prompt_stats is not None:
+                _llm_gateway.record_call(feature, prompt_stats, usage)
+        except Exception as exc:
+            _llm_gateway.record_event(feature, "errors")
+            if _is_retryable_groq_error(exc):
+                _groq_breaker.record_failure()
+            raise
+        finally:
+            # Dropping the HTTP response tells Groq to stop generating when we stop early.
+            close = getattr(stream, "close", None)
+            if callable(close):
+                close()
 
 
 def analyze_geospatial_context(
@@ -865,6 +2592,7 @@ def analyze_geospatial_context(
     if not groq_available():
         return None
 
+    neighbours = sorted(neighbours, key=lambda neighbour: neighbour.get("distance_km", float("inf")))
     neighbour_lines = []
     for idx, neighbour in enumerate(neighbours, start=1):
         neighbour_lines.append(
@@ -878,7 +2606,9 @@ def analyze_geospatial_context(
     if not neighbour_lines:
         return None
 
-    prompt = (
+    # Neighbours are sorted nearest first, so the budget drops the farthest ones.
+    builder = _PromptBuilder("geospatial")
+    builder.text(
         "You are a geospatial safety analyst. Provide JSON with keys:\n"
         "- risk_level (LOW/MEDIUM/HIGH/CRITICAL)\n"
         "- summary (1-2 sentences)\n"
@@ -886,17 +2616,23 @@ def analyze_geospatial_context(
         "- nearest_contact (string)\n"
         "- confidence (0-100)\n\n"
         f"Current user location: lat={user_location.get('latitude')}, lon={user_location.get('longitude')}\n"
-        "Nearby users:\n" + "\n".join(neighbour_lines)
     )
+    builder.section("Nearby users:\n", neighbour_lines)
+    prompt = builder.build()
 
-    analysis = groq_generate_chat(prompt)
+    try:
+        analysis = groq_generate_chat(prompt, feature="geospatial", prompt_stats=builder.stats)
+    except Exception as exc:
+        logger.warning("Geospatial analysis unavailable: %s", exc)
+        return None
     payload, raw = _extract_json_payload(analysis.get("content") or "")
     if not payload:
-        return {"summary": raw, "reasoning": ""}
+        return {"summary": raw, "reasoning": "", "model": analysis.get("model")}
     return {
         "summary": payload.get("summary") or raw,
         "reasoning": "",
         "structured": payload,
+        "model": analysis.get("model"),
     }
 
 
@@ -907,38 +2643,48 @@ def analyze_sos_message(
     if not groq_available():
         return None
 
-    neighbour_context = ""
-    if neighbours:
-        summary_parts = []
-        for neighbour in neighbours:
-            summary_parts.append(
-                f"{neighbour.get('displayName', 'Unknown')} ({neighbour.get('distance_km', '?.?')}km)"
-            )
-        if summary_parts:
-            neighbour_context = "Nearby responders: " + ", ".join(summary_parts)
+    summary_parts = [
+        f"{neighbour.get('displayName', 'Unknown')} ({neighbour.get('distance_km', '?.?')}km)"
+        for neighbour in sorted(neighbours or [], key=lambda n: n.get("distance_km", float("inf")))
+    ]
 
-    prompt = (
+    builder = _PromptBuilder("sos_analysis")
+    builder.text(
         "You are an emergency operations assistant. Return JSON with keys:\n"
         "- severity (LOW/MEDIUM/HIGH/CRITICAL)\n"
         "- confidence (0-100)\n"
         "- recommended_actions (array of short actions for responders)\n"
         "- summary (1-2 sentences)\n"
         "- tags (array of short keywords)\n\n"
-        f"Message: {sos_payload.get('message')}\n"
+    )
+    builder.text(f"Message: {sos_payload.get('message')}\n", max_tokens=PROMPT_MAX_FIELD_TOKENS)
+    builder.text(
         f"Emergency type: {sos_payload.get('emergencyType')}\n"
         f"Location: lat={sos_payload.get('latitude')}, lon={sos_payload.get('longitude')}\n"
         f"Reporter: {sos_payload.get('userId')}\n"
-        f"{neighbour_context}"
     )
+    builder.section("Nearby responders: ", summary_parts, separator=", ")
+    prompt = builder.build()
 
-    analysis = groq_generate_chat(prompt)
-    payload, raw = _extract_json_payload(analysis.get("content") or "")
-    if not payload:
-        return {"analysis": raw, "reasoning": ""}
-    return {
+    try:
+        analysis = groq_generate_chat_hedged(
+            prompt,
+            feature="sos_analysis",
+            hedge_model=SOS_HEDGE_MODEL or None,
+            hedge_delay_seconds=SOS_HEDGE_DELAY_MS / 1000,
+            prompt_stats=builder.stats,
+        )
+    except Exception as exc:
+        logger.warning("SOS analysis unavailable: %s", exc)
+        return None
+    payload, raw = _extract_json_payload(analysis.get("content") or "")
+    if not payload:
+        return {"analysis": raw, "reasoning": "", "model": analysis.get("model")}
+    return {
         "analysis": payload.get("summary") or raw,
         "reasoning": "",
         "structured": payload,
+        "model": analysis.get("model"),
     }
 
 
@@ -946,6 +2692,7 @@ def summarize_alert_feed(alerts: Iterable[Dict[str, str]]) -> Optional[str]:
     if not groq_available():
         return None
 
+    alerts = list(alerts)
     lines: List[str] = []
     for alert in alerts:
         responder_name = alert.get("senderDisplayName") or alert.get("userName") or "Unknown"
@@ -958,12 +2705,27 @@ def summarize_alert_feed(alerts: Iterable[Dict[str, str]]) -> Optional[str]:
     if not lines:
         return None
 
-    prompt = (
+    def alert_priority(index: int):
+        # Active, widely reported, then nearby alerts are the ones dispatchers must not miss.
+        alert = alerts[index]
+        return (
+            alert.get("status", "active") != "active",
+            -(alert.get("reporterCount") or 1),
+            alert.get("distance", float("inf")),
+        )
+
+    builder = _PromptBuilder("feed_summary")
+    builder.text(
         "Summarize the alerts feed for dispatchers. "
         "Return 3 bullet points and highlight urgent patterns.\n\n"
-        + "\n".join(lines)
     )
-    analysis = groq_generate_chat(prompt)
+    builder.section("", lines, priority=alert_priority)
+    prompt = builder.build()
+    try:
+        analysis = groq_generate_chat(prompt, feature="feed_summary", prompt_stats=builder.stats)
+    except Exception as exc:
+        logger.warning("Alert feed summary unavailable: %s", exc)
+        return None
     return analysis.get("content") or None
 
 
@@ -997,17 +2759,17 @@ def _initialize_firebase_app() -> firebase_admin.App:
 
 def verify_id_token(id_token: str) -> Optional[dict]:
     try:
-        return auth.verify_id_token(id_token)
+        return _token_verifier(id_token)
     except Exception as exc:
         logger.error("Error verifying Firebase ID token: %s", exc)
         return None
 
 
 def get_user_data(user_id: str) -> Optional[dict]:
-    if not db:
+    if get_db() is None:
         return None
     try:
-        doc = db.collection("users").document(user_id).get()
+        doc = get_db().collection("users").document(user_id).get()
         if doc.exists:
             return doc.to_dict()
         return None
@@ -1015,17 +2777,126 @@ def get_user_data(user_id: str) -> Optional[dict]:
         logger.error("Error fetching user data for %s: %s", user_id, exc)
         return None
 
-# Initialize external clients
-_init_groq_client()
-
+# External clients are created on first use in each process (get_db, _get_groq_client).
 db: Optional[admin_firestore.Client] = None
-try:
+_db_override: Optional[Any] = None
+_db_init_failures = 0
+_db_retry_at = 0.0
+_db_init_lock = threading.Lock()
+_backend_init_ms: Dict[str, float] = {}
+if not LOCAL_BACKENDS:
+    _init_groq_client()
+
+
+def get_db(retry: bool = False) -> Optional[admin_firestore.Client]:
+    """Return this process's Firestore client, initialising Firebase Admin on first use.
+
+    A failed initialisation is retried with exponential backoff (from
+    ``FIRESTORE_INIT_RETRY_SECONDS`` up to ``FIRESTORE_INIT_RETRY_MAX_SECONDS``) rather
+    than on every request; ``retry`` skips the wait, as the readiness probe does.
+    """
+    global db, _db_init_failures, _db_retry_at
+    if db is not None or (not retry and time.monotonic() < _db_retry_at):
+        return db
+    with _db_init_lock:
+        if db is None and (retry or time.monotonic() >= _db_retry_at):
+            started = time.monotonic()
+            try:
+                _initialize_firebase_app()
+                client = admin_firestore.client()
+                db = _InstrumentedFirestore(client) if METRICS_ENABLED or TRACING_ENABLED else client
+                _db_init_failures = 0
+                logger.info("Firebase Admin SDK initialized successfully.")
+            except Exception as exc:
+                _db_init_failures += 1
+                delay = min(
+                    FIRESTORE_INIT_RETRY_MAX_SECONDS,
+                    FIRESTORE_INIT_RETRY_SECONDS * 2 ** min(_db_init_failures - 1, 16),
+                )
+                _db_retry_at = time.monotonic() + delay
+                logger.error("Firebase Admin SDK init failed (retrying in %.0fs): %s", delay, exc)
+            finally:
+                _backend_init_ms["firestore"] = round((time.monotonic() - started) * 1000, 1)
+    return db
+
+
+def firestore_retry_after() -> int:
+    """Seconds until get_db() next tries to initialise Firestore, for Retry-After headers."""
+    return max(1, math.ceil(_db_retry_at - time.monotonic()))
+
+
+def _reset_db_after_fork() -> None:
+    # gRPC channels must not be shared with the parent; injected stand-ins are kept.
+    global db, _db_init_failures, _db_retry_at, _db_init_lock
+    db = _db_override
+    _db_init_failures = 0
+    _db_retry_at = 0.0
+    _db_init_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_db_after_fork)
+
+
+def warm_backends(retry: bool = False) -> Dict[str, Any]:
+    """Create this process's Firestore client and open a Groq connection ahead of real traffic."""
+    global _groq_warmed
+    firestore_ready = get_db(retry=retry) is not None
+    if groq_available() and not _groq_warmed:
+        started = time.monotonic()
+        _groq_warmed = warm_groq_client()
+        _backend_init_ms["groq"] = round((time.monotonic() - started) * 1000, 1)
+    return {
+        "firestore": firestore_ready,
+        "groq": groq_available() and _groq_warmed,
+        "initMs": dict(_backend_init_ms),
+    }
+
+
+def _verify_firebase_id_token(id_token: str) -> dict:
     _initialize_firebase_app()
-    db = admin_firestore.client()
-    logger.info("Firebase Admin SDK initialized successfully.")
-except Exception as exc:
-    logger.error("Firebase Admin SDK init failed: %s", exc)
-    logger.warning("Running without Firebase integration.")
+    return auth.verify_id_token(id_token)
+
+
+def _send_fcm_message(message: messaging.Message) -> str:
+    _initialize_firebase_app()
+    return messaging.send(message)
+
+
+_token_verifier: Callable[[str], dict] = _verify_firebase_id_token
+_push_sender: Callable[[messaging.Message], str] = _send_fcm_message
+
+
+def configure_backends(
+    *,
+    firestore: Optional[Any] = None,
+    groq_client: Optional[Any] = None,
+    push_sender: Optional[Callable[[messaging.Message], str]] = None,
+    token_verifier: Optional[Callable[[str], dict]] = None,
+) -> None:
+    """Swap the Firestore client, Groq client, FCM sender or ID-token verifier.
+
+    Used by local runs and benchmarks (see local_backends.py); arguments left as
+    None keep the current backend.
+    """
+    global db, _db_override, _groq_client, _groq_client_override, _groq_available, _push_sender, _token_verifier
+    if firestore is not None:
+        db = _db_override = firestore
+    if groq_client is not None:
+        with _groq_client_lock:
+            _groq_client = _groq_client_override = groq_client
+            _groq_available = True
+    if push_sender is not None:
+        _push_sender = push_sender
+    if token_verifier is not None:
+        _token_verifier = token_verifier
+    logger.info(
+        "Backends configured: firestore=%s groq=%s push=%s auth=%s",
+        type(db).__name__,
+        type(_groq_client).__name__ if _groq_client is not None else "lazy",
+        getattr(_push_sender, "__qualname__", type(_push_sender).__name__),
+        getattr(_token_verifier, "__qualname__", type(_token_verifier).__name__),
+    )
 
 # Determine environment
 ENV = os.environ.get("FLASK_ENV", "development")
@@ -1033,7 +2904,121 @@ DEBUG = ENV == "development"
 PORT = int(os.environ.get("PORT", 5001))
 ALLOWED_ORIGINS = _parse_allowed_origins(os.environ.get("ALLOWED_ORIGINS"))
 
+def _json_default(value: Any) -> Any:
+    """Encode values routes hand to jsonify that JSON has no type for; timestamps become epoch ms."""
+    if isinstance(value, datetime):
+        return _timestamp_to_ms(value)
+    if hasattr(value, "latitude") and hasattr(value, "longitude"):
+        return {"latitude": value.latitude, "longitude": value.longitude}
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return DefaultJSONProvider.default(value)
+
+
+def _finite_json(value: Any) -> Any:
+    """Copy of ``value`` with NaN and infinity replaced by None, as orjson encodes them."""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _finite_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite_json(item) for item in value]
+    return value
+
+
+def _fast_json_enabled() -> bool:
+    return JSON_FAST_ENCODER and orjson is not None
+
+
+class _AppJSONProvider(DefaultJSONProvider):
+    """jsonify/get_json backed by orjson when available, with the app's timestamp and GeoPoint encoding.
+
+    Both encoders produce the same document: sorted keys (indented in debug), UTF-8
+    rather than \\u escapes, and null for NaN and infinity. Payloads orjson rejects,
+    such as integers wider than 64 bits, and calls with stdlib-only arguments use the
+    stdlib encoder.
+    """
+
+    default = staticmethod(_json_default)
+
+    def encode(self, obj: Any, *, pretty: bool = False) -> bytes:
+        if not _fast_json_enabled():
+            return self._stdlib_encode(obj, pretty)
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if pretty:
+            options |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=_json_default, option=options)
+        except TypeError:
+            return self._stdlib_encode(obj, pretty)
+
+    def _stdlib_encode(self, obj: Any, pretty: bool) -> bytes:
+        if pretty:
+            return self._stdlib_dumps(obj, indent=2).encode("utf-8")
+        return self._stdlib_dumps(obj, separators=(",", ":")).encode("utf-8")
+
+    def _stdlib_dumps(self, obj: Any, **kwargs: Any) -> str:
+        kwargs.setdefault("ensure_ascii", False)
+        kwargs.setdefault("allow_nan", False)
+        try:
+            return super().dumps(obj, **kwargs)
+        except ValueError as exc:
+            if "Out of range float" not in str(exc):
+                raise
+        # Rare: only payloads that contain NaN or infinity pay for the copy.
+        kwargs["default"] = lambda value: _finite_json(_json_default(value))
+        return super().dumps(_finite_json(obj), **kwargs)
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs:
+            return self._stdlib_dumps(obj, **kwargs)
+        return self.encode(obj).decode("utf-8")
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        if kwargs or not _fast_json_enabled():
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        if not _fast_json_enabled():
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = self.compact is False or (self.compact is None and self._app.debug)
+        return self._app.response_class(self.encode(obj, pretty=pretty) + b"\n", mimetype=self.mimetype)
+
+
 app = Flask(__name__)
+app.json = _AppJSONProvider(app)
+
+
+def _wants_ndjson() -> bool:
+    """True when the client asked for newline-delimited JSON (Accept header or ``?format=ndjson``)."""
+    if request.args.get("format") == "ndjson":
+        return True
+    return request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def _ndjson_response(items: Iterable[Any], meta: Optional[Callable[[], Dict[str, Any]]] = None) -> Response:
+    """Stream ``items`` as one JSON document per line, encoding each as it is produced.
+
+    ``meta`` is called after the last item and its result is sent as a final
+    ``{"meta": ...}`` line. A failure part-way through ends the stream with an
+    ``{"error": ...}`` line, since the status code has already been sent.
+    """
+
+    def generate() -> Generator[bytes, None, None]:
+        try:
+            for item in items:
+                yield app.json.encode(item) + b"\n"
+            if meta is not None:
+                yield app.json.encode({"meta": meta()}) + b"\n"
+        except Exception as exc:
+            logger.error("NDJSON stream for %s failed: %s", request.path, exc)
+            yield app.json.encode({"error": "Stream interrupted"}) + b"\n"
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE, headers={"X-Accel-Buffering": "no"})
 
 if ALLOWED_ORIGINS:
     logger.info("Configuring CORS for allowed origins: %s", ", ".join(ALLOWED_ORIGINS))
@@ -1120,6 +3105,644 @@ def build_context_messages(user_profile: Optional[Dict]) -> List[Dict[str, str]]
     ]
 
 
+def _chat_memory_ref(user_id: str):
+    if get_db() is None:
+        return None
+    return get_db().collection("users").document(user_id).collection("chatMemory").document("summary")
+
+
+def _summarize_chat_turns(previous_summary: str, turns: Sequence[Dict[str, Any]]) -> str:
+    lines = []
+    for turn in turns:
+        lines.append(f"User: {turn['question']}")
+        lines.append(f"Assistant: {turn['response']}")
+    prompt = (
+        "Update the running summary of an emergency-assistance chat. Keep facts the assistant "
+        "needs later: the user's situation, location hints, injuries, people involved, actions "
+        "already taken and open concerns. Reply with the updated summary only, under 150 words.\n\n"
+        f"Current summary: {previous_summary or '(none)'}\n\n"
+        "New turns:\n" + "\n".join(lines)
+    )
+    result = groq_generate_chat(
+        prompt,
+        temperature=0,
+        max_tokens=ASK_SUMMARY_MAX_TOKENS,
+        feature="chat_summary",
+    )
+    return (result.get("content") or "").strip() or previous_summary
+
+
+def load_chat_memory(user_id: str) -> Dict[str, Any]:
+    """Return the rolling summary plus the recent turns to replay for ``user_id``.
+
+    Only the newest ``ASK_HISTORY_TURNS + ASK_SUMMARY_BATCH_TURNS`` chats newer than the
+    summary cursor are read. No LLM call happens here: older turns are folded into the
+    summary in the background by ``summarize_pending_chats``.
+    """
+    memory: Dict[str, Any] = {"summary": "", "turns": []}
+    memory_ref = _chat_memory_ref(user_id)
+    if memory_ref is None:
+        return memory
+
+    try:
+        memory_data = memory_ref.get().to_dict() or {}
+        chat_docs = list(
+            get_db().collection("users")
+            .document(user_id)
+            .collection("chats")
+            .order_by("timestamp", direction=admin_firestore.Query.DESCENDING)
+            .limit(ASK_HISTORY_TURNS + ASK_SUMMARY_BATCH_TURNS)
+            .stream()
+        )
+    except Exception as exc:
+        logger.warning("Failed to load chat memory for %s: %s", user_id, exc)
+        return memory
+
+    watermark = memory_data.get("summarizedThrough")
+    turns = []
+    for chat_doc in reversed(chat_docs):
+        chat_data = chat_doc.to_dict() or {}
+        timestamp = chat_data.get("timestamp")
+        if watermark is not None and timestamp is not None and timestamp <= watermark:
+            continue
+        if chat_data.get("question") and chat_data.get("response"):
+            turns.append({"question": chat_data["question"], "response": chat_data["response"]})
+
+    memory["summary"] = memory_data.get("summary") or ""
+    memory["turns"] = turns
+    return memory
+
+
+def summarize_pending_chats(user_id: str) -> int:
+    """Fold turns older than the replay window into the summary; returns the turns folded.
+
+    Reads forward from the ``summarizedThrough`` cursor, so turns are never skipped when an
+    earlier attempt failed, and advances the cursor after every ``ASK_SUMMARY_BATCH_TURNS``.
+    """
+    memory_ref = _chat_memory_ref(user_id)
+    if memory_ref is None or not groq_available():
+        return 0
+    batch_turns = max(1, ASK_SUMMARY_BATCH_TURNS)
+    window = max(0, ASK_HISTORY_TURNS) + batch_turns
+    memory_data = memory_ref.get().to_dict() or {}
+    summary = memory_data.get("summary") or ""
+    cursor = memory_data.get("summarizedThrough")
+    summarized_turns = int(memory_data.get("summarizedTurns") or 0)
+    folded = 0
+    while True:
+        query = get_db().collection("users").document(user_id).collection("chats")
+        if cursor is not None:
+            query = query.where("timestamp", ">", cursor)
+        chat_docs = list(
+            query.order_by("timestamp", direction=admin_firestore.Query.ASCENDING).limit(window).stream()
+        )
+        # Fewer than a full window: everything left still fits in the replayed turns.
+        if len(chat_docs) < window:
+            return folded
+        batch = [chat_doc.to_dict() or {} for chat_doc in chat_docs[:batch_turns]]
+        turns = [chat for chat in batch if chat.get("question") and chat.get("response")]
+        if turns:
+            summary = _summarize_chat_turns(summary, turns)
+        cursor = batch[-1].get("timestamp")
+        summarized_turns += len(turns)
+        memory_ref.set(
+            {
+                "summary": summary,
+                "summarizedThrough": cursor,
+                "summarizedTurns": summarized_turns,
+                "updatedAt": admin_firestore.SERVER_TIMESTAMP,
+            },
+            merge=True,
+        )
+        folded += len(turns)
+
+
+def build_memory_messages(
+    memory: Dict[str, Any],
+    question: str,
+    base_messages: Sequence[Dict[str, str]],
+) -> List[Dict[str, str]]:
+    """Assemble context messages that fit ``ASK_CONTEXT_TOKEN_BUDGET``, dropping the oldest turns first."""
+    used = _estimate_tokens(HEALTH_EXPERT_PROMPT) + _estimate_tokens(question)
+    used += sum(_estimate_tokens(message["content"]) for message in base_messages)
+
+    summary = memory.get("summary") or ""
+    summary_tokens = _estimate_tokens(summary)
+    if summary and used + summary_tokens > ASK_CONTEXT_TOKEN_BUDGET:
+        remaining = max(0, ASK_CONTEXT_TOKEN_BUDGET - used)
+        summary = summary[-remaining * 4 :] if remaining else ""
+        summary_tokens = _estimate_tokens(summary)
+    used += summary_tokens
+
+    kept_turns: List[List[Dict[str, str]]] = []
+    for turn in reversed(memory.get("turns") or []):
+        turn_messages = [
+            {"role": "user", "content": turn["question"]},
+            {"role": "assistant", "content": turn["response"]},
+        ]
+        turn_tokens = sum(_estimate_tokens(message["content"]) for message in turn_messages)
+        if used + turn_tokens > ASK_CONTEXT_TOKEN_BUDGET:
+            break
+        used += turn_tokens
+        kept_turns.append(turn_messages)
+
+    messages = list(base_messages)
+    if summary:
+        messages.append({"role": "system", "content": "Summary of the earlier conversation:\n" + summary})
+    for turn_messages in reversed(kept_turns):
+        messages.extend(turn_messages)
+    return messages
+
+
+_MINHASH_PRIME = (1 << 61) - 1
+_MINHASH_BANDS = 16
+_MINHASH_ROWS = 4
+_minhash_rng = random.Random(20240611)
+_MINHASH_PARAMS = [
+    (_minhash_rng.randrange(1, _MINHASH_PRIME), _minhash_rng.randrange(0, _MINHASH_PRIME))
+    for _ in range(_MINHASH_BANDS * _MINHASH_ROWS)
+]
+
+
+def _normalize_question(question: str) -> str:
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", (question or "").lower()).split())
+
+
+_QUESTION_STOP_WORDS = frozenset(
+    "a an the i im my me we our you your he she him her his it its they them their "
+    "is are was were be been am do does did to of in on at for with from by and or if so "
+    "what whats how should can could would will when where why who which that this there "
+    "these those please".split()
+)
+# "don't" normalises to "don t", so the stems and the bare "t" count as negations too.
+_NEGATION_WORDS = frozenset(
+    "no not never none nothing nobody nor neither without cannot cant dont doesnt didnt "
+    "isnt arent wasnt werent wont shouldnt couldnt wouldnt don doesn didn isn aren wasn "
+    "weren won shouldn couldn wouldn t".split()
+)
+
+
+def _question_terms(normalized: str) -> Tuple[frozenset, frozenset]:
+    """(content words, negation words) of a normalised question."""
+    words = frozenset(normalized.split())
+    negations = words & _NEGATION_WORDS
+    return words - _QUESTION_STOP_WORDS - negations, negations
+
+
+def _question_shingles(normalized: str, width: int = 4) -> frozenset:
+    padded = f" {normalized} "
+    if len(padded) <= width:
+        return frozenset([padded])
+    return frozenset(padded[i : i + width] for i in range(len(padded) - width + 1))
+
+
+def _minhash_signature(shingles: frozenset) -> Tuple[int, ...]:
+    hashes = [
+        int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for shingle in shingles
+    ]
+    return tuple(min((a * value + b) % _MINHASH_PRIME for value in hashes) for a, b in _MINHASH_PARAMS)
+
+
+class _AskResponseCache:
+    """TTL/LRU cache of /ask answers keyed on normalised question text.
+
+    An optional second tier finds near-duplicate questions with MinHash LSH over
+    character shingles and confirms them with the exact Jaccard similarity. Shingles
+    alone cannot tell "infant" from "adult" or "bleeding" from "not bleeding", so a
+    similar hit also needs the same content words and negations as the question.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, similarity_threshold: float):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._bands: Dict[Tuple[int, Tuple[int, ...]], set] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "exactHits": 0,
+            "similarHits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "savedMs": 0,
+        }
+
+    def _band_keys(self, signature: Tuple[int, ...]):
+        for band in range(_MINHASH_BANDS):
+            yield band, signature[band * _MINHASH_ROWS : (band + 1) * _MINHASH_ROWS]
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None or entry.get("signature") is None:
+            return
+        for band_key in self._band_keys(entry["signature"]):
+            bucket = self._bands.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    self._bands.pop(band_key, None)
+
+    def _live(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry["expiresAt"] <= now:
+            self._remove(key)
+            self._stats["evictions"] += 1
+            return None
+        return entry
+
+    def _hit(self, key: str, entry: Dict[str, Any], tier: str) -> Dict[str, Any]:
+        self._entries.move_to_end(key)
+        self._stats[tier] += 1
+        self._stats["savedMs"] += entry["latencyMs"]
+        return entry
+
+    def lookup(self, question: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        normalized = _normalize_question(question)
+        if not normalized:
+            return None, None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._live(normalized, now)
+            if entry is not None:
+                return self._hit(normalized, entry, "exactHits"), "exact"
+
+            if self.similarity_threshold > 0:
+                shingles = _question_shingles(normalized)
+                terms = _question_terms(normalized)
+                candidates = set()
+                for band_key in self._band_keys(_minhash_signature(shingles)):
+                    candidates.update(self._bands.get(band_key, ()))
+                best_key, best_score = None, 0.0
+                for candidate in candidates:
+                    candidate_entry = self._live(candidate, now)
+                    if candidate_entry is None or candidate_entry["terms"] != terms:
+                        continue
+                    other = candidate_entry["shingles"]
+                    score = len(shingles & other) / len(shingles | other)
+                    if score > best_score:
+                        best_key, best_score = candidate, score
+                if best_key is not None and best_score >= self.similarity_threshold:
+                    return self._hit(best_key, self._entries[best_key], "similarHits"), "similar"
+
+            self._stats["misses"] += 1
+            return None, None
+
+    def store(self, question: str, answer: str, *, model: str, latency_ms: int) -> None:
+        normalized = _normalize_question(question)
+        if not normalized or not answer:
+            return
+        shingles = _question_shingles(normalized)
+        signature = _minhash_signature(shingles) if self.similarity_threshold > 0 else None
+        with self._lock:
+            self._remove(normalized)
+            self._entries[normalized] = {
+                "answer": answer,
+                "model": model,
+                "latencyMs": latency_ms,
+                "shingles": shingles,
+                "terms": _question_terms(normalized),
+                "signature": signature,
+                "expiresAt": time.monotonic() + self.ttl_seconds,
+            }
+            if signature is not None:
+                for band_key in self._band_keys(signature):
+                    self._bands.setdefault(band_key, set()).add(normalized)
+            self._stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self._stats["exactHits"] + self._stats["similarHits"]
+            lookups = hits + self._stats["misses"]
+            return {
+                "enabled": ASK_CACHE_ENABLED,
+                "entries": len(self._entries),
+                **self._stats,
+                "hitRate": round(hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_ask_cache = _AskResponseCache(ASK_CACHE_MAX_ENTRIES, ASK_CACHE_TTL_SECONDS, ASK_CACHE_SIMILARITY_THRESHOLD)
+
+
+def _lookup_cached_answer(question: str) -> Optional[Dict[str, Any]]:
+    if not ASK_CACHE_ENABLED:
+        return None
+    entry, tier = _ask_cache.lookup(question)
+    if entry is None:
+        return None
+    return {"answer": entry["answer"], "model": entry["model"], "tier": tier}
+
+
+def _store_cached_answer(question: str, answer: str, *, started: float, model: Optional[str] = None) -> None:
+    if ASK_CACHE_ENABLED:
+        _ask_cache.store(
+            question,
+            answer,
+            model=model or AI_MODEL_NAME,
+            latency_ms=int((time.monotonic() - started) * 1000),
+        )
+
+
+# Words that point back at earlier turns ("is it broken?", "what about him?").
+_FOLLOW_UP_WORDS = frozenset(
+    "it its that this these those they them their he him his she her again also else more "
+    "still same above earlier before previous last then there".split()
+)
+
+
+def _is_context_free_question(question: str) -> bool:
+    """Whether the answer can be shared: a self-contained question that does not refer to earlier turns."""
+    words = _normalize_question(question).split()
+    if len(words) < 3 or words[0] in ("and", "but", "so", "ok", "okay"):
+        return False
+    return not _FOLLOW_UP_WORDS.intersection(words)
+
+
+def _ask_profile_messages(shared: bool) -> List[Dict[str, str]]:
+    """Profile context for an /ask prompt; none when the answer goes into the shared cache."""
+    # Cached answers are served to every user, so they must not mention the asker.
+    if shared and ASK_CACHE_ENABLED:
+        return []
+    return build_context_messages(getattr(request, "user", {}) or {})
+
+
+def _replay_chunks(text: str, size: int = 48) -> Generator[str, None, None]:
+    """Split a cached answer into word-aligned chunks so it streams like a live completion."""
+    buffer = ""
+    for word in re.split(r"(\s+)", text):
+        buffer += word
+        if len(buffer) >= size:
+            yield buffer
+            buffer = ""
+    if buffer:
+        yield buffer
+
+
+_SSE_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+_SSE_DONE = object()
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def _sse_event(data: str) -> str:
+    """Frame ``data`` as one SSE event; every line of the payload gets its own ``data:`` field."""
+    return "".join(f"data: {line}\n" for line in _SSE_LINE_BREAK.split(data)) + "\n"
+
+
+def _sse_frames(
+    source: Callable[[], Iterator[str]],
+    *,
+    coalesce_seconds: float = SSE_COALESCE_SECONDS,
+    max_bytes: int = SSE_COALESCE_MAX_BYTES,
+    heartbeat_seconds: float = SSE_HEARTBEAT_SECONDS,
+) -> Generator[str, None, None]:
+    """Turn the text deltas produced by ``source`` into coalesced SSE frames.
+
+    ``source`` is consumed on a helper thread through a bounded queue. The first
+    delta is sent at once; later deltas are buffered until ``coalesce_seconds``
+    have passed or ``max_bytes`` are waiting. A comment heartbeat is sent when
+    nothing has been written for ``heartbeat_seconds``. Closing the generator
+    (client disconnect) stops the helper, which closes ``source`` and with it
+    the upstream request. Exceptions raised by ``source`` are re-raised here.
+    """
+    chunks: queue.Queue = queue.Queue(maxsize=SSE_BUFFER_CHUNKS)
+    stop = threading.Event()
+
+    def offer(item: Any) -> bool:
+        # Blocks while the client is slower than the model, but gives up once the consumer is gone.
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.25)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        iterator = source()
+        try:
+            for delta in iterator:
+                if not offer(delta):
+                    break
+        except Exception as exc:
+            offer(exc)
+        finally:
+            close = getattr(iterator, "close", None)
+            if callable(close):
+                close()
+            offer(_SSE_DONE)
+
+    if has_request_context():
+        # The helper thread still needs ``request``/``g`` (deadlines, gateway slots).
+        produce = copy_current_request_context(produce)
+    producer = _start_thread(produce, "sse-producer")
+
+    pending: List[str] = []
+    pending_bytes = 0
+    flush_at: Optional[float] = None
+    last_write = time.monotonic()
+    first = True
+    _metrics.inc("sse_streams_active", {})
+    try:
+        while True:
+            now = time.monotonic()
+            wake_at = last_write + heartbeat_seconds
+            if flush_at is not None:
+                wake_at = min(wake_at, flush_at)
+            try:
+                item = chunks.get(timeout=max(0.0, wake_at - now))
+            except queue.Empty:
+                item = None
+
+            if item is _SSE_DONE or isinstance(item, Exception):
+                if pending:
+                    yield _sse_event("".join(pending))
+                if item is _SSE_DONE:
+                    return
+                raise item
+
+            if item is not None:
+                pending.append(item)
+                pending_bytes += len(item.encode("utf-8"))
+                if flush_at is None:
+                    flush_at = time.monotonic() + coalesce_seconds
+
+            now = time.monotonic()
+            if pending and (first or pending_bytes >= max_bytes or now >= flush_at):
+                yield _sse_event("".join(pending))
+                pending, pending_bytes, flush_at = [], 0, None
+                last_write = now
+                first = False
+            elif not pending and now - last_write >= heartbeat_seconds:
+                yield ": keep-alive\n\n"
+                last_write = now
+    finally:
+        _metrics.inc("sse_streams_active", {}, -1.0)
+        stop.set()
+        # Free queue slots in case the producer is mid-put; it sees ``stop`` on its next try.
+        while True:
+            try:
+                chunks.get_nowait()
+            except queue.Empty:
+                break
+        producer.join(timeout=1.0)
+
+
+class _ChatHistoryWriter:
+    """Background writer that commits chat entries for all users in Firestore batches.
+
+    Entries are flushed every ``CHAT_WRITE_FLUSH_SECONDS`` or as soon as
+    ``CHAT_WRITE_BATCH_SIZE`` are queued, and drained on interpreter shutdown. Every
+    ``summary_every`` stored turns a user's chat summary is brought up to date on the
+    same thread, so /ask never waits for the summarization call.
+    """
+
+    def __init__(self, flush_seconds: float, batch_size: int, max_queue: int, summary_every: int):
+        self.flush_seconds = flush_seconds
+        # One Firestore batch holds at most 500 writes.
+        self.batch_size = max(1, min(batch_size, 500))
+        self.max_queue = max_queue
+        self.summary_every = max(1, summary_every)
+        self._unsummarized: Dict[str, int] = {}
+        self._summaries: "OrderedDict[str, None]" = OrderedDict()
+        self._queue: deque = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._closed = False
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "batches": 0,
+            "dropped": 0,
+            "failed": 0,
+            "summaries": 0,
+            "summaryFailures": 0,
+        }
+
+    def _ensure_thread(self) -> None:
+        # Threads do not survive fork, so each worker process starts its own.
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="chat-history-writer", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, user_id: str, payload: Dict[str, Any]) -> bool:
+        with self._cond:
+            if self._closed or len(self._queue) >= self.max_queue:
+                self._stats["dropped"] += 1
+                logger.warning("Chat history buffer full; dropping entry for %s", user_id)
+                return False
+            self._queue.append((user_id, payload, current_request_id()))
+            self._stats["enqueued"] += 1
+            self._ensure_thread()
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    def _take_batch(self) -> List[Tuple[str, Dict[str, Any], Optional[str]]]:
+        entries = []
+        while self._queue and len(entries) < self.batch_size:
+            entries.append(self._queue.popleft())
+        return entries
+
+    def _commit(self, entries: List[Tuple[str, Dict[str, Any], Optional[str]]]) -> None:
+        if not entries:
+            return
+        try:
+            batch = get_db().batch()
+            for user_id, payload, _ in entries:
+                chat_ref = get_db().collection("users").document(user_id).collection("chats").document()
+                batch.set(chat_ref, payload)
+            batch.commit()
+        except Exception as exc:
+            logger.warning(
+                "Failed to store %d chat history entries (requests %s): %s",
+                len(entries),
+                ", ".join(request_id or "-" for _, _, request_id in entries),
+                exc,
+            )
+            with self._cond:
+                self._stats["failed"] += len(entries)
+            return
+        with self._cond:
+            self._stats["written"] += len(entries)
+            self._stats["batches"] += 1
+        self.note_written(user_id for user_id, _, _ in entries)
+
+    def note_written(self, user_ids: Iterable[str]) -> None:
+        """Count stored turns per user and schedule a summary once ``summary_every`` have piled up."""
+        with self._cond:
+            for user_id in user_ids:
+                count = self._unsummarized.get(user_id, 0) + 1
+                if count < self.summary_every:
+                    self._unsummarized[user_id] = count
+                    continue
+                self._unsummarized.pop(user_id, None)
+                self._summaries[user_id] = None
+            if self._summaries and not self._closed:
+                self._ensure_thread()
+                self._cond.notify()
+
+    def _summarize(self, user_ids: List[str]) -> None:
+        for user_id in user_ids:
+            try:
+                summarize_pending_chats(user_id)
+            except Exception as exc:
+                # The cursor only moves after a stored summary, so the next attempt picks these turns up.
+                logger.warning("Failed to update chat summary for %s: %s", user_id, exc)
+                with self._cond:
+                    self._stats["summaryFailures"] += 1
+                continue
+            with self._cond:
+                self._stats["summaries"] += 1
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if len(self._queue) < self.batch_size and not self._summaries and not self._closed:
+                    self._cond.wait(self.flush_seconds)
+                entries = self._take_batch()
+                if not entries and self._closed:
+                    return
+                summaries = list(self._summaries)
+                self._summaries.clear()
+            self._commit(entries)
+            self._summarize(summaries)
+
+    def flush(self) -> None:
+        """Synchronously write everything queued so far."""
+        while True:
+            with self._cond:
+                entries = self._take_batch()
+            if not entries:
+                return
+            self._commit(entries)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self.flush()
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._cond:
+            return {"queued": len(self._queue), **self._stats}
+
+
+_chat_writer = _ChatHistoryWriter(
+    CHAT_WRITE_FLUSH_SECONDS, CHAT_WRITE_BATCH_SIZE, CHAT_WRITE_QUEUE_MAX, ASK_SUMMARY_BATCH_TURNS
+)
+atexit.register(_chat_writer.close)
+
+
 def persist_chat_entry(
     user_id: str,
     question: str,
@@ -1128,41 +3751,597 @@ def persist_chat_entry(
     model: Optional[str] = None,
     reasoning: Optional[str] = None,
 ) -> None:
-    if not answer or not db:
+    if not answer or get_db() is None:
         return
+    payload = {
+        "question": question,
+        "response": answer,
+        # Stamped when the answer is produced so batched entries keep their order.
+        "timestamp": datetime.now(timezone.utc),
+        "model": model or AI_MODEL_NAME,
+    }
+    if reasoning:
+        payload["reasoning"] = reasoning
+
+    if CHAT_WRITE_BUFFER_ENABLED:
+        _chat_writer.enqueue(user_id, payload)
+        return
+
     try:
-        chat_ref = (
-            db.collection("users")
-            .document(user_id)
-            .collection("chats")
-        )
-        payload = {
-            "question": question,
-            "response": answer,
-            "timestamp": admin_firestore.SERVER_TIMESTAMP,
-            "model": model or AI_MODEL_NAME,
-        }
-        if reasoning:
-            payload["reasoning"] = reasoning
-        chat_ref.add(payload)
+        get_db().collection("users").document(user_id).collection("chats").add(payload)
     except Exception as persist_error:
         logger.warning("Failed to store chat history for %s: %s", user_id, persist_error)
+        return
+    _chat_writer.note_written([user_id])
+
+
+class _NearbyUser:
+    """A candidate neighbour ranked by get_nearest_neighbors; only the returned ones become dicts."""
+
+    __slots__ = (
+        "user_id", "display_name", "latitude", "longitude", "distance_km",
+        "last_updated", "accuracy", "email", "truncated",
+    )
+
+    def __init__(
+        self,
+        user_id: str,
+        display_name: str,
+        latitude: float,
+        longitude: float,
+        distance_km: float,
+        last_updated: Optional[float],
+        accuracy: Any,
+        email: Optional[str],
+        truncated: bool = False,
+    ):
+        self.user_id = user_id
+        self.display_name = display_name
+        self.latitude = latitude
+        self.longitude = longitude
+        self.distance_km = distance_km
+        self.last_updated = last_updated
+        self.accuracy = accuracy
+        self.email = email
+        self.truncated = truncated
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "userId": self.user_id,
+            "displayName": self.display_name,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "distance_km": self.distance_km,
+            "lastUpdated": self.last_updated,
+            "accuracy": self.accuracy,
+            "email": self.email,
+        }
+
+
+_LOCATION_INDEX_MAGIC = b"GALOCIX1"
+_LOCATION_INDEX_VERSION = 1
+# magic, version, capacity, count, writer pid, sequence, watermark, heartbeat; padded to 64 bytes.
+_LOCATION_INDEX_HEADER = struct.Struct("<8sIIIIQdd")
+_LOCATION_INDEX_HEADER_SIZE = 64
+_LOCATION_INDEX_SEQ_OFFSET = 24
+_LOCATION_INDEX_COUNT_OFFSET = 16
+_LOCATION_INDEX_WATERMARK_OFFSET = 32
+_LOCATION_INDEX_HEARTBEAT_OFFSET = 40
+# Struct-of-arrays columns: (name, struct code, bytes per slot). Text columns are fixed-width UTF-8.
+_LOCATION_INDEX_COLUMNS = (
+    ("lat", "d", 8),
+    ("lng", "d", 8),
+    ("ts", "d", 8),
+    ("accuracy", "f", 4),
+    ("flags", "B", 1),
+    ("uid", "s", 40),
+    ("name", "s", 48),
+    ("email", "s", 64),
+)
+_LOCATION_INDEX_SPECS = {name: (code, width) for name, code, width in _LOCATION_INDEX_COLUMNS}
+# Set when displayName or email did not fit; readers fetch that user's location document instead.
+_LOCATION_FLAG_TRUNCATED = 1
+_LOCATION_SNAPSHOT_MAGIC = b"GALOCSN1"
+# magic, version, rows, crc32 of the columns, reserved, watermark, written at; columns follow, sized to rows.
+_LOCATION_SNAPSHOT_HEADER = struct.Struct("<8sIIIIdd")
+
+
+def _location_index_layout(capacity: int) -> Tuple[Dict[str, int], int]:
+    offsets: Dict[str, int] = {}
+    position = _LOCATION_INDEX_HEADER_SIZE
+    for name, _, width in _LOCATION_INDEX_COLUMNS:
+        offsets[name] = position
+        position += width * capacity
+    return offsets, position
+
+
+def _location_index_record(data: Dict[str, Any]) -> Optional[Tuple[float, float, float, float, str, str]]:
+    try:
+        lat = float(data.get("latitude"))
+        lng = float(data.get("longitude"))
+    except (TypeError, ValueError):
+        return None
+    timestamp = data.get("timestamp")
+    if not hasattr(timestamp, "timestamp"):
+        return None
+    try:
+        accuracy = float(data.get("accuracy"))
+    except (TypeError, ValueError):
+        accuracy = math.nan
+    return lat, lng, timestamp.timestamp(), accuracy, data.get("displayName") or "", data.get("email") or ""
+
+
+class _LocationIndexWriter:
+    """Single writer of the shared location table.
+
+    Rows live in fixed slots of a memory-mapped file laid out as parallel columns.
+    Every batch of changes is bracketed by a sequence counter that is odd while a
+    write is in progress (a seqlock), so readers in other processes never lock:
+    they copy what they need and retry if the counter moved.
+    """
+
+    def __init__(self, path: str, capacity: int):
+        import fcntl
+
+        self.capacity = capacity
+        self.offsets, size = _location_index_layout(capacity)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self._fd)
+            raise RuntimeError(f"Another process already owns the location index at {path}")
+        # Never shrink the file: workers may still hold a mapping of a larger table, and
+        # touching pages past the new end would kill them with SIGBUS.
+        os.ftruncate(self._fd, max(size, os.fstat(self._fd).st_size))
+        self._mm = mmap.mmap(self._fd, size)
+        self._slots: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._count = 0
+        self._seq = 0
+        self.watermark = 0.0
+        self._mm[:_LOCATION_INDEX_HEADER_SIZE] = bytes(_LOCATION_INDEX_HEADER_SIZE)
+        _LOCATION_INDEX_HEADER.pack_into(
+            self._mm, 0, _LOCATION_INDEX_MAGIC, _LOCATION_INDEX_VERSION, capacity, 0, os.getpid(), 0, 0.0, 0.0
+        )
+
+    def _put(self, column: str, slot: int, value: Any) -> None:
+        code, width = _LOCATION_INDEX_SPECS[column]
+        offset = self.offsets[column] + slot * width
+        if code == "s":
+            encoded = value.encode("utf-8")[:width]
+            self._mm[offset:offset + width] = encoded.ljust(width, b"\0")
+        else:
+            struct.pack_into("<" + code, self._mm, offset, value)
+
+    def _fits(self, value: str, column: str) -> bool:
+        return len(value.encode("utf-8")) <= _LOCATION_INDEX_SPECS[column][1]
+
+    def apply(self, upserts: Sequence[Tuple[str, Dict[str, Any]]] = (), removals: Sequence[str] = ()) -> int:
+        """Write a batch of location documents (uid, data) and deletions; returns rows changed."""
+        changed = 0
+        self._seq += 1
+        struct.pack_into("<Q", self._mm, _LOCATION_INDEX_SEQ_OFFSET, self._seq)
+        try:
+            for uid in removals:
+                slot = self._slots.pop(uid, None)
+                if slot is not None:
+                    self._put("ts", slot, 0.0)
+                    self._free.append(slot)
+                    changed += 1
+            for uid, data in upserts:
+                record = _location_index_record(data)
+                if record is None or not self._fits(uid, "uid"):
+                    continue
+                slot = self._slots.get(uid)
+                if slot is None:
+                    if self._free:
+                        slot = self._free.pop()
+                    elif self._count < self.capacity:
+                        slot = self._count
+                        self._count += 1
+                    else:
+                        logger.warning("Location index is full (%d rows); dropping %s", self.capacity, uid)
+                        continue
+                    self._slots[uid] = slot
+                lat, lng, ts, accuracy, name, email = record
+                truncated = not (self._fits(name, "name") and self._fits(email, "email"))
+                self._put("lat", slot, lat)
+                self._put("lng", slot, lng)
+                self._put("ts", slot, ts)
+                self._put("accuracy", slot, accuracy)
+                self._put("flags", slot, _LOCATION_FLAG_TRUNCATED if truncated else 0)
+                self._put("uid", slot, uid)
+                self._put("name", slot, "" if truncated else name)
+                self._put("email", slot, "" if truncated else email)
+                self.watermark = max(self.watermark, ts)
+                changed += 1
+            struct.pack_into("<I", self._mm, _LOCATION_INDEX_COUNT_OFFSET, self._count)
+            struct.pack_into("<d", self._mm, _LOCATION_INDEX_WATERMARK_OFFSET, self.watermark)
+        finally:
+            self._seq += 1
+            struct.pack_into("<Q", self._mm, _LOCATION_INDEX_SEQ_OFFSET, self._seq)
+        return changed
+
+    def expire(self, cutoff: float) -> int:
+        """Free the slots of users whose last location is older than ``cutoff`` (epoch seconds)."""
+        stale = [
+            uid for uid, slot in self._slots.items()
+            if struct.unpack_from("<d", self._mm, self.offsets["ts"] + slot * 8)[0] < cutoff
+        ]
+        return self.apply(removals=stale) if stale else 0
+
+    def heartbeat(self) -> None:
+        struct.pack_into("<d", self._mm, _LOCATION_INDEX_HEARTBEAT_OFFSET, time.time())
+
+    def save_snapshot(self, path: str) -> int:
+        """Write the live rows to ``path`` as a compact snapshot (atomically replaced); returns rows written."""
+        slots = sorted(self._slots.values())
+        # Without freed slots the live rows are exactly the first len(slots) of each column.
+        contiguous = len(slots) == self._count
+        columns = []
+        for name, _, width in _LOCATION_INDEX_COLUMNS:
+            base = self.offsets[name]
+            if contiguous:
+                columns.append(self._mm[base:base + len(slots) * width])
+            else:
+                columns.append(b"".join(self._mm[base + slot * width:base + (slot + 1) * width] for slot in slots))
+        body = b"".join(columns)
+        header = _LOCATION_SNAPSHOT_HEADER.pack(
+            _LOCATION_SNAPSHOT_MAGIC, _LOCATION_INDEX_VERSION, len(slots), zlib.crc32(body), 0, self.watermark, time.time()
+        )
+        partial = f"{path}.{os.getpid()}.tmp"
+        with open(partial, "wb") as handle:
+            handle.write(header)
+            handle.write(body)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(partial, path)
+        return len(slots)
+
+    def load_snapshot(self, path: str) -> int:
+        """Replace the table with the rows of a snapshot written by save_snapshot; returns rows loaded.
+
+        A missing, truncated or corrupt snapshot loads nothing, and the caller does a full load instead.
+        """
+        try:
+            with open(path, "rb") as handle:
+                mm = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return 0
+        try:
+            if len(mm) < _LOCATION_SNAPSHOT_HEADER.size:
+                return 0
+            magic, version, rows, checksum, _, watermark, _ = _LOCATION_SNAPSHOT_HEADER.unpack_from(mm, 0)
+            body = memoryview(mm)[_LOCATION_SNAPSHOT_HEADER.size:]
+            try:
+                row_width = sum(width for _, _, width in _LOCATION_INDEX_COLUMNS)
+                if (
+                    magic != _LOCATION_SNAPSHOT_MAGIC
+                    or version != _LOCATION_INDEX_VERSION
+                    or len(body) != rows * row_width
+                    or zlib.crc32(body) != checksum
+                ):
+                    logger.warning("Ignoring invalid location index snapshot at %s", path)
+                    return 0
+                if rows > self.capacity:
+                    logger.warning("Location snapshot has %d rows; keeping the first %d", rows, self.capacity)
+                loaded = min(rows, self.capacity)
+                self._seq += 1
+                struct.pack_into("<Q", self._mm, _LOCATION_INDEX_SEQ_OFFSET, self._seq)
+                try:
+                    position = 0
+                    for name, _, width in _LOCATION_INDEX_COLUMNS:
+                        base = self.offsets[name]
+                        self._mm[base:base + loaded * width] = body[position:position + loaded * width]
+                        position += rows * width
+                    uid_base = self.offsets["uid"]
+                    uid_width = _LOCATION_INDEX_SPECS["uid"][1]
+                    self._slots = {
+                        self._mm[uid_base + slot * uid_width:uid_base + (slot + 1) * uid_width]
+                        .rstrip(b"\0")
+                        .decode("utf-8", "replace"): slot
+                        for slot in range(loaded)
+                    }
+                    self._free = []
+                    self._count = loaded
+                    self.watermark = watermark
+                    struct.pack_into("<I", self._mm, _LOCATION_INDEX_COUNT_OFFSET, self._count)
+                    struct.pack_into("<d", self._mm, _LOCATION_INDEX_WATERMARK_OFFSET, self.watermark)
+                finally:
+                    self._seq += 1
+                    struct.pack_into("<Q", self._mm, _LOCATION_INDEX_SEQ_OFFSET, self._seq)
+                return loaded
+            finally:
+                body.release()
+        finally:
+            mm.close()
+
+    def close(self) -> None:
+        self._mm.flush()
+        self._mm.close()
+        os.close(self._fd)
+
+
+class _LocationIndexReader:
+    """Lock-free reader of the table kept by _LocationIndexWriter, opened lazily in each process."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mm: Optional[mmap.mmap] = None
+        self._capacity = 0
+        self._offsets: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "fallbacks": 0, "retries": 0}
+
+    def _open(self) -> Optional[mmap.mmap]:
+        try:
+            with open(self.path, "rb") as handle:
+                mm = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        magic, version, capacity, *_ = _LOCATION_INDEX_HEADER.unpack_from(mm, 0)
+        offsets, size = _location_index_layout(capacity)
+        if magic != _LOCATION_INDEX_MAGIC or version != _LOCATION_INDEX_VERSION or len(mm) < size:
+            mm.close()
+            return None
+        self._capacity, self._offsets = capacity, offsets
+        return mm
+
+    def _map(self) -> Optional[Tuple[Tuple, mmap.mmap, Dict[str, int]]]:
+        """Return (header, mapping, column offsets) taken together under the lock.
+
+        Callers use the returned mapping, never ``self._mm``, so a remap by another
+        thread cannot pull it from under them. A replaced mapping is not closed here:
+        it is unmapped once the last reader holding it lets go.
+        """
+        with self._lock:
+            if self._mm is not None:
+                header = _LOCATION_INDEX_HEADER.unpack_from(self._mm, 0)
+                if header[2] == self._capacity:
+                    return header, self._mm, self._offsets
+                # The updater restarted with a different capacity; remap.
+            self._mm = self._open()
+            if self._mm is None:
+                return None
+            return _LOCATION_INDEX_HEADER.unpack_from(self._mm, 0), self._mm, self._offsets
+
+    def _record(self, outcome: str) -> None:
+        with self._lock:
+            self._stats[outcome] += 1
+
+    @staticmethod
+    def _text(mm: mmap.mmap, offsets: Dict[str, int], column: str, slot: int) -> str:
+        width = _LOCATION_INDEX_SPECS[column][1]
+        offset = offsets[column] + slot * width
+        return mm[offset:offset + width].rstrip(b"\0").decode("utf-8", "ignore")
+
+    def nearest(
+        self, lat: float, lng: float, exclude_user_id: str, limit: int, max_age_seconds: float
+    ) -> Optional[List[_NearbyUser]]:
+        """Return the ``limit`` closest fresh users, or None when the index is missing or stale."""
+        mapped = self._map()
+        if mapped is None or time.time() - mapped[0][7] > LOCATION_INDEX_STALE_SECONDS:
+            self._record("fallbacks")
+            return None
+        _, mm, offsets = mapped
+        cutoff = time.time() - max_age_seconds
+        lng_scale = math.cos(math.radians(lat))
+        for _ in range(20):
+            seq = struct.unpack_from("<Q", mm, _LOCATION_INDEX_SEQ_OFFSET)[0]
+            if seq % 2:
+                time.sleep(0)
+                continue
+            count = struct.unpack_from("<I", mm, _LOCATION_INDEX_COUNT_OFFSET)[0]
+            lats = memoryview(mm[offsets["lat"]:offsets["lat"] + 8 * count]).cast("d")
+            lngs = memoryview(mm[offsets["lng"]:offsets["lng"] + 8 * count]).cast("d")
+            stamps = memoryview(mm[offsets["ts"]:offsets["ts"] + 8 * count]).cast("d")
+            if struct.unpack_from("<Q", mm, _LOCATION_INDEX_SEQ_OFFSET)[0] != seq:
+                self._record("retries")
+                continue
+            # Rank by equirectangular distance (cheap, same order at these scales), then measure exactly.
+            candidates = heapq.nsmallest(
+                limit + 1,
+                (
+                    ((row_lat - lat) ** 2 + ((row_lng - lng) * lng_scale) ** 2, slot)
+                    for slot, (row_lat, row_lng, stamp) in enumerate(zip(lats, lngs, stamps))
+                    if stamp >= cutoff
+                ),
+            )
+            rows = []
+            for _, slot in candidates:
+                uid = self._text(mm, offsets, "uid", slot)
+                if uid == exclude_user_id:
+                    continue
+                accuracy = struct.unpack_from("<f", mm, offsets["accuracy"] + slot * 4)[0]
+                rows.append(
+                    _NearbyUser(
+                        uid,
+                        self._text(mm, offsets, "name", slot) or "User",
+                        lats[slot],
+                        lngs[slot],
+                        round(haversine(lat, lng, lats[slot], lngs[slot]), 2),
+                        stamps[slot],
+                        None if math.isnan(accuracy) else round(accuracy, 3),
+                        self._text(mm, offsets, "email", slot) or None,
+                        bool(mm[offsets["flags"] + slot] & _LOCATION_FLAG_TRUNCATED),
+                    )
+                )
+            if struct.unpack_from("<Q", mm, _LOCATION_INDEX_SEQ_OFFSET)[0] != seq:
+                self._record("retries")
+                continue
+            self._record("hits")
+            rows.sort(key=attrgetter("distance_km"))
+            return rows[:limit]
+        self._record("fallbacks")
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        if not LOCATION_INDEX_ENABLED:
+            return {"enabled": False}
+        mapped = self._map()
+        header = mapped[0] if mapped is not None else None
+        with self._lock:
+            stats = dict(self._stats)
+        if header is None:
+            return {"enabled": True, "available": False, **stats}
+        return {
+            "enabled": True,
+            "available": True,
+            "rows": header[3],
+            "writerPid": header[4],
+            "watermark": header[6],
+            "heartbeatAgeSeconds": round(time.time() - header[7], 1),
+            "snapshotAgeSeconds": _file_age_seconds(LOCATION_INDEX_SNAPSHOT_PATH),
+            **stats,
+        }
+
+
+_location_index = _LocationIndexReader(LOCATION_INDEX_PATH)
+
+
+def _file_age_seconds(path: str) -> Optional[float]:
+    try:
+        return round(time.time() - os.path.getmtime(path), 1)
+    except OSError:
+        return None
+
+
+def _fill_truncated_location_rows(rows: List[_NearbyUser]) -> List[_NearbyUser]:
+    truncated = [row for row in rows if row.truncated]
+    if truncated and get_db() is not None:
+        try:
+            refs = [get_db().collection("locations").document(row.user_id) for row in truncated]
+            for row, snapshot in zip(truncated, get_db().get_all(refs)):
+                data = snapshot.to_dict() or {}
+                row.display_name = data.get("displayName") or "User"
+                row.email = data.get("email")
+        except Exception as exc:
+            logger.warning("Failed to load long location fields: %s", exc)
+    return rows
+
+
+def run_location_index_updater(stop: Optional[threading.Event] = None) -> None:
+    """Own the shared location table: load fresh locations, then follow changes until ``stop`` is set.
+
+    Starts from the snapshot at LOCATION_INDEX_SNAPSHOT_PATH when there is one, so
+    only locations written since its watermark are read back from Firestore. Uses a
+    Firestore snapshot listener when the client supports one and polls
+    ``timestamp >= watermark`` otherwise. Rows older than LOCATION_FRESHNESS_MINUTES
+    are expired so their slots are reused, and the snapshot is rewritten every
+    LOCATION_INDEX_SNAPSHOT_SECONDS and on shutdown.
+    """
+    stop = stop or threading.Event()
+    client = get_db()
+    if client is None:
+        raise RuntimeError("Firestore is not configured; the location index cannot be built")
+    writer = _LocationIndexWriter(LOCATION_INDEX_PATH, LOCATION_INDEX_CAPACITY)
+    max_age = LOCATION_FRESHNESS_MINUTES * 60
+    snapshots = LOCATION_INDEX_SNAPSHOT_SECONDS > 0
+    if snapshots:
+        started = time.perf_counter()
+        restored = writer.load_snapshot(LOCATION_INDEX_SNAPSHOT_PATH)
+        if restored:
+            expired = writer.expire(time.time() - max_age)
+            logger.info(
+                "Restored %d locations (%d expired) from %s in %.1f ms",
+                restored, expired, LOCATION_INDEX_SNAPSHOT_PATH, (time.perf_counter() - started) * 1000,
+            )
+
+    def since() -> datetime:
+        cutoff = _freshness_cutoff(max_age)
+        if writer.watermark:
+            return max(cutoff, datetime.fromtimestamp(writer.watermark, timezone.utc))
+        return cutoff
+
+    query = client.collection("locations").where("timestamp", ">=", since())
+    changes: "queue.Queue[Tuple[List, List]]" = queue.Queue()
+    watch = None
+    if hasattr(query, "on_snapshot"):
+
+        def on_snapshot(_snapshots, doc_changes, _read_time):
+            upserts, removals = [], []
+            for change in doc_changes:
+                if change.type.name == "REMOVED":
+                    removals.append(change.document.id)
+                else:
+                    upserts.append((change.document.id, change.document.to_dict() or {}))
+            changes.put((upserts, removals))
+
+        watch = query.on_snapshot(on_snapshot)
+    logger.info("Location index updater writing %s (listener=%s)", LOCATION_INDEX_PATH, watch is not None)
+
+    last_expiry = last_snapshot = time.monotonic()
+    # Readers treat the table as stale until the first batch (the listener's initial state) is applied.
+    synced = False
+    try:
+        while not stop.is_set():
+            if watch is not None:
+                try:
+                    batch = [changes.get(timeout=LOCATION_INDEX_POLL_SECONDS)]
+                    while not changes.empty():
+                        batch.append(changes.get_nowait())
+                except queue.Empty:
+                    batch = []
+                for upserts, removals in batch:
+                    writer.apply(upserts, removals)
+                synced = synced or bool(batch)
+            else:
+                polled = client.collection("locations").where("timestamp", ">=", since()).stream()
+                writer.apply([(snapshot.id, snapshot.to_dict() or {}) for snapshot in polled])
+                synced = True
+                stop.wait(LOCATION_INDEX_POLL_SECONDS)
+            if time.monotonic() - last_expiry >= 60:
+                writer.expire(time.time() - max_age)
+                last_expiry = time.monotonic()
+            if synced:
+                writer.heartbeat()
+            if synced and snapshots and time.monotonic() - last_snapshot >= LOCATION_INDEX_SNAPSHOT_SECONDS:
+                _save_location_snapshot(writer)
+                last_snapshot = time.monotonic()
+    finally:
+        if watch is not None:
+            watch.unsubscribe()
+        if synced and snapshots:
+            _save_location_snapshot(writer)
+        writer.close()
+
+
+def _save_location_snapshot(writer: _LocationIndexWriter) -> None:
+    started = time.perf_counter()
+    try:
+        rows = writer.save_snapshot(LOCATION_INDEX_SNAPSHOT_PATH)
+    except OSError as exc:
+        logger.warning("Failed to write location index snapshot to %s: %s", LOCATION_INDEX_SNAPSHOT_PATH, exc)
+        return
+    logger.debug("Wrote %d locations to %s in %.1f ms", rows, LOCATION_INDEX_SNAPSHOT_PATH, (time.perf_counter() - started) * 1000)
 
 
 def get_nearest_neighbors(current_lat: float, current_lng: float, exclude_user_id: str, limit: int = 4):
-    """Return nearby users using Firestore-backed location data."""
-    if not db:
+    """Return nearby users from the shared location index, or from Firestore location data."""
+    if LOCATION_INDEX_ENABLED:
+        with span("location_index.nearest"):
+            rows = _location_index.nearest(
+                current_lat, current_lng, exclude_user_id, limit, LOCATION_FRESHNESS_MINUTES * 60
+            )
+        if rows is not None:
+            return [row.to_json() for row in _fill_truncated_location_rows(rows)]
+
+    if get_db() is None:
         logger.warning("Firestore not configured – nearest neighbour lookup skipped")
         return []
 
     try:
-        location_docs = db.collection("locations").stream()
+        location_docs = (
+            get_db().collection("locations")
+            .where("timestamp", ">=", _freshness_cutoff(LOCATION_FRESHNESS_MINUTES * 60))
+            .stream()
+        )
     except Exception as firestore_error:
         logger.error("Failed to load user locations: %s", firestore_error)
         return []
 
-    now_seconds = time.time()
-    users_with_distance = []
+    candidates: List[_NearbyUser] = []
     for doc_snapshot in location_docs:
         uid = doc_snapshot.id
         if uid == exclude_user_id:
@@ -1180,25 +4359,23 @@ def get_nearest_neighbors(current_lat: float, current_lng: float, exclude_user_i
 
         timestamp = record.get("timestamp")
         ts_seconds = timestamp.timestamp() if hasattr(timestamp, "timestamp") else None
-        if ts_seconds and now_seconds - ts_seconds > 30 * 60:
-            continue
 
         distance = haversine(current_lat, current_lng, user_lat, user_lng)
-        users_with_distance.append(
-            {
-                "userId": uid,
-                "displayName": record.get("displayName") or "User",
-                "latitude": user_lat,
-                "longitude": user_lng,
-                "distance_km": round(distance, 2),
-                "lastUpdated": ts_seconds,
-                "accuracy": record.get("accuracy"),
-                "email": record.get("email"),
-            }
+        candidates.append(
+            _NearbyUser(
+                uid,
+                record.get("displayName") or "User",
+                user_lat,
+                user_lng,
+                round(distance, 2),
+                ts_seconds,
+                record.get("accuracy"),
+                record.get("email"),
+            )
         )
 
-    users_with_distance.sort(key=lambda x: x["distance_km"])
-    return users_with_distance[:limit]
+    # nsmallest keeps the order of equal distances, like a stable sort followed by a slice.
+    return [user.to_json() for user in heapq.nsmallest(limit, candidates, key=attrgetter("distance_km"))]
 
 
 def fetch_alert_responses(alert_ref):
@@ -1228,56 +4405,698 @@ def fetch_alert_responses(alert_ref):
         logger.warning("Failed to load responses for alert %s: %s", alert_ref.id, err)
     return responses
 
+def _alert_coordinates(alert_data: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+    location = alert_data.get("location")
+    if not location or not hasattr(location, "latitude"):
+        # Compatibility with older documents that stored dicts
+        lat = location.get("latitude") if isinstance(location, dict) else None
+        lng = location.get("longitude") if isinstance(location, dict) else None
+    else:
+        lat = location.latitude
+        lng = location.longitude
+
+    if lat is None or lng is None:
+        return None
+    try:
+        return float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None
+
+
+class _NearbyAlert:
+    """An active alert inside the search radius; responses are attached after ranking."""
+
+    __slots__ = (
+        "alert_id", "reference", "user_id", "user_name", "message", "emergency_type", "status",
+        "reporter_count", "merged_message", "distance", "latitude", "longitude", "created_ms",
+        "ai_insights", "responses",
+    )
+
+    def __init__(self, snapshot, data: Dict[str, Any], latitude: float, longitude: float, distance: float):
+        created_at = data.get("createdAt")
+        created_seconds = created_at.timestamp() if hasattr(created_at, "timestamp") else None
+        ai_insights = data.get("aiInsights")
+        if isinstance(ai_insights, dict):
+            ai_insights = dict(ai_insights)
+            generated_at = ai_insights.get("generatedAt")
+            if hasattr(generated_at, "timestamp"):
+                ai_insights["generatedAt"] = int(generated_at.timestamp() * 1000)
+        self.alert_id = snapshot.id
+        self.reference = snapshot.reference
+        self.user_id = data.get("userId")
+        self.user_name = data.get("senderDisplayName") or "User"
+        self.message = data.get("message")
+        self.emergency_type = data.get("emergencyType")
+        self.status = data.get("status")
+        self.reporter_count = data.get("reporterCount", 1)
+        self.merged_message = data.get("mergedMessage")
+        self.distance = round(distance, 2)
+        self.latitude = latitude
+        self.longitude = longitude
+        self.created_ms = int(created_seconds * 1000) if created_seconds else None
+        self.ai_insights = ai_insights
+        self.responses: List[Dict[str, Any]] = []
+
+    def to_json(self, viewer_id: str) -> Dict[str, Any]:
+        return {
+            "id": self.alert_id,
+            "userId": self.user_id,
+            "userName": self.user_name,
+            "message": self.message,
+            "emergencyType": self.emergency_type,
+            "status": self.status,
+            "reporterCount": self.reporter_count,
+            "mergedMessage": self.merged_message,
+            "distance": self.distance,
+            "location": {"latitude": self.latitude, "longitude": self.longitude},
+            "createdAt": self.created_ms,
+            "isOwnAlert": self.user_id == viewer_id,
+            "responses": self.responses,
+            "aiInsights": self.ai_insights,
+        }
+
+
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+_KM_PER_DEGREE = 111.32
+
+
+def _geohash(lat: float, lng: float, precision: int = ALERT_GEOHASH_PRECISION) -> str:
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars: List[str] = []
+    value = bit_count = 0
+    even = True
+    while len(chars) < precision:
+        bounds, coordinate = (lng_range, lng) if even else (lat_range, lat)
+        middle = (bounds[0] + bounds[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_ALPHABET[value])
+            value = bit_count = 0
+    return "".join(chars)
+
+
+def _geohash_ranges(lat: float, lng: float, radius_km: float) -> List[Tuple[str, str]]:
+    """Geohash prefix ranges whose cells cover the circle of ``radius_km`` around a point.
+
+    Picks the finest precision whose cells are at least ``radius_km`` across, so the
+    cell holding the centre plus its eight neighbours cover the circle.
+    """
+    # Cells get narrower towards the poles; size them at the circle's poleward edge.
+    edge_latitude = min(89.9, abs(lat) + radius_km / _KM_PER_DEGREE)
+    for precision in range(ALERT_GEOHASH_PRECISION, 0, -1):
+        lat_bits = 5 * precision // 2
+        lat_step = 180.0 / 2 ** lat_bits
+        lng_step = 360.0 / 2 ** (5 * precision - lat_bits)
+        if (
+            lat_step * _KM_PER_DEGREE >= radius_km
+            and lng_step * _KM_PER_DEGREE * math.cos(math.radians(edge_latitude)) >= radius_km
+        ):
+            break
+    else:
+        return [("", "~")]
+    prefixes = {
+        _geohash(
+            max(-90.0, min(90.0, lat + dy * lat_step)),
+            (lng + dx * lng_step + 180.0) % 360.0 - 180.0,
+            precision,
+        )
+        for dy in (-1, 0, 1)
+        for dx in (-1, 0, 1)
+    }
+    return [(prefix, prefix + "~") for prefix in sorted(prefixes)]
+
+
+def _active_alerts_near(
+    lat: float,
+    lng: float,
+    radius_km: float,
+    *,
+    since: datetime,
+    emergency_type: Optional[str] = None,
+    limit: int = NEARBY_ALERT_QUERY_LIMIT,
+) -> List[Tuple[Any, Dict[str, Any], Tuple[float, float], float]]:
+    """Active alerts created since ``since`` within ``radius_km``, nearest first.
+
+    Queries one geohash range per covering cell, bounded by ``createdAt`` and ``limit``,
+    so reads grow with the fresh alerts in the area rather than with every active alert.
+    Returns (snapshot, data, coordinates, km).
+    """
+    seen = set()
+    matches = []
+    for start, end in _geohash_ranges(lat, lng, radius_km):
+        query = get_db().collection("alerts").where("status", "==", "active")
+        if emergency_type is not None:
+            query = query.where("emergencyType", "==", emergency_type)
+        query = (
+            query.where("geohash", ">=", start)
+            .where("geohash", "<", end)
+            .where("createdAt", ">=", since)
+            .order_by("geohash")
+            .order_by("createdAt")
+            .limit(limit)
+        )
+        for snapshot in query.stream():
+            if snapshot.id in seen:
+                continue
+            seen.add(snapshot.id)
+            data = snapshot.to_dict() or {}
+            coordinates = _alert_coordinates(data)
+            if coordinates is None:
+                continue
+            distance = haversine(lat, lng, *coordinates)
+            if distance <= radius_km:
+                matches.append((snapshot, data, coordinates, distance))
+    matches.sort(key=lambda match: match[3])
+    return matches
+
+
+def backfill_alert_geohashes(batch_size: Optional[int] = None) -> int:
+    """Add ``geohash`` to active alerts written before area queries existed; returns alerts updated."""
+    batch_size = max(1, batch_size or ALERT_LIFECYCLE_BATCH_SIZE)
+    updated = 0
+    last_snapshot = None
+    while True:
+        query = (
+            get_db().collection("alerts")
+            .where("status", "==", "active")
+            .order_by("createdAt", direction=admin_firestore.Query.ASCENDING)
+            .limit(batch_size)
+        )
+        if last_snapshot is not None:
+            query = query.start_after(last_snapshot)
+        page = list(query.stream())
+        if not page:
+            break
+        last_snapshot = page[-1]
+        batch = get_db().batch()
+        pending = 0
+        for snapshot in page:
+            data = snapshot.to_dict() or {}
+            coordinates = _alert_coordinates(data)
+            if data.get("geohash") or coordinates is None:
+                continue
+            batch.update(snapshot.reference, {"geohash": _geohash(*coordinates)})
+            pending += 1
+        if pending:
+            batch.commit()
+            updated += pending
+        if len(page) < batch_size:
+            break
+    return updated
+
+
+def _backfill_alert_geohashes_once(batch_size: int) -> Optional[int]:
+    """Run the geohash backfill until one pass has completed; None once it has.
+
+    New alerts are written with a geohash, so a single full pass is enough.
+    """
+    marker = get_db().collection("maintenance").document("alertGeohashBackfill")
+    if marker.get().exists:
+        return None
+    updated = backfill_alert_geohashes(batch_size)
+    marker.set({"completedAt": admin_firestore.SERVER_TIMESTAMP, "updated": updated})
+    return updated
+
+
+def _run_in_transaction(callback):
+    runner = getattr(get_db(), "run_transaction", None)
+    if runner is not None:
+        # Injected in-memory stores (local_backends) apply the callback under their own lock.
+        return runner(callback)
+    transaction = get_db().transaction()
+    with _firestore_call("transaction", "*"):
+        return admin_firestore.transactional(callback)(transaction)
+
+
+def _find_sos_cluster(current_lat: float, current_lng: float, emergency_type: str):
+    """Return the closest recent active alert of the same type within the cluster radius."""
+    try:
+        matches = _active_alerts_near(
+            current_lat,
+            current_lng,
+            SOS_CLUSTER_RADIUS_KM,
+            since=_freshness_cutoff(SOS_CLUSTER_WINDOW_MINUTES * 60),
+            emergency_type=emergency_type,
+        )
+        return matches[0][0] if matches else None
+    except Exception as exc:
+        logger.warning("SOS cluster lookup failed; creating a new alert: %s", exc)
+        return None
+
+
+def _merge_sos_report(alert_ref, *, user_id: str, sender_name: str, message: str) -> Optional[Dict[str, Any]]:
+    """Attach a duplicate SOS report to an existing incident; returns None if it is no longer active."""
+
+    def merge(transaction):
+        snapshot = alert_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return None
+        alert_data = snapshot.to_dict() or {}
+        if alert_data.get("status") != "active":
+            return None
+
+        reporter_ids = list(alert_data.get("reporterIds") or [alert_data.get("userId")])
+        reporter_ids = [reporter_id for reporter_id in reporter_ids if reporter_id]
+        if user_id not in reporter_ids:
+            reporter_ids.append(user_id)
+
+        merged_message = alert_data.get("mergedMessage") or alert_data.get("message") or ""
+        if len(merged_message) < SOS_CLUSTER_MAX_MERGED_CHARS:
+            merged_message = f"{merged_message}\n{sender_name or 'User'}: {message}".strip()
+            merged_message = merged_message[:SOS_CLUSTER_MAX_MERGED_CHARS]
+
+        transaction.update(
+            alert_ref,
+            {
+                "reporterIds": reporter_ids,
+                "reporterCount": len(reporter_ids),
+                "mergedMessage": merged_message,
+                "lastUpdated": admin_firestore.SERVER_TIMESTAMP,
+            },
+        )
+        return {
+            "alertId": snapshot.id,
+            "reporterCount": len(reporter_ids),
+            "recipients": alert_data.get("recipients") or [],
+        }
+
+    return _run_in_transaction(merge)
+
+
+def _alert_last_activity_seconds(alert_data: Dict[str, Any]) -> Optional[float]:
+    activity = [
+        value.timestamp()
+        for value in (alert_data.get("createdAt"), alert_data.get("lastUpdated"))
+        if hasattr(value, "timestamp")
+    ]
+    return max(activity) if activity else None
+
+
+def _archive_alerts(alert_snapshots: Sequence[Any], *, reason: str) -> int:
+    """Move alerts (and their responses) into the archive collection in batched writes."""
+    archive_collection = get_db().collection(ALERT_ARCHIVE_COLLECTION)
+    batch = get_db().batch()
+    pending_writes = 0
+    archived = 0
+
+    def reserve(writes: int) -> None:
+        nonlocal batch, pending_writes
+        if pending_writes and pending_writes + writes > FIRESTORE_BATCH_WRITE_LIMIT:
+            batch.commit()
+            batch = get_db().batch()
+            pending_writes = 0
+        pending_writes += writes
+
+    def move_response(archive_ref, response_snapshot) -> None:
+        batch.set(
+            archive_ref.collection("responses").document(response_snapshot.id),
+            response_snapshot.to_dict() or {},
+        )
+        batch.delete(response_snapshot.reference)
+
+    for alert_snapshot in alert_snapshots:
+        alert_data = alert_snapshot.to_dict() or {}
+        response_snapshots = list(alert_snapshot.reference.collection("responses").stream())
+        archive_ref = archive_collection.document(alert_snapshot.id)
+        archived_status = "resolved" if response_snapshots else "expired"
+
+        # Responses may span several batches (each is copied and deleted). The alert moves
+        # in the same batch as its last response, so after a partial failure it is still
+        # active and still has a response when the next run retries it.
+        for response_snapshot in response_snapshots[:-1]:
+            reserve(2)
+            move_response(archive_ref, response_snapshot)
+        reserve(4 if response_snapshots else 2)
+        if response_snapshots:
+            move_response(archive_ref, response_snapshots[-1])
+        batch.set(
+            archive_ref,
+            {
+                **alert_data,
+                "status": archived_status,
+                "previousStatus": alert_data.get("status"),
+                "archiveReason": reason,
+                "archivedAt": admin_firestore.SERVER_TIMESTAMP,
+            },
+        )
+        batch.delete(alert_snapshot.reference)
+        archived += 1
+
+    if pending_writes:
+        batch.commit()
+    return archived
+
+
+def _expire_inactive_alerts(inactivity_minutes: float, batch_size: int) -> int:
+    cutoff = _freshness_cutoff(inactivity_minutes * 60)
+    cutoff_seconds = cutoff.timestamp()
+    archived = 0
+    last_snapshot = None
+
+    while True:
+        query = (
+            get_db().collection("alerts")
+            .where("status", "==", "active")
+            .where("createdAt", "<", cutoff)
+            .order_by("createdAt", direction=admin_firestore.Query.ASCENDING)
+            .limit(batch_size)
+        )
+        if last_snapshot is not None:
+            query = query.start_after(last_snapshot)
+        page = list(query.stream())
+        if not page:
+            break
+        last_snapshot = page[-1]
+
+        # createdAt is older than the cutoff, but a recent response keeps the alert live.
+        inactive = []
+        for snapshot in page:
+            last_activity = _alert_last_activity_seconds(snapshot.to_dict() or {})
+            if last_activity is None or last_activity < cutoff_seconds:
+                inactive.append(snapshot)
+        archived += _archive_alerts(inactive, reason="inactive")
+
+        if len(page) < batch_size:
+            break
+    return archived
+
+
+def _count_query(query) -> int:
+    return int(query.count(alias="total").get()[0][0].value)
+
+
+def _enforce_active_alert_cap(active_cap: int, batch_size: int) -> int:
+    active = get_db().collection("alerts").where("status", "==", "active")
+    # A count aggregation bills one read per 1000 alerts; offset() would bill every skipped one.
+    overflow = _count_query(active) - active_cap
+    archived = 0
+    last_snapshot = None
+    while overflow > 0:
+        query = active.order_by("createdAt", direction=admin_firestore.Query.ASCENDING).limit(min(batch_size, overflow))
+        if last_snapshot is not None:
+            query = query.start_after(last_snapshot)
+        oldest = list(query.stream())
+        if not oldest:
+            break
+        last_snapshot = oldest[-1]
+        archived += _archive_alerts(oldest, reason="capacity")
+        overflow -= len(oldest)
+    return archived
+
+
+def run_alert_lifecycle(
+    *,
+    inactivity_minutes: Optional[float] = None,
+    active_cap: Optional[int] = None,
+    batch_size: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Expire inactive alerts and trim the active set down to ``ALERT_ACTIVE_CAP``."""
+    if get_db() is None:
+        raise RuntimeError("Firestore is not available")
+
+    inactivity_minutes = ALERT_INACTIVITY_MINUTES if inactivity_minutes is None else inactivity_minutes
+    active_cap = ALERT_ACTIVE_CAP if active_cap is None else active_cap
+    batch_size = max(1, batch_size or ALERT_LIFECYCLE_BATCH_SIZE)
+
+    started = time.time()
+    geohashed = _backfill_alert_geohashes_once(batch_size)
+    expired = _expire_inactive_alerts(inactivity_minutes, batch_size)
+    capped = _enforce_active_alert_cap(max(0, active_cap), batch_size)
+    summary = {
+        "geohashBackfilled": geohashed,
+        "expired": expired,
+        "capped": capped,
+        "archiveCollection": ALERT_ARCHIVE_COLLECTION,
+        "durationMs": int((time.time() - started) * 1000),
+    }
+    logger.info("Alert lifecycle run complete: %s", summary)
+    return summary
+
 # Authentication middleware
+def _maybe_start_profiling(user: Dict[str, Any]) -> None:
+    """Profile this request when an admin asks for it with ``X-Profile: 1`` or ``?profile=1``."""
+    requested = request.headers.get("X-Profile") == "1" or request.args.get("profile") == "1"
+    if not requested or user.get("admin") is not True or g.get("profiler") is not None:
+        return
+    profile_id = f"{int(time.time())}-{uuid.uuid4().hex[:12]}"
+    profiler = _SamplingProfiler.try_start(profile_id)
+    if profiler is None:
+        logger.warning("Profiling skipped for %s: %d profiles already running", request.path, PROFILE_MAX_ACTIVE)
+        return
+    g.profiler = profiler
+    g.profiler_token = _current_profiler.set(profiler)
+
+
 def auth_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        # If Firebase Admin is not available, proceed with a mock user for demo purposes.
-        if db is None:
-            logger.warning("Firebase Admin SDK not initialized. Using mock user for request.")
-            request.user = {"uid": "mock-user-for-deployment"}
-            return f(*args, **kwargs)
-            
+        # Without Firestore there is no way to serve the user's data; ask the client to retry.
+        if get_db() is None:
+            response = jsonify({"error": "Service temporarily unavailable: database not initialised"})
+            response.status_code = 503
+            response.headers["Retry-After"] = str(firestore_retry_after())
+            return response
+
         auth_header = request.headers.get('Authorization')
         
         if not auth_header or not auth_header.startswith('Bearer '):
             return jsonify({"error": "No valid authentication token provided"}), 401
         
         token = auth_header.split('Bearer ')[1]
-        user = verify_id_token(token)
+        with span("auth.verify_token"):
+            user = verify_id_token(token)
         
         if not user:
             return jsonify({"error": "Invalid authentication token"}), 401
         
         # Add user to request
         request.user = user
+        _maybe_start_profiling(user)
         return f(*args, **kwargs)
     
     return decorated_function
 
+class _TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = max(rate, 1e-6)
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, floor: float = 0.0) -> float:
+        """Take a token if at least ``floor`` would remain; otherwise return seconds to wait."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens - 1 >= floor:
+                self.tokens -= 1
+                return 0.0
+            return (floor + 1 - self.tokens) / self.rate
+
+    def refund(self) -> None:
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+
+# lane -> (per-user tokens per second, per-user burst, share of the global reserve kept back)
+ADMISSION_LANES: Dict[str, Tuple[float, float, float]] = {
+    "critical": (
+        float(os.environ.get("RATE_LIMIT_CRITICAL_PER_SECOND", "1")),
+        float(os.environ.get("RATE_LIMIT_CRITICAL_BURST", "10")),
+        0.0,
+    ),
+    "standard": (
+        float(os.environ.get("RATE_LIMIT_STANDARD_PER_SECOND", "2")),
+        float(os.environ.get("RATE_LIMIT_STANDARD_BURST", "20")),
+        0.5,
+    ),
+    "low": (
+        float(os.environ.get("RATE_LIMIT_LOW_PER_SECOND", "0.5")),
+        float(os.environ.get("RATE_LIMIT_LOW_BURST", "10")),
+        1.0,
+    ),
+}
+
+_global_bucket = _TokenBucket(GLOBAL_RATE_PER_SECOND, GLOBAL_RATE_BURST)
+_user_buckets = _TTLCache(50000, 600)
+_admission_lock = threading.Lock()
+_admission_stats: Dict[str, Dict[str, int]] = {
+    lane: {"admitted": 0, "rejectedUser": 0, "rejectedGlobal": 0} for lane in ADMISSION_LANES
+}
+
+
+def _record_admission(lane: str, outcome: str) -> None:
+    with _admission_lock:
+        _admission_stats[lane][outcome] += 1
+
+
+def admission_stats() -> Dict[str, Dict[str, int]]:
+    with _admission_lock:
+        return {lane: dict(counts) for lane, counts in _admission_stats.items()}
+
+
+def _user_bucket(user_id: str, lane: str):
+    rate, burst, _ = ADMISSION_LANES[lane]
+    bucket_key = f"{user_id}:{request.endpoint}"
+    bucket = _user_buckets.get(bucket_key)
+    if bucket is None:
+        _, bucket = _user_buckets.setdefault(bucket_key, _TokenBucket(rate, burst))
+    return bucket
+
+
+def _rate_limited_response(retry_after: float):
+    response = jsonify({"error": "Too many requests. Please retry shortly."})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def admission_control(lane: str):
+    """Per-user/per-route token buckets plus a global bucket that keeps headroom for critical lanes."""
+    if lane not in ADMISSION_LANES:
+        raise ValueError(f"Unknown admission lane: {lane}")
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not RATE_LIMIT_ENABLED:
+                return f(*args, **kwargs)
+
+            user_id = (getattr(request, "user", {}) or {}).get("uid") or request.remote_addr or "anonymous"
+            user_bucket = _user_bucket(user_id, lane)
+            retry_after = user_bucket.try_acquire()
+            if retry_after:
+                _record_admission(lane, "rejectedUser")
+                return _rate_limited_response(retry_after)
+
+            reserve_share = ADMISSION_LANES[lane][2]
+            floor = GLOBAL_RATE_BURST * CRITICAL_RESERVE_FRACTION * reserve_share
+            retry_after = _global_bucket.try_acquire(floor)
+            if retry_after:
+                user_bucket.refund()
+                _record_admission(lane, "rejectedGlobal")
+                logger.warning("Shedding %s request to %s under global load", lane, request.endpoint)
+                return _rate_limited_response(retry_after)
+
+            _record_admission(lane, "admitted")
+            return f(*args, **kwargs)
+
+        return decorated_function
+
+    return decorator
+
+
+_idempotency_store = _TTLCache(IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_TTL_SECONDS)
+
+
+def idempotent(f):
+    """Replay the stored response when a request repeats its ``Idempotency-Key`` header."""
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = (request.headers.get("Idempotency-Key") or "").strip()
+        if not key:
+            return f(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({"error": "Idempotency-Key must be at most 255 characters"}), 400
+
+        user_id = (getattr(request, "user", {}) or {}).get("uid")
+        store_key = f"{user_id}:{request.method}:{request.path}:{key}"
+        fingerprint = _stable_hash(request.get_data(as_text=True) or "")
+        inserted, entry = _idempotency_store.setdefault(
+            store_key, {"state": "pending", "fingerprint": fingerprint}
+        )
+        if not inserted:
+            if entry["fingerprint"] != fingerprint:
+                return jsonify({"error": "Idempotency-Key was already used with a different payload"}), 422
+            if entry["state"] == "pending":
+                response = jsonify({"error": "A request with this Idempotency-Key is still in progress"})
+                response.status_code = 409
+                response.headers["Retry-After"] = "1"
+                return response
+            response = current_app.response_class(
+                entry["body"],
+                status=entry["status"],
+                mimetype=entry["mimetype"],
+            )
+            response.headers["Idempotent-Replayed"] = "true"
+            return response
+
+        try:
+            response = current_app.make_response(f(*args, **kwargs))
+        except Exception:
+            _idempotency_store.pop(store_key)
+            raise
+
+        # Server errors stay retryable; everything else is replayed verbatim.
+        if response.status_code >= 500 or response.is_streamed:
+            _idempotency_store.pop(store_key)
+        else:
+            _idempotency_store.set(
+                store_key,
+                {
+                    "state": "complete",
+                    "fingerprint": fingerprint,
+                    "body": response.get_data(),
+                    "status": response.status_code,
+                    "mimetype": response.mimetype,
+                },
+            )
+        return response
+
+    return decorated_function
+
 @app.route('/ask', methods=['POST'])
 @auth_required
+@admission_control("low")
 def ask_assistant():
     payload = request.get_json(silent=True) or {}
     question = (payload.get("question") or "").strip()
     if not question:
         return jsonify({"error": "No question provided"}), 400
 
+    # Any user can be served a cached answer to a question that does not depend on memory.
+    cacheable = _is_context_free_question(question)
+    cached = _lookup_cached_answer(question) if cacheable else None
+    if cached:
+        persist_chat_entry(request.user['uid'], question, cached["answer"], model=cached["model"])
+        return jsonify({"response": cached["answer"], "model": cached["model"], "cached": cached["tier"]})
+
     if not groq_available():
         return jsonify(
             {"error": "Groq AI model is not available. Please configure GROQ_API_KEY on the server."}
         ), 503
 
-    user_profile = getattr(request, "user", {}) or {}
-    context_messages = build_context_messages(user_profile)
+    memory = load_chat_memory(request.user['uid'])
+    # Only answers generated without any memory are stored for others.
+    cacheable = cacheable and not memory["summary"] and not memory["turns"]
+    context_messages = build_memory_messages(memory, question, _ask_profile_messages(cacheable))
+    started = time.monotonic()
     try:
         ai_result = groq_generate_chat(
             format_prompt(question),
             system_prompt=HEALTH_EXPERT_PROMPT.strip(),
             context_messages=context_messages,
+            feature="ask",
         )
         answer = (ai_result or {}).get("content")
-        if not answer:
+        model = (ai_result or {}).get("model") or AI_MODEL_NAME
+        if answer:
+            if cacheable:
+                _store_cached_answer(question, answer, started=started, model=model)
+        else:
             answer = (
                 "I couldn't generate a helpful reply right now. Please try again in a moment "
                 "or contact local emergency services if this is urgent."
@@ -1286,9 +5105,9 @@ def ask_assistant():
             request.user['uid'],
             question,
             answer,
-            model=AI_MODEL_NAME,
+            model=model,
         )
-        response_payload = {"response": answer, "model": AI_MODEL_NAME}
+        response_payload = {"response": answer, "model": model}
         return jsonify(response_payload)
     except Exception as exc:
         logger.error("Groq chat error: %s", exc, exc_info=True)
@@ -1303,6 +5122,7 @@ def ask_assistant():
 
 @app.route('/ask-stream', methods=['POST'])
 @auth_required
+@admission_control("low")
 def ask_assistant_stream():
     payload = request.get_json(silent=True) or {}
     question = (payload.get("question") or "").strip()
@@ -1310,53 +5130,83 @@ def ask_assistant_stream():
     if not question:
         return jsonify({"error": "No question provided"}), 400
 
+    cacheable = _is_context_free_question(question)
+    cached = _lookup_cached_answer(question) if cacheable else None
+    if cached:
+        user_id = request.user['uid']
+
+        def replay_cached():
+            with _metrics.track_in_progress("sse_streams_active"):
+                for chunk in _replay_chunks(cached["answer"], size=SSE_COALESCE_MAX_BYTES):
+                    yield _sse_event(chunk)
+            persist_chat_entry(user_id, question, cached["answer"], model=cached["model"])
+
+        return Response(stream_with_context(replay_cached()), mimetype='text/event-stream', headers=SSE_HEADERS)
+
     if not groq_available():
         def unavailable():
-            yield "data: Groq AI model is not available. Please configure GROQ_API_KEY.\n\n"
-        return Response(stream_with_context(unavailable()), mimetype='text/event-stream')
+            yield _sse_event("Groq AI model is not available. Please configure GROQ_API_KEY.")
+        return Response(stream_with_context(unavailable()), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+    memory = load_chat_memory(request.user['uid'])
+    cacheable = cacheable and not memory["summary"] and not memory["turns"]
 
     def stream_response():
         collected_chunks: List[str] = []
-        try:
-            user_profile = getattr(request, "user", {}) or {}
-            context_messages = build_context_messages(user_profile)
+        stream_model: Dict[str, Optional[str]] = {}
+        started = time.monotonic()
+        completed = False
+        context_messages = build_memory_messages(memory, question, _ask_profile_messages(cacheable))
+        deadline = _groq_deadline()
+
+        def answer_deltas() -> Generator[str, None, None]:
+            g.groq_deadline = deadline
             response_stream = groq_stream_chat(
                 format_prompt(question),
                 system_prompt=HEALTH_EXPERT_PROMPT.strip(),
                 context_messages=context_messages,
             )
-            for chunk in response_stream:
-                chunk_type = chunk.get("type")
-                content = chunk.get("content")
-                if not content:
-                    continue
-                # Only yield content, skip reasoning
-                if chunk_type != "reasoning":
-                    collected_chunks.append(content)
-                    yield f"data: {content}\n\n"
+            try:
+                for chunk in response_stream:
+                    content = chunk.get("content")
+                    # Only stream content, skip reasoning
+                    if content and chunk.get("type") != "reasoning":
+                        collected_chunks.append(content)
+                        stream_model["model"] = chunk.get("model")
+                        yield content
+            finally:
+                response_stream.close()
+
+        try:
+            yield from _sse_frames(answer_deltas)
+            completed = True
         except Exception as stream_exc:
             logger.error("Groq streaming error: %s", stream_exc, exc_info=True)
-            safe_message = str(stream_exc).replace("\n", " ").strip()
-            yield f"data: Streaming error: {safe_message or 'Unknown error occurred.'}\n\n"
+            safe_message = str(stream_exc).strip()
+            yield _sse_event(f"Streaming error: {safe_message or 'Unknown error occurred.'}")
         finally:
             full_response = "".join(collected_chunks).strip()
+            model = stream_model.get("model") or AI_MODEL_NAME
+            if full_response and completed and cacheable:
+                _store_cached_answer(question, full_response, started=started, model=model)
             if full_response:
                 persist_chat_entry(
                     request.user['uid'],
                     question,
                     full_response,
-                    model=AI_MODEL_NAME,
+                    model=model,
                 )
 
-    return Response(stream_with_context(stream_response()), mimetype='text/event-stream')
+    return Response(stream_with_context(stream_response()), mimetype='text/event-stream', headers=SSE_HEADERS)
 
 @app.route('/user/profile', methods=['GET'])
 @auth_required
+@admission_control("standard")
 def get_user_profile():
     user_id = request.user['uid']
     
     # Get user data from Firebase
-    if db is None:
+    if get_db() is None:
         logger.warning("Firebase not initialised – returning minimal profile stub")
         return jsonify({"profile": {"uid": user_id}}), 200
 
@@ -1365,10 +5215,11 @@ def get_user_profile():
     if not user_data:
         return jsonify({"profile": {"uid": user_id}}), 200
 
-    return jsonify({"profile": user_data})
+    return jsonify({"profile": _serialize_profile(user_data)})
 
 @app.route('/api/users/sync', methods=['POST'])
 @auth_required
+@admission_control("standard")
 def sync_user_profile():
     payload = request.json or {}
     user_id = request.user['uid']
@@ -1411,12 +5262,12 @@ def sync_user_profile():
         except Exception as geo_error:
             logger.warning(f"Failed to set GeoPoint for user {user_id}: {geo_error}")
 
-    if db is None:
+    if get_db() is None:
         logger.warning("Firebase Admin SDK not initialised – returning mock sync status")
         return jsonify({"status": "mock_synced", "firestore": False})
 
     try:
-        db.collection('users').document(user_id).set(
+        get_db().collection('users').document(user_id).set(
             {k: v for k, v in user_doc.items() if v is not None},
             merge=True
         )
@@ -1426,7 +5277,7 @@ def sync_user_profile():
 
     if latitude is not None and longitude is not None:
         try:
-            db.collection("locations").document(user_id).set(
+            get_db().collection("locations").document(user_id).set(
                 {
                     "latitude": float(latitude),
                     "longitude": float(longitude),
@@ -1443,6 +5294,7 @@ def sync_user_profile():
 
 @app.route('/api/location', methods=['POST'])
 @auth_required
+@admission_control("low")
 def update_location():
     data = request.json
     user_id = request.user['uid']
@@ -1467,7 +5319,7 @@ def update_location():
     if DEBUG:
         logger.debug(f"User {user_id} location payload: lat={lat_val}, lng={lon_val}, accuracy={accuracy}")
 
-    if db is None:
+    if get_db() is None:
         logger.warning("Firebase Admin not initialised – skipping persistent location write")
         return jsonify({"status": "accepted", "firestore": False}), 200
 
@@ -1480,8 +5332,8 @@ def update_location():
     }
 
     try:
-        db.collection('users').document(user_id).set(location_doc, merge=True)
-        db.collection("locations").document(user_id).set(
+        get_db().collection('users').document(user_id).set(location_doc, merge=True)
+        get_db().collection("locations").document(user_id).set(
             {
                 "latitude": lat_val,
                 "longitude": lon_val,
@@ -1501,6 +5353,7 @@ def update_location():
 
 @app.route('/api/nearest-users', methods=['POST'])
 @auth_required
+@admission_control("low")
 def get_nearest_users():
     data = request.json
     user_id = request.user['uid']
@@ -1510,7 +5363,7 @@ def get_nearest_users():
     if latitude is None or longitude is None:
         return jsonify({"error": "Latitude and longitude are required"}), 400
     
-    if db is None:
+    if get_db() is None:
         logger.warning("Firebase not configured – returning empty nearest user list")
         return jsonify({"nearest_users": []}), 200
 
@@ -1538,15 +5391,16 @@ def get_nearest_users():
         nearest_users,
     )
     if ai_analysis:
-        ai_analysis["model"] = AI_MODEL_NAME
+        ai_analysis["model"] = ai_analysis.get("model") or AI_MODEL_NAME
         response_payload["analysis"] = ai_analysis
     return jsonify(response_payload)
 
 
 @app.route('/api/devices/register', methods=['POST'])
 @auth_required
+@admission_control("standard")
 def register_device_token():
-    if db is None:
+    if get_db() is None:
         return jsonify({"error": "Firebase not configured"}), 503
 
     payload = request.get_json(silent=True) or {}
@@ -1576,8 +5430,9 @@ def register_device_token():
 
 @app.route('/api/devices/<path:token>', methods=['DELETE'])
 @auth_required
+@admission_control("standard")
 def delete_device_token(token):
-    if db is None:
+    if get_db() is None:
         return jsonify({"error": "Firebase not configured"}), 503
 
     if not token.strip():
@@ -1594,8 +5449,9 @@ def delete_device_token(token):
 
 @app.route('/api/conversations', methods=['POST'])
 @auth_required
+@admission_control("standard")
 def create_conversation():
-    if db is None:
+    if get_db() is None:
         return jsonify({"error": "Firebase not configured"}), 503
 
     payload = request.get_json(silent=True) or {}
@@ -1635,8 +5491,9 @@ def create_conversation():
 
 @app.route('/api/conversations', methods=['GET'])
 @auth_required
+@admission_control("standard")
 def list_conversations():
-    if db is None:
+    if get_db() is None:
         return jsonify({"conversations": []}), 503
 
     user_id = request.user["uid"]
@@ -1647,7 +5504,7 @@ def list_conversations():
     limit = max(1, min(limit, 100))
 
     try:
-        conversation_query = db.collection("conversations").where(
+        conversation_query = get_db().collection("conversations").where(
             "participants",
             "array_contains",
             user_id,
@@ -1655,18 +5512,24 @@ def list_conversations():
         conversations = []
         for snapshot in conversation_query.stream():
             summary = _conversation_summary_from_snapshot(snapshot, user_id)
-            if not summary:
-                continue
-            latest_message = _get_latest_conversation_message(snapshot.id)
-            if latest_message is not None:
-                summary["latestMessage"] = latest_message
-            conversations.append(summary)
+            if summary:
+                conversations.append(summary)
 
         conversations.sort(
             key=lambda item: item.get("updatedAt") or item.get("createdAt") or 0,
             reverse=True,
         )
-        return jsonify({"conversations": conversations[:limit]})
+        del conversations[limit:]
+
+        def with_latest_message(summary: Dict[str, Any]) -> Dict[str, Any]:
+            latest_message = _get_latest_conversation_message(summary["id"])
+            if latest_message is not None:
+                summary["latestMessage"] = latest_message
+            return summary
+
+        if _wants_ndjson():
+            return _ndjson_response(map(with_latest_message, conversations))
+        return jsonify({"conversations": [with_latest_message(summary) for summary in conversations]})
     except Exception as exc:
         logger.error("Failed to list conversations: %s", exc)
         return jsonify({"error": "Failed to load conversations"}), 500
@@ -1674,8 +5537,9 @@ def list_conversations():
 
 @app.route('/api/conversations/<conversation_id>', methods=['GET'])
 @auth_required
+@admission_control("standard")
 def get_conversation(conversation_id):
-    if db is None:
+    if get_db() is None:
         return jsonify({"error": "Firebase not configured"}), 503
 
     snapshot = _load_conversation_snapshot(conversation_id)
@@ -1692,8 +5556,9 @@ def get_conversation(conversation_id):
 
 @app.route('/api/conversations/<conversation_id>/messages', methods=['GET'])
 @auth_required
+@admission_control("standard")
 def list_conversation_messages(conversation_id):
-    if db is None:
+    if get_db() is None:
         return jsonify({"messages": []}), 503
 
     snapshot = _load_conversation_snapshot(conversation_id)
@@ -1715,14 +5580,18 @@ def list_conversation_messages(conversation_id):
         return jsonify({"error": "Conversation not found"}), 404
 
     try:
-        message_docs = list(
-            messages_ref.order_by("timestamp", direction=admin_firestore.Query.ASCENDING).stream()
-        )
-        messages = [_serialize_message_snapshot(doc) for doc in message_docs[-limit:]]
+        # Read only the newest ``limit`` messages, then return them oldest first.
+        records = [
+            _MessageRecord(doc)
+            for doc in messages_ref.order_by("timestamp", direction=admin_firestore.Query.DESCENDING)
+            .limit(limit)
+            .stream()
+        ]
+        records.reverse()
         return jsonify(
             {
                 "conversation": summary,
-                "messages": messages,
+                "messages": [record.to_json() for record in records],
             }
         )
     except Exception as exc:
@@ -1732,8 +5601,10 @@ def list_conversation_messages(conversation_id):
 
 @app.route('/api/conversations/<conversation_id>/messages', methods=['POST'])
 @auth_required
+@admission_control("standard")
+@idempotent
 def send_conversation_message(conversation_id):
-    if db is None:
+    if get_db() is None:
         return jsonify({"error": "Firebase not configured"}), 503
 
     payload = request.get_json(silent=True) or {}
@@ -1823,7 +5694,7 @@ def send_conversation_message(conversation_id):
             "status": "sent",
             "conversationId": conversation_id,
             "message": message,
-            "emotionAnalysis": analysis,
+            "emotionAnalysis": _serialize_emotion_analysis(analysis),
             "notificationSummary": notification_summary,
         }
     )
@@ -1831,6 +5702,7 @@ def send_conversation_message(conversation_id):
 
 @app.route('/api/emotion/analyze', methods=['POST'])
 @auth_required
+@admission_control("low")
 def analyze_emotion():
     payload = request.get_json(silent=True) or {}
     text = (payload.get("text") or payload.get("message") or "").strip()
@@ -1854,8 +5726,39 @@ def analyze_emotion():
     )
     return jsonify({"analysis": _serialize_emotion_analysis(analysis)})
 
+def _mirror_sos_report(
+    *,
+    user_id: str,
+    sender_name: str,
+    emergency_type: str,
+    message: str,
+    latitude: float,
+    longitude: float,
+    alert_id: str,
+) -> None:
+    # Mirror alert in sos collection to satisfy Firestore schema expectations
+    try:
+        now = datetime.now(timezone.utc)
+        get_db().collection("sos").add(
+            {
+                "emergencyType": emergency_type,
+                "Name": sender_name,
+                "location": {"latitude": latitude, "longitude": longitude},
+                "text": message,
+                "Date": now.strftime("%Y-%m-%d"),
+                "Time": now.strftime("%H:%M:%S%z"),
+                "userId": user_id,
+                "alertId": alert_id,
+            }
+        )
+    except Exception as sos_error:
+        logger.warning("Failed to mirror SOS alert to sos collection: %s", sos_error)
+
+
 @app.route('/api/send-sos', methods=['POST'])
 @auth_required
+@admission_control("critical")
+@idempotent
 def send_sos():
     data = request.json
     user_id = request.user['uid']
@@ -1870,7 +5773,7 @@ def send_sos():
     if not message:
         return jsonify({"error": "Message is required"}), 400
     
-    if db is None:
+    if get_db() is None:
         logger.warning("Firebase not configured – returning mock SOS response")
         return jsonify(
             {
@@ -1887,10 +5790,8 @@ def send_sos():
     except (TypeError, ValueError):
         return jsonify({"error": "Invalid latitude/longitude"}), 400
 
-    nearest_users = get_nearest_neighbors(current_lat, current_lng, user_id, limit=4)
-    recipient_ids = [user["userId"] for user in nearest_users]
-
-    sender_profile = get_user_data(user_id)
+    with span("sender_profile"):
+        sender_profile = get_user_data(user_id)
     sender_name = (
         sender_profile.get("displayName")
         if sender_profile
@@ -1899,30 +5800,80 @@ def send_sos():
         or "User"
     )
 
+    with span("cluster_lookup"):
+        cluster_snapshot = _find_sos_cluster(current_lat, current_lng, emergency_type)
+    if cluster_snapshot is not None:
+        try:
+            with span("cluster_merge", alert_id=cluster_snapshot.id):
+                merged = _merge_sos_report(
+                    cluster_snapshot.reference,
+                    user_id=user_id,
+                    sender_name=sender_name,
+                    message=message,
+                )
+        except Exception as merge_error:
+            logger.warning("Failed to merge SOS into alert %s: %s", cluster_snapshot.id, merge_error)
+            merged = None
+        if merged:
+            with span("sos_mirror"):
+                _mirror_sos_report(
+                    user_id=user_id,
+                    sender_name=sender_name,
+                    emergency_type=emergency_type,
+                    message=message,
+                    latitude=current_lat,
+                    longitude=current_lng,
+                    alert_id=merged["alertId"],
+                )
+            logger.info(
+                "SOS merged - User: %s, Alert: %s, Reporters: %d",
+                user_id,
+                merged["alertId"],
+                merged["reporterCount"],
+            )
+            return jsonify(
+                {
+                    "status": "sos_merged",
+                    "recipients": merged["recipients"],
+                    "alertId": merged["alertId"],
+                    "reporterCount": merged["reporterCount"],
+                    "message": "SOS merged into an active incident nearby",
+                    "notificationSummary": {"recipientCount": 0, "sent": 0, "failed": 0, "results": []},
+                }
+            )
+
+    with span("neighbour_scan"):
+        nearest_users = get_nearest_neighbors(current_lat, current_lng, user_id, limit=4)
+    recipient_ids = [user["userId"] for user in nearest_users]
+
     alert_payload = {
         "userId": user_id,
         "senderDisplayName": sender_name,
         "message": message,
         "emergencyType": emergency_type,
         "location": admin_firestore.GeoPoint(current_lat, current_lng),
+        "geohash": _geohash(current_lat, current_lng),
         "status": "active",
         "createdAt": admin_firestore.SERVER_TIMESTAMP,
         "recipients": recipient_ids,
+        "reporterIds": [user_id],
+        "reporterCount": 1,
     }
 
-    ai_insights = analyze_sos_message(
-        {
-            "userId": user_id,
-            "message": message,
-            "emergencyType": emergency_type,
-            "latitude": current_lat,
-            "longitude": current_lng,
-        },
-        nearest_users,
-    )
+    with span("sos_analysis"):
+        ai_insights = analyze_sos_message(
+            {
+                "userId": user_id,
+                "message": message,
+                "emergencyType": emergency_type,
+                "latitude": current_lat,
+                "longitude": current_lng,
+            },
+            nearest_users,
+        )
     if ai_insights:
         alert_payload["aiInsights"] = {
-            "model": AI_MODEL_NAME,
+            "model": ai_insights.get("model") or AI_MODEL_NAME,
             "analysis": ai_insights.get("analysis"),
             "reasoning": ai_insights.get("reasoning"),
             "structured": ai_insights.get("structured"),
@@ -1930,30 +5881,24 @@ def send_sos():
         }
 
     try:
-        alert_ref = db.collection("alerts").document()
-        alert_ref.set(alert_payload)
+        with span("alert_write"):
+            alert_ref = get_db().collection("alerts").document()
+            alert_ref.set(alert_payload)
         alert_id = alert_ref.id
     except Exception as firestore_error:
         logger.error("Failed to create alert document: %s", firestore_error)
         return jsonify({"error": "Failed to record SOS alert"}), 500
 
-    # Mirror alert in sos collection to satisfy Firestore schema expectations
-    try:
-        now = datetime.now(timezone.utc)
-        db.collection("sos").add(
-            {
-                "emergencyType": emergency_type,
-                "Name": sender_name,
-                "location": {"latitude": current_lat, "longitude": current_lng},
-                "text": message,
-                "Date": now.strftime("%Y-%m-%d"),
-                "Time": now.strftime("%H:%M:%S%z"),
-                "userId": user_id,
-                "alertId": alert_id,
-            }
+    with span("sos_mirror"):
+        _mirror_sos_report(
+            user_id=user_id,
+            sender_name=sender_name,
+            emergency_type=emergency_type,
+            message=message,
+            latitude=current_lat,
+            longitude=current_lng,
+            alert_id=alert_id,
         )
-    except Exception as sos_error:
-        logger.warning("Failed to mirror SOS alert to sos collection: %s", sos_error)
 
     logger.info(
         "SOS Alert sent - User: %s, Location: (%s, %s), Type: %s, Recipients: %d",
@@ -1964,19 +5909,20 @@ def send_sos():
         len(recipient_ids),
     )
 
-    notification_summary = _send_push_notifications_to_users(
-        recipient_ids,
-        title=f"New {emergency_type} SOS nearby",
-        body=message[:120],
-        data={
-            "type": "alert",
-            "alertId": alert_id,
-            "emergencyType": emergency_type,
-            "senderId": user_id,
-            "senderName": sender_name,
-        },
-        exclude_user_id=user_id,
-    )
+    with span("push_fanout", recipients=len(recipient_ids)):
+        notification_summary = _send_push_notifications_to_users(
+            recipient_ids,
+            title=f"New {emergency_type} SOS nearby",
+            body=message[:120],
+            data={
+                "type": "alert",
+                "alertId": alert_id,
+                "emergencyType": emergency_type,
+                "senderId": user_id,
+                "senderName": sender_name,
+            },
+            exclude_user_id=user_id,
+        )
 
     response_payload = {
         "status": "sos_sent",
@@ -1987,7 +5933,7 @@ def send_sos():
     }
     if ai_insights:
         response_payload["aiInsights"] = {
-            "model": AI_MODEL_NAME,
+            "model": ai_insights.get("model") or AI_MODEL_NAME,
             "analysis": ai_insights.get("analysis"),
             "reasoning": ai_insights.get("reasoning"),
             "structured": ai_insights.get("structured"),
@@ -1997,8 +5943,9 @@ def send_sos():
 
 @app.route('/api/alerts/nearby', methods=['POST'])
 @auth_required
+@admission_control("standard")
 def get_nearby_alerts():
-    if db is None:
+    if get_db() is None:
         logger.warning("Firebase not configured – returning empty alert list")
         return jsonify({"alerts": []}), 200
 
@@ -2016,89 +5963,50 @@ def get_nearby_alerts():
         radius_km = float(radius_km)
     except (TypeError, ValueError):
         return jsonify({"error": "Invalid latitude, longitude or radius"}), 400
+    if not all(math.isfinite(value) for value in (current_lat, current_lng, radius_km)):
+        return jsonify({"error": "Invalid latitude, longitude or radius"}), 400
+    radius_km = min(max(radius_km, 0.0), NEARBY_ALERT_MAX_RADIUS_KM)
 
-    max_age_minutes = payload.get("maxAgeMinutes", 180)
+    max_age_minutes = payload.get("maxAgeMinutes", DEFAULT_ALERT_MAX_AGE_MINUTES)
     try:
         max_age_minutes = float(max_age_minutes)
     except (TypeError, ValueError):
-        max_age_minutes = 180
+        max_age_minutes = DEFAULT_ALERT_MAX_AGE_MINUTES
 
-    now_seconds = time.time()
-    max_age_seconds = max_age_minutes * 60
     user_id = request.user["uid"]
 
     try:
-        alert_docs = db.collection("alerts").where("status", "==", "active").stream()
+        # Each cell query is capped too; this keeps the nearest matches after the radius filter.
+        matches = _active_alerts_near(
+            current_lat, current_lng, radius_km, since=_freshness_cutoff(max_age_minutes * 60)
+        )[:NEARBY_ALERT_QUERY_LIMIT]
     except Exception as firestore_error:
         logger.error("Failed to load alerts: %s", firestore_error)
         return jsonify({"error": "Failed to load alerts"}), 500
 
-    alerts = []
-    for alert_doc in alert_docs:
-        alert_data = alert_doc.to_dict() or {}
-        location = alert_data.get("location")
-        if not location or not hasattr(location, "latitude"):
-            # Compatibility with older documents that stored dicts
-            lat = (
-                location.get("latitude")
-                if isinstance(location, dict)
-                else None
-            )
-            lng = (
-                location.get("longitude")
-                if isinstance(location, dict)
-                else None
-            )
-        else:
-            lat = location.latitude
-            lng = location.longitude
-
-        if lat is None or lng is None:
-            continue
-
-        try:
-            lat = float(lat)
-            lng = float(lng)
-        except (TypeError, ValueError):
-            continue
-
-        distance = haversine(current_lat, current_lng, lat, lng)
-        if distance > radius_km:
-            continue
+    nearby = [
+        _NearbyAlert(alert_doc, alert_data, lat, lng, distance)
+        for alert_doc, alert_data, (lat, lng), distance in matches
+    ]
+    nearby.sort(key=attrgetter("distance"))
+    if _wants_ndjson():
 
-        created_at = alert_data.get("createdAt")
-        created_seconds = (
-            created_at.timestamp() if hasattr(created_at, "timestamp") else None
-        )
-        if created_seconds and now_seconds - created_seconds > max_age_seconds:
-            continue
+        def stream_alerts() -> Iterator[Dict[str, Any]]:
+            for alert in nearby:
+                alert.responses = fetch_alert_responses(alert.reference)
+                yield alert.to_json(user_id)
+                alert.responses = []
 
-        responses = fetch_alert_responses(alert_doc.reference)
-        ai_insights = alert_data.get("aiInsights")
-        if isinstance(ai_insights, dict):
-            ai_insights = dict(ai_insights)
-            generated_at = ai_insights.get("generatedAt")
-            if hasattr(generated_at, "timestamp"):
-                ai_insights["generatedAt"] = int(generated_at.timestamp() * 1000)
+        def feed_summary() -> Dict[str, Any]:
+            # Sent last, so clients render the alerts without waiting for the model.
+            ai_summary = summarize_alert_feed(alert.to_json(user_id) for alert in nearby)
+            return {"aiSummary": {"model": AI_MODEL_NAME, "summary": ai_summary} if ai_summary else None}
 
-        alerts.append(
-            {
-                "id": alert_doc.id,
-                "userId": alert_data.get("userId"),
-                "userName": alert_data.get("senderDisplayName") or "User",
-                "message": alert_data.get("message"),
-                "emergencyType": alert_data.get("emergencyType"),
-                "status": alert_data.get("status"),
-                "distance": round(distance, 2),
-                "location": {"latitude": lat, "longitude": lng},
-                "createdAt": int(created_seconds * 1000) if created_seconds else None,
-                "isOwnAlert": alert_data.get("userId") == user_id,
-                "responses": responses,
-                "aiInsights": ai_insights,
-            }
-        )
+        return _ndjson_response(stream_alerts(), feed_summary)
 
-    alerts.sort(key=lambda alert: alert["distance"])
+    for alert in nearby:
+        alert.responses = fetch_alert_responses(alert.reference)
+    alerts = [alert.to_json(user_id) for alert in nearby]
     response_payload = {"alerts": alerts}
     ai_summary = summarize_alert_feed(alerts)
     if ai_summary:
@@ -2111,8 +6019,10 @@ def get_nearby_alerts():
 
 @app.route('/api/alerts/<alert_id>/respond', methods=['POST'])
 @auth_required
+@admission_control("critical")
+@idempotent
 def respond_to_alert(alert_id):
-    if db is None:
+    if get_db() is None:
         logger.warning("Firebase not configured – ignoring alert response")
         return jsonify({"status": "unavailable"}), 200
 
@@ -2132,7 +6042,7 @@ def respond_to_alert(alert_id):
     )
 
     try:
-        alert_ref = db.collection("alerts").document(alert_id)
+        alert_ref = get_db().collection("alerts").document(alert_id)
         alert_snapshot = alert_ref.get()
         if not alert_snapshot.exists:
             return jsonify({"error": "Alert not found"}), 404
@@ -2213,60 +6123,369 @@ def respond_to_alert(alert_id):
         }
     )
 
+def _chat_history_items(doc_snapshot) -> List[Dict[str, Any]]:
+    chat_data = doc_snapshot.to_dict() or {}
+    timestamp = chat_data.get("timestamp")
+    ts_value = (
+        timestamp.timestamp() if hasattr(timestamp, "timestamp") else None
+    )
+    question = chat_data.get("question")
+    answer = chat_data.get("response")
+    items = []
+    if question:
+        items.append(
+            {
+                "id": f"{doc_snapshot.id}_question",
+                "sender": "user",
+                "text": question,
+                "timestamp": ts_value,
+            }
+        )
+    if answer:
+        items.append(
+            {
+                "id": f"{doc_snapshot.id}_answer",
+                "sender": "ai",
+                "text": answer,
+                "timestamp": ts_value,
+                "model": chat_data.get("model"),
+            }
+        )
+    return items
+
+
 @app.route('/chats', methods=['GET'])
 @auth_required
+@admission_control("standard")
 def get_chats():
-    if not db:
+    """Page through chat history newest-first.
+
+    ``before`` is the chat id cursor returned as ``nextCursor``; ``since`` (epoch ms)
+    returns only chats newer than the client's last sync. Each page is emitted in
+    chronological order and carries an ETag derived from the newest chat.
+    """
+    if get_db() is None:
         logger.warning("Firestore not configured – returning empty chat history")
         return jsonify({"history": []})
     user_id = request.user['uid']
+
     try:
-        chat_query = (
-            db.collection("users")
-            .document(user_id)
-            .collection("chats")
-            .order_by("timestamp", direction=admin_firestore.Query.ASCENDING)
+        limit = int(request.args.get("limit", DEFAULT_CHAT_HISTORY_LIMIT))
+    except (TypeError, ValueError):
+        limit = DEFAULT_CHAT_HISTORY_LIMIT
+    limit = max(1, min(limit, 200))
+    before = (request.args.get("before") or "").strip()
+    since = request.args.get("since")
+    since_dt = None
+    if since:
+        try:
+            # Timestamps are reported truncated to whole milliseconds, so skip the rest of that one.
+            since_dt = datetime.fromtimestamp((int(float(since)) + 1) / 1000, tz=timezone.utc)
+        except (TypeError, ValueError, OverflowError, OSError):
+            return jsonify({"error": "since must be a timestamp in milliseconds"}), 400
+
+    try:
+        chats_ref = get_db().collection("users").document(user_id).collection("chats")
+        newest_query = chats_ref.order_by("timestamp", direction=admin_firestore.Query.DESCENDING).limit(1)
+        newest = next(iter(newest_query.stream()), None)
+        newest_ts = _timestamp_to_ms((newest.to_dict() or {}).get("timestamp")) if newest else None
+        ndjson = _wants_ndjson()
+        etag = _stable_hash(
+            f"{user_id}|{newest.id if newest else ''}|{newest_ts}|{limit}|{before}|{since}|{'ndjson' if ndjson else 'json'}"
         )
-        history = []
-        for doc_snapshot in chat_query.stream():
-            chat_data = doc_snapshot.to_dict() or {}
-            timestamp = chat_data.get("timestamp")
-            ts_value = (
-                timestamp.timestamp() if hasattr(timestamp, "timestamp") else None
-            )
-            question = chat_data.get("question")
-            answer = chat_data.get("response")
-            if question:
-                history.append(
-                    {
-                        "id": f"{doc_snapshot.id}_question",
-                        "sender": "user",
-                        "text": question,
-                        "timestamp": ts_value,
-                    }
-                )
-            if answer:
-                history.append(
-                    {
-                        "id": f"{doc_snapshot.id}_answer",
-                        "sender": "ai",
-                        "text": answer,
-                        "timestamp": ts_value,
-                        "model": chat_data.get("model"),
-                    }
-                )
-        return jsonify({"history": history})
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+
+        chat_query = chats_ref.order_by("timestamp", direction=admin_firestore.Query.DESCENDING)
+        if since_dt is not None:
+            chat_query = chat_query.where("timestamp", ">=", since_dt)
+        if before:
+            cursor_snapshot = chats_ref.document(before).get()
+            if not cursor_snapshot.exists:
+                return jsonify({"error": "Unknown history cursor"}), 400
+            chat_query = chat_query.start_after(cursor_snapshot)
+
+        chat_docs = list(chat_query.limit(limit + 1).stream())
+        has_more = len(chat_docs) > limit
+        chat_docs = chat_docs[:limit]
+
+        page = {
+            "hasMore": has_more,
+            "nextCursor": chat_docs[-1].id if has_more and chat_docs else None,
+            "latestTimestamp": newest_ts,
+        }
+        if ndjson:
+            history_items = itertools.chain.from_iterable(map(_chat_history_items, reversed(chat_docs)))
+            response = _ndjson_response(history_items, lambda: page)
+        else:
+            history = []
+            for doc_snapshot in reversed(chat_docs):
+                history.extend(_chat_history_items(doc_snapshot))
+            response = jsonify({"history": history, **page})
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        response.vary.add("Accept")
+        return response
     except Exception as e:
         logger.error("Error fetching chat history: %s", e)
         return jsonify({"error": "An error occurred while fetching chat history"}), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if not METRICS_TOKEN:
+        return jsonify({"error": "Metrics are not exposed; set METRICS_TOKEN"}), 403
+    if not hmac.compare_digest(request.headers.get("X-Metrics-Token", "").encode(), METRICS_TOKEN.encode()):
+        return jsonify({"error": "Invalid metrics token"}), 401
+    if not METRICS_ENABLED:
+        return jsonify({"status": "disabled"}), 404
+    return Response(_metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+@auth_required
+def get_request_profile(profile_id):
+    if (getattr(request, "user", None) or {}).get("admin") is not True:
+        return jsonify({"error": "Admin access required"}), 403
+    if not re.fullmatch(r"[0-9]+-[0-9a-f]{12}", profile_id):
+        return jsonify({"error": "Invalid profile id"}), 400
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.folded")
+    if not os.path.exists(path):
+        return jsonify({"error": "Profile not found"}), 404
+    with open(path, encoding="utf-8") as handle:
+        return Response(handle.read(), mimetype="text/plain")
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify(
+        {
+            "status": "ok",
+            "firestore": db is not None,
+            "groq": groq_available(),
+            "groqBreaker": _groq_breaker.snapshot(),
+            "llmGateway": _llm_gateway.snapshot(),
+            "modelRouter": _model_router.snapshot(),
+            "groqTransport": _groq_transport_stats.snapshot(),
+            "askCache": _ask_cache.snapshot(),
+            "chatWriter": _chat_writer.snapshot(),
+            "locationIndex": _location_index.snapshot(),
+            "admission": admission_stats(),
+        }
+    )
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: initialises this worker's clients on demand; 503 until Firestore is usable."""
+    components = warm_backends(retry=True)
+    status_code = 200 if components["firestore"] else 503
+    return jsonify({"status": "ready" if status_code == 200 else "unavailable", **components}), status_code
+
 @app.route('/api/cleanup-chats', methods=['POST'])
 def cleanup_chats():
     return jsonify({"status": "disabled"}), 200
 
+@app.route('/api/maintenance/alerts', methods=['POST'])
+def maintain_alerts():
+    if not MAINTENANCE_TOKEN:
+        return jsonify({"status": "disabled"}), 200
+    if not hmac.compare_digest(request.headers.get("X-Maintenance-Token", "").encode(), MAINTENANCE_TOKEN.encode()):
+        return jsonify({"error": "Invalid maintenance token"}), 401
+    if get_db() is None:
+        return jsonify({"error": "Firebase not configured"}), 503
+
+    try:
+        summary = run_alert_lifecycle()
+    except Exception as exc:
+        logger.error("Alert lifecycle run failed: %s", exc, exc_info=True)
+        return jsonify({"error": "Alert lifecycle run failed"}), 500
+    return jsonify({"status": "completed", **summary})
+
+
+@app.cli.command("location-index")
+def location_index_command():
+    """Run the single updater process for the shared location index (LOCATION_INDEX_PATH)."""
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+    run_location_index_updater(stop)
+
+
+@app.cli.command("backfill-alert-geohashes")
+def backfill_alert_geohashes_command():
+    """Add the geohash used by nearby-alert queries to active alerts that predate it."""
+    print(json.dumps({"updated": backfill_alert_geohashes()}))
+
+
+@app.cli.command("maintain-alerts")
+def maintain_alerts_command():
+    """Expire inactive alerts and enforce the active-alert cap (cron entry point)."""
+    summary = run_alert_lifecycle()
+    print(json.dumps(summary))
+
+_REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+_TRACEPARENT_PATTERN = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+@app.before_request
+def start_request_trace():
+    if not TRACING_ENABLED:
+        return
+    trace_id, remote_parent = uuid.uuid4().hex, None
+    traceparent = _TRACEPARENT_PATTERN.match(request.headers.get("traceparent", "").strip().lower())
+    if traceparent:
+        trace_id, remote_parent = traceparent.group(1), traceparent.group(2)
+    request_id = request.headers.get("X-Request-ID", "").strip()
+    if not _REQUEST_ID_PATTERN.match(request_id):
+        request_id = trace_id
+    trace = _Trace(request_id, trace_id, remote_parent)
+    g.trace = trace
+    g.trace_tokens = (_current_trace.set(trace), _current_span_id.set(None))
+
+
+@app.after_request
+def add_trace_headers(response):
+    trace = g.get("trace")
+    if trace is None:
+        return response
+    g.trace_status = response.status_code
+    response.headers["X-Request-ID"] = trace.request_id
+    # Stages finished so far; for streams that is everything before the first byte.
+    timings = [
+        f"{re.sub(r'[^A-Za-z0-9_-]', '_', name)};dur={duration:.1f}"
+        for name, duration in trace.stage_timings()[:12]
+    ]
+    timings.append(f"total;dur={(time.time_ns() - trace.started_ns) / 1e6:.1f}")
+    response.headers["Server-Timing"] = ", ".join(timings)
+    return response
+
+
+@app.teardown_request
+def finish_request_trace(exc):
+    # Runs after a streamed body is done; copied contexts on helper threads have no trace in ``g``.
+    trace = g.pop("trace", None)
+    if trace is None:
+        return
+    trace_token, span_token = g.pop("trace_tokens")
+    route = request.url_rule.rule if request.url_rule else "<unmatched>"
+    try:
+        _export_trace(
+            trace,
+            f"{request.method} {route}",
+            time.time_ns(),
+            {
+                "http.method": request.method,
+                "http.route": route,
+                "http.status_code": g.pop("trace_status", None),
+                "user.id": (getattr(request, "user", None) or {}).get("uid"),
+                "error": f"{type(exc).__name__}: {exc}" if exc is not None else None,
+            },
+        )
+    finally:
+        try:
+            _current_span_id.reset(span_token)
+            _current_trace.reset(trace_token)
+        except ValueError:
+            # Reset from a different context (some servers finish streams elsewhere).
+            _current_span_id.set(None)
+            _current_trace.set(None)
+
+
+@app.after_request
+def add_profile_header(response):
+    profiler = g.get("profiler")
+    if profiler is not None:
+        response.headers["X-Profile-Id"] = profiler.profile_id
+    return response
+
+
+@app.teardown_request
+def finish_request_profile(exc):
+    # Teardown runs after a streamed body is finished, so the profile covers the whole stream.
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return
+    token = g.pop("profiler_token", None)
+    try:
+        path = profiler.stop()
+        logger.info("Stored %d-sample profile for %s at %s", profiler.samples, request.path, path)
+    except OSError as write_error:
+        logger.warning("Failed to store profile %s: %s", profiler.profile_id, write_error)
+    finally:
+        try:
+            _current_profiler.reset(token)
+        except ValueError:
+            _current_profiler.set(None)
+
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_started = time.monotonic()
+    _metrics.inc("http_requests_in_flight", {})
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get("metrics_started")
+    if started is not None:
+        # Unmatched paths share one label so scanners cannot blow up the series count.
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        labels = {"route": route, "method": request.method}
+        _metrics.observe("http_request_duration_seconds", labels, time.monotonic() - started)
+        _metrics.inc("http_requests_total", {**labels, "status": response.status_code})
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    # Streams keep the request context until the body is done, so this also covers SSE.
+    # Contexts copied onto helper threads get a fresh ``g`` and are skipped here.
+    if g.pop("metrics_started", None) is not None:
+        _metrics.inc("http_requests_in_flight", {}, -1.0)
+
+
 @app.after_request
 def add_cors_headers(response):
     return response
 
+def _install_local_backends() -> None:
+    global RATE_LIMIT_ENABLED
+    # ENV defaults to development, so only an explicit setting counts as consent.
+    if os.environ.get("FLASK_ENV") != "development":
+        raise RuntimeError("LOCAL_BACKENDS=1 accepts any bearer token and requires FLASK_ENV=development to be set")
+    import local_backends
+
+    groq_stub = local_backends.ScriptedGroq()
+    configure_backends(
+        firestore=local_backends.InMemoryFirestore(),
+        groq_client=groq_stub,
+        push_sender=local_backends.PushSink(latency=LOCAL_FCM_LATENCY_SECONDS),
+        token_verifier=local_backends.fake_token_verifier,
+    )
+    logger.warning("LOCAL_BACKENDS=1: serving from in-memory stand-ins; bearer tokens are treated as uids.")
+    if LOCAL_SEED:
+        # Seed at full speed and without admission control, then switch on the simulated latency.
+        rate_limit_enabled, RATE_LIMIT_ENABLED = RATE_LIMIT_ENABLED, False
+        try:
+            world = local_backends.seed_dataset(app, **LOCAL_SEED)
+            _chat_writer.flush()
+        finally:
+            RATE_LIMIT_ENABLED = rate_limit_enabled
+        logger.info(
+            "Seeded %s users, %s alerts and %s conversations",
+            len(world.users),
+            len(world.alerts),
+            len(world.conversations),
+        )
+    groq_stub.latency = LOCAL_GROQ_LATENCY_SECONDS
+    groq_stub.token_latency = LOCAL_GROQ_TOKEN_LATENCY_SECONDS
+
+
+if LOCAL_BACKENDS:
+    _install_local_backends()
+
 if __name__ == '__main__':
+    if GROQ_WARMUP:
+        threading.Thread(target=warm_groq_client, name="groq-warmup", daemon=True).start()
     app.run(debug=DEBUG, host='0.0.0.0', port=PORT)
@@ -0,0 +1,287 @@
+"""End-to-end route benchmark against the in-memory backends.
+
+Seeds users, live locations, alerts, conversations and chat history through
+the API itself (so documents have the exact shape the routes write), then
+drives every route with the Flask test client and reports throughput and
+p50/p99 latency per route. Runs are reproducible for a given --seed.
+
+    cd backend
+    python benchmarks/e2e_benchmark.py --users 500 --alerts 100 --requests 200 --concurrency 4
+    python benchmarks/e2e_benchmark.py --groq-latency 0.3 --json results.json
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Benchmarks measure route cost, not admission control or answer caching.
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+os.environ.setdefault("ASK_CACHE_ENABLED", "0")
+os.environ.setdefault("GROQ_WARMUP", "0")
+
+import app  # noqa: E402
+from local_backends import (  # noqa: E402
+    ASK_QUESTIONS,
+    EMERGENCY_TYPES,
+    InMemoryFirestore,
+    PushSink,
+    ScriptedGroq,
+    SeededWorld,
+    fake_token_verifier,
+    offset_point,
+    seed_dataset,
+)
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def headers(uid: str) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {uid}"}
+
+
+Scenario = Callable[[Any, random.Random], Any]
+
+
+def build_scenarios(world: SeededWorld) -> Dict[str, Scenario]:
+    def near(rng: random.Random) -> Tuple[str, float, float]:
+        uid = rng.choice(world.users)
+        lat, lng = world.positions[uid]
+        return uid, lat, lng
+
+    def location(client, rng):
+        uid, lat, lng = near(rng)
+        lat, lng = offset_point(rng, lat, lng, 0.2)
+        world.positions[uid] = (lat, lng)
+        return client.post("/api/location", json={"latitude": lat, "longitude": lng, "accuracy": 15}, headers=headers(uid))
+
+    def nearest_users(client, rng):
+        uid, lat, lng = near(rng)
+        return client.post("/api/nearest-users", json={"latitude": lat, "longitude": lng}, headers=headers(uid))
+
+    def alerts_nearby(client, rng):
+        uid, lat, lng = near(rng)
+        return client.post("/api/alerts/nearby", json={"latitude": lat, "longitude": lng, "radius": 10}, headers=headers(uid))
+
+    def send_sos(client, rng):
+        uid, lat, lng = near(rng)
+        return client.post(
+            "/api/send-sos",
+            json={"latitude": lat, "longitude": lng, "message": "Help needed.", "emergencyType": rng.choice(EMERGENCY_TYPES)},
+            headers=headers(uid),
+        )
+
+    def respond(client, rng):
+        return client.post(
+            f"/api/alerts/{rng.choice(world.alerts)}/respond",
+            json={"message": "On my way."},
+            headers=headers(rng.choice(world.users)),
+        )
+
+    def list_conversations(client, rng):
+        _, owner = rng.choice(world.conversations)
+        return client.get("/api/conversations", headers=headers(owner))
+
+    def get_conversation(client, rng):
+        conversation_id, owner = rng.choice(world.conversations)
+        return client.get(f"/api/conversations/{conversation_id}", headers=headers(owner))
+
+    def list_messages(client, rng):
+        conversation_id, owner = rng.choice(world.conversations)
+        return client.get(f"/api/conversations/{conversation_id}/messages", headers=headers(owner))
+
+    def post_message(client, rng):
+        conversation_id, owner = rng.choice(world.conversations)
+        return client.post(
+            f"/api/conversations/{conversation_id}/messages",
+            json={"text": "Are you safe now?"},
+            headers=headers(owner),
+        )
+
+    def emotion(client, rng):
+        return client.post(
+            "/api/emotion/analyze",
+            json={"text": "I'm scared, the water is rising fast."},
+            headers=headers(rng.choice(world.users)),
+        )
+
+    def ask(client, rng):
+        return client.post("/ask", json={"question": rng.choice(ASK_QUESTIONS)}, headers=headers(rng.choice(world.users)))
+
+    def ask_stream(client, rng):
+        response = client.post("/ask-stream", json={"question": rng.choice(ASK_QUESTIONS)}, headers=headers(rng.choice(world.users)))
+        response.get_data()
+        return response
+
+    def chats(client, rng):
+        return client.get("/chats", headers=headers(rng.choice(world.chat_users or world.users)))
+
+    def profile(client, rng):
+        return client.get("/user/profile", headers=headers(rng.choice(world.users)))
+
+    def health(client, rng):
+        return client.get("/health")
+
+    scenarios: Dict[str, Scenario] = {
+        "POST /api/location": location,
+        "POST /api/nearest-users": nearest_users,
+        "POST /api/alerts/nearby": alerts_nearby,
+        "POST /api/send-sos": send_sos,
+        "POST /api/emotion/analyze": emotion,
+        "POST /ask": ask,
+        "POST /ask-stream": ask_stream,
+        "GET /chats": chats,
+        "GET /user/profile": profile,
+        "GET /health": health,
+    }
+    if world.alerts:
+        scenarios["POST /api/alerts/<id>/respond"] = respond
+    if world.conversations:
+        scenarios.update(
+            {
+                "GET /api/conversations": list_conversations,
+                "GET /api/conversations/<id>": get_conversation,
+                "GET /api/conversations/<id>/messages": list_messages,
+                "POST /api/conversations/<id>/messages": post_message,
+            }
+        )
+    return scenarios
+
+
+def run_scenario(scenario: Scenario, requests: int, concurrency: int, seed: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+    per_worker = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+
+    def worker(index: int, count: int) -> None:
+        nonlocal errors
+        client = app.app.test_client()
+        rng = random.Random(seed * 1000 + index)
+        for _ in range(count):
+            started = time.perf_counter()
+            response = scenario(client, rng)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code >= 400:
+                    errors += 1
+
+    threads = [threading.Thread(target=worker, args=(i, n)) for i, n in enumerate(per_worker) if n]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / wall if wall else 0.0,
+        "p50Ms": percentile(latencies, 0.50) * 1000,
+        "p99Ms": percentile(latencies, 0.99) * 1000,
+        "maxMs": max(latencies, default=0.0) * 1000,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200, help="users to seed (each with a live location)")
+    parser.add_argument("--alerts", type=int, default=50, help="SOS alerts to seed")
+    parser.add_argument("--conversations", type=int, default=50, help="direct conversations to seed")
+    parser.add_argument("--messages", type=int, default=10, help="messages per seeded conversation")
+    parser.add_argument("--chat-users", type=int, default=20, help="users given /ask chat history")
+    parser.add_argument("--chat-turns", type=int, default=20, help="/ask turns per chat user")
+    parser.add_argument("--lat", type=float, default=37.7749, help="centre latitude of the seeded area")
+    parser.add_argument("--lng", type=float, default=-122.4194, help="centre longitude of the seeded area")
+    parser.add_argument("--radius", type=float, default=8.0, help="seeded area radius in km")
+    parser.add_argument("--requests", type=int, default=100, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=1, help="client threads per route")
+    parser.add_argument("--groq-latency", type=float, default=0.0, help="scripted Groq latency per call (s)")
+    parser.add_argument("--fcm-latency", type=float, default=0.0, help="FCM sink latency per send (s)")
+    parser.add_argument("--location-index", action="store_true", help="serve nearest-users from the shared location index")
+    parser.add_argument("--routes", default="", help="comma-separated substrings selecting routes to run")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for seeding and request mix")
+    parser.add_argument("--json", dest="json_path", help="also write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    logging.getLogger(app.logger.name).setLevel(logging.WARNING)
+    store = InMemoryFirestore()
+    push = PushSink(latency=args.fcm_latency)
+    app.configure_backends(
+        firestore=store,
+        groq_client=ScriptedGroq(latency=args.groq_latency),
+        push_sender=push,
+        token_verifier=fake_token_verifier,
+    )
+
+    seed_started = time.perf_counter()
+    world = seed_dataset(
+        app.app,
+        users=args.users,
+        alerts=args.alerts,
+        conversations=args.conversations,
+        messages=args.messages,
+        chat_users=args.chat_users,
+        chat_turns=args.chat_turns,
+        lat=args.lat,
+        lng=args.lng,
+        radius_km=args.radius,
+        seed=args.seed,
+    )
+    app._chat_writer.flush()
+    print(
+        f"seeded users={len(world.users)} alerts={len(world.alerts)} conversations={len(world.conversations)} "
+        f"documents={len(store.docs)} in {time.perf_counter() - seed_started:.1f}s"
+    )
+
+    index_stop = threading.Event()
+    if args.location_index:
+        app.LOCATION_INDEX_ENABLED = True
+        threading.Thread(target=app.run_location_index_updater, args=(index_stop,), daemon=True).start()
+        while not app._location_index.snapshot().get("available"):
+            time.sleep(0.05)
+        time.sleep(app.LOCATION_INDEX_POLL_SECONDS)
+
+    selected = [part.strip() for part in args.routes.split(",") if part.strip()]
+    results: Dict[str, Dict[str, Any]] = {}
+    print(f"{'route':<42} {'n':>6} {'err':>5} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, scenario in build_scenarios(world).items():
+        if selected and not any(part in name for part in selected):
+            continue
+        result = run_scenario(scenario, args.requests, max(1, args.concurrency), args.seed)
+        results[name] = result
+        print(
+            f"{name:<42} {result['requests']:>6} {result['errors']:>5} {result['throughput']:>9.1f} "
+            f"{result['p50Ms']:>9.2f} {result['p99Ms']:>9.2f} {result['maxMs']:>9.2f}"
+        )
+    app._chat_writer.flush()
+    index_stop.set()
+    print(f"firestore operations: {json.dumps(store.operations, sort_keys=True)}  pushes sent: {len(push.sent)}")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as handle:
+            json.dump(
+                {"config": vars(args), "firestoreOperations": store.operations, "routes": results},
+                handle,
+                indent=2,
+                default=str,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,436 @@
+"""Incident-surge load generator with a capacity curve per gunicorn configuration.
+
+Virtual users replay the traffic of a real incident:
+
+- location pings to /api/location;
+- polling of /api/alerts/nearby;
+- an SOS burst from the users closest to the incident point;
+- responders answering the incident's alerts via /api/alerts/<id>/respond;
+- conversation messages;
+- /ask-stream sessions.
+
+By default each worker configuration ("WORKERSxTHREADS") is started as a
+gunicorn server on the in-memory stand-ins (LOCAL_BACKENDS=1). The app is
+preloaded and seeded once, so all workers share the same starting dataset.
+The user count is then stepped up. For every step the tool reports per-operation
+p50/p99 latency, 5xx/transport errors and shed (429) requests. A step passes when
+its critical operations (send-sos, respond) stay within --slo-ms at an error rate
+of --max-error-rate or less. The capacity of a configuration is the last step
+before the first one that fails; later steps are still run and shown in the curve.
+
+    cd backend
+    python benchmarks/loadgen.py --configs 1x1,2x1,2x4 --steps 10,25,50,100 --duration 30
+    python benchmarks/loadgen.py --target http://127.0.0.1:5001 --steps 20   # already-running server
+
+Writes made during a run (new alerts, messages) live in the worker that handled
+them, so with several workers a response to a burst alert can land on a worker
+that never saw it and return 404. A 404 on a critical operation is counted as an
+error ("lost" in the report), so such a configuration fails its SLO instead of
+looking better than it is.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from local_backends import ASK_QUESTIONS, EMERGENCY_TYPES, offset_point, seeded_positions  # noqa: E402
+
+CRITICAL_OPERATIONS = ("send_sos", "respond")
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    d_lat = math.radians(lat2 - lat1)
+    d_lng = math.radians(lng2 - lng1)
+    a = math.sin(d_lat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(d_lng / 2) ** 2
+    return 6371.0 * 2 * math.asin(math.sqrt(a))
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(self, operation: str, status: str, elapsed: float) -> None:
+        with self.lock:
+            self.latencies[operation].append(elapsed)
+            self.statuses[operation][status] += 1
+
+    def summary(self, wall: float) -> Dict[str, Any]:
+        operations: Dict[str, Any] = {}
+        total = errors = 0
+        for operation, samples in sorted(self.latencies.items()):
+            statuses = dict(self.statuses[operation])
+            op_errors = statuses.get("5xx", 0) + statuses.get("transport", 0) + statuses.get("lost", 0)
+            total += len(samples)
+            errors += op_errors
+            operations[operation] = {
+                "requests": len(samples),
+                "ok": statuses.get("2xx", 0),
+                "shed": statuses.get("429", 0),
+                "clientErrors": statuses.get("4xx", 0),
+                "lost": statuses.get("lost", 0),
+                "errors": op_errors,
+                "p50Ms": percentile(samples, 0.50) * 1000,
+                "p99Ms": percentile(samples, 0.99) * 1000,
+            }
+        return {
+            "requests": total,
+            "lost": sum(stats["lost"] for stats in operations.values()),
+            "throughput": total / wall if wall else 0.0,
+            "errorRate": errors / total if total else 0.0,
+            "operations": operations,
+        }
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, index: int, uid: str, home: Tuple[float, float], plan: "IncidentPlan", recorder: Recorder):
+        super().__init__(name=f"vu-{index}", daemon=True)
+        self.uid = uid
+        self.position = home
+        self.plan = plan
+        self.recorder = recorder
+        self.rng = random.Random(plan.args.seed * 7919 + index)
+        self.responder = self.rng.random() < plan.args.responder_fraction
+        self.sos_at = plan.sos_schedule.get(uid)
+        self.conversations: List[str] = []
+        self.known_alerts: List[str] = []
+
+    def call(self, client: httpx.Client, operation: str, method: str, path: str, **kwargs) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            if operation == "ask_stream":
+                with client.stream(method, path, **kwargs) as response:
+                    for _ in response.iter_bytes():
+                        pass
+            else:
+                response = client.request(method, path, **kwargs)
+        except httpx.HTTPError:
+            self.recorder.record(operation, "transport", time.perf_counter() - started)
+            return None
+        code = response.status_code
+        if code == 429:
+            status = "429"
+        elif code == 404 and operation in CRITICAL_OPERATIONS:
+            status = "lost"
+        else:
+            status = f"{code // 100}xx"
+        self.recorder.record(operation, status, time.perf_counter() - started)
+        return response
+
+    def run(self) -> None:
+        args = self.plan.args
+        headers = {"Authorization": f"Bearer {self.uid}"}
+        with httpx.Client(base_url=self.plan.base_url, headers=headers, timeout=args.timeout) as client:
+            listing = self.call(client, "list_conversations", "GET", "/api/conversations")
+            if listing is not None and listing.status_code == 200:
+                self.conversations = [c["id"] for c in listing.json().get("conversations", []) if c.get("id")]
+
+            now = time.monotonic()
+            # Stagger first actions so virtual users do not fire in lockstep.
+            due = {
+                "location": now + self.rng.uniform(0, args.location_interval),
+                "poll": now + self.rng.uniform(0, args.poll_interval),
+                "message": now + self.rng.expovariate(1 / args.message_interval),
+                "ask": now + self.rng.expovariate(1 / args.ask_interval),
+            }
+            while not self.plan.stop.is_set():
+                action, when = min(due.items(), key=lambda item: item[1])
+                if self.sos_at is not None and self.plan.started + self.sos_at < when:
+                    action, when = "sos", self.plan.started + self.sos_at
+                if self.plan.stop.wait(max(0.0, when - time.monotonic())):
+                    break
+                if action == "sos":
+                    self.sos_at = None
+                    self.send_sos(client)
+                    continue
+                getattr(self, action)(client)
+                interval = {
+                    "location": args.location_interval,
+                    "poll": args.poll_interval / (2 if self.responder and self.plan.burst_started() else 1),
+                    "message": self.rng.expovariate(1 / args.message_interval),
+                    "ask": self.rng.expovariate(1 / args.ask_interval),
+                }[action]
+                due[action] = time.monotonic() + interval
+
+    def location(self, client: httpx.Client) -> None:
+        lat, lng = offset_point(self.rng, *self.position, 0.05)
+        self.position = (lat, lng)
+        self.call(client, "location", "POST", "/api/location", json={"latitude": lat, "longitude": lng, "accuracy": 12})
+
+    def poll(self, client: httpx.Client) -> None:
+        lat, lng = self.position
+        response = self.call(
+            client, "alerts_nearby", "POST", "/api/alerts/nearby", json={"latitude": lat, "longitude": lng, "radius": 5}
+        )
+        if response is None or response.status_code != 200:
+            return
+        alerts = [alert.get("id") for alert in response.json().get("alerts", []) if not alert.get("isOwnAlert")]
+        self.known_alerts = [alert_id for alert_id in alerts if alert_id]
+        if self.responder and self.known_alerts and self.plan.burst_started():
+            if self.rng.random() < self.plan.args.respond_probability:
+                self.call(
+                    client,
+                    "respond",
+                    "POST",
+                    f"/api/alerts/{self.rng.choice(self.known_alerts)}/respond",
+                    json={"message": "I'm nearby and on my way."},
+                )
+
+    def send_sos(self, client: httpx.Client) -> None:
+        lat, lng = self.position
+        self.call(
+            client,
+            "send_sos",
+            "POST",
+            "/api/send-sos",
+            json={
+                "latitude": lat,
+                "longitude": lng,
+                "message": "Building collapse, people trapped.",
+                "emergencyType": self.plan.args.incident_type,
+            },
+            headers={"Idempotency-Key": f"{self.uid}-{self.plan.run_id}"},
+        )
+
+    def message(self, client: httpx.Client) -> None:
+        if not self.conversations:
+            return
+        self.call(
+            client,
+            "message",
+            "POST",
+            f"/api/conversations/{self.rng.choice(self.conversations)}/messages",
+            json={"text": "Are you safe? Where are you now?"},
+        )
+
+    def ask(self, client: httpx.Client) -> None:
+        self.call(client, "ask_stream", "POST", "/ask-stream", json={"question": self.rng.choice(ASK_QUESTIONS)})
+
+
+class IncidentPlan:
+    """Shared run state: who sends SOS and when, relative to the stage start."""
+
+    def __init__(self, args: argparse.Namespace, base_url: str, positions: Dict[str, Tuple[float, float]], run_id: str):
+        self.args = args
+        self.base_url = base_url
+        self.run_id = run_id
+        self.stop = threading.Event()
+        self.started = time.monotonic()
+        incident = (args.incident_lat, args.incident_lng)
+        nearest = sorted(positions, key=lambda uid: haversine_km(*incident, *positions[uid]))
+        rng = random.Random(args.seed)
+        self.sos_schedule = {
+            uid: args.burst_at + rng.uniform(0, args.burst_window) for uid in nearest[: args.sos_burst]
+        }
+
+    def burst_started(self) -> bool:
+        return time.monotonic() >= self.started + self.args.burst_at
+
+
+def run_stage(args: argparse.Namespace, base_url: str, users: int, run_id: str) -> Dict[str, Any]:
+    positions = seeded_positions(args.seed_users, args.lat, args.lng, args.radius, args.seed)
+    uids = list(positions)[:users] if users <= len(positions) else [list(positions)[i % len(positions)] for i in range(users)]
+    active_positions = {uid: positions[uid] for uid in uids}
+    plan = IncidentPlan(args, base_url, active_positions, run_id)
+    recorder = Recorder()
+    threads = [VirtualUser(index, uid, positions[uid], plan, recorder) for index, uid in enumerate(uids)]
+    plan.started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    plan.stop.set()
+    for thread in threads:
+        thread.join(args.timeout + 1)
+    return recorder.summary(time.monotonic() - plan.started)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args: argparse.Namespace, workers: int, threads: int) -> Tuple[subprocess.Popen, str]:
+    port = free_port()
+    env = dict(os.environ)
+    env.update(
+        {
+            "LOCAL_BACKENDS": "1",
+            "FLASK_ENV": "development",
+            "GROQ_WARMUP": "0",
+            "LOCAL_SEED": json.dumps(
+                {
+                    "users": args.seed_users,
+                    "alerts": args.seed_alerts,
+                    "conversations": args.seed_conversations,
+                    "messages": 4,
+                    "chat_users": 0,
+                    "lat": args.lat,
+                    "lng": args.lng,
+                    "radius_km": args.radius,
+                    "seed": args.seed,
+                }
+            ),
+            "LOCAL_GROQ_LATENCY_SECONDS": str(args.groq_latency),
+            "LOCAL_FCM_LATENCY_SECONDS": str(args.fcm_latency),
+        }
+    )
+    command = [
+        sys.executable, "-m", "gunicorn",
+        "--bind", f"127.0.0.1:{port}",
+        "--workers", str(workers),
+        "--threads", str(threads),
+        "--timeout", "120",
+        "--log-level", "warning",
+        "app:app",
+    ]
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("gunicorn did not become healthy in time")
+
+
+def stop_server(process: subprocess.Popen) -> None:
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def within_slo(result: Dict[str, Any], args: argparse.Namespace) -> bool:
+    if result["errorRate"] > args.max_error_rate:
+        return False
+    return all(
+        result["operations"][operation]["p99Ms"] <= args.slo_ms
+        for operation in CRITICAL_OPERATIONS
+        if operation in result["operations"]
+    )
+
+
+def print_stage(label: str, users: int, result: Dict[str, Any], ok: bool) -> None:
+    print(
+        f"\n[{label}] users={users} req/s={result['throughput']:.1f} "
+        f"errorRate={result['errorRate']:.2%} {'within SLO' if ok else 'SLO VIOLATED'}"
+    )
+    print(
+        f"  {'operation':<20} {'n':>6} {'2xx':>6} {'429':>5} {'4xx':>5} {'lost':>5} {'err':>5} {'p50 ms':>9} {'p99 ms':>9}"
+    )
+    for name, stats in result["operations"].items():
+        print(
+            f"  {name:<20} {stats['requests']:>6} {stats['ok']:>6} {stats['shed']:>5} {stats['clientErrors']:>5} "
+            f"{stats['lost']:>5} {stats['errors']:>5} {stats['p50Ms']:>9.1f} {stats['p99Ms']:>9.1f}"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--configs", default="1x1,2x1,2x4", help="gunicorn WORKERSxTHREADS configurations to compare")
+    parser.add_argument("--target", help="base URL of an already-running LOCAL_BACKENDS server (skips spawning)")
+    parser.add_argument("--steps", default="10,25,50,100", help="concurrent virtual users per stage")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per stage")
+    parser.add_argument("--lat", type=float, default=37.7749, help="centre latitude of the area")
+    parser.add_argument("--lng", type=float, default=-122.4194, help="centre longitude of the area")
+    parser.add_argument("--radius", type=float, default=5.0, help="area radius in km")
+    parser.add_argument("--incident-lat", type=float, default=37.7749, help="SOS burst latitude")
+    parser.add_argument("--incident-lng", type=float, default=-122.4194, help="SOS burst longitude")
+    parser.add_argument("--incident-type", default="medical", choices=EMERGENCY_TYPES, help="emergencyType of the burst")
+    parser.add_argument("--sos-burst", type=int, default=20, help="users nearest the incident who press SOS")
+    parser.add_argument("--burst-at", type=float, default=5.0, help="seconds into each stage when the burst starts")
+    parser.add_argument("--burst-window", type=float, default=10.0, help="seconds over which burst SOS calls spread")
+    parser.add_argument("--responder-fraction", type=float, default=0.3, help="share of users who answer alerts")
+    parser.add_argument("--respond-probability", type=float, default=0.5, help="chance a responder answers per poll")
+    parser.add_argument("--location-interval", type=float, default=10.0, help="seconds between location pings")
+    parser.add_argument("--poll-interval", type=float, default=5.0, help="seconds between alert polls")
+    parser.add_argument("--message-interval", type=float, default=30.0, help="mean seconds between messages")
+    parser.add_argument("--ask-interval", type=float, default=90.0, help="mean seconds between /ask-stream sessions")
+    parser.add_argument("--seed-users", type=int, default=500, help="users seeded into the local backends")
+    parser.add_argument("--seed-alerts", type=int, default=20, help="alerts seeded before the run")
+    parser.add_argument("--seed-conversations", type=int, default=100, help="conversations seeded before the run")
+    parser.add_argument("--groq-latency", type=float, default=0.3, help="scripted Groq latency per call (s)")
+    parser.add_argument("--fcm-latency", type=float, default=0.02, help="FCM sink latency per send (s)")
+    parser.add_argument("--slo-ms", type=float, default=2000.0, help="p99 budget for send-sos and respond")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="allowed 5xx/transport/lost error rate")
+    parser.add_argument("--timeout", type=float, default=30.0, help="client timeout per request (s)")
+    parser.add_argument("--startup-timeout", type=float, default=120.0, help="seconds to wait for a spawned server")
+    parser.add_argument("--seed", type=int, default=1, help="random seed shared by the server dataset and the load mix")
+    parser.add_argument("--json", dest="json_path", help="also write the full report to this JSON file")
+    args = parser.parse_args(argv)
+
+    steps = [int(step) for step in args.steps.split(",") if step.strip()]
+    configs = ["external"] if args.target else [config.strip() for config in args.configs.split(",") if config.strip()]
+    report: Dict[str, Any] = {"config": vars(args), "capacity": {}, "stages": {}}
+
+    for config in configs:
+        process = None
+        if args.target:
+            base_url = args.target.rstrip("/")
+        else:
+            workers, threads = (int(part) for part in config.lower().split("x"))
+            print(f"\n=== starting gunicorn workers={workers} threads={threads} ===")
+            process, base_url = start_server(args, workers, threads)
+        capacity = 0
+        violated = False
+        stages = []
+        try:
+            for index, users in enumerate(steps):
+                result = run_stage(args, base_url, users, run_id=f"{config}-{index}-{int(time.time())}")
+                ok = within_slo(result, args)
+                print_stage(config, users, result, ok)
+                stages.append({"users": users, "withinSlo": ok, **result})
+                violated = violated or not ok
+                if not violated:
+                    capacity = users
+        finally:
+            if process is not None:
+                stop_server(process)
+        report["stages"][config] = stages
+        report["capacity"][config] = capacity
+
+    print("\ncapacity curve (users:throughput/lost at each step, ! = SLO violated):")
+    for config, stages in report["stages"].items():
+        curve = "  ".join(
+            f"{stage['users']}:{stage['throughput']:.0f}/{stage['lost']}{'' if stage['withinSlo'] else '!'}" for stage in stages
+        )
+        print(f"  {config:<10} capacity={report['capacity'][config]:<6} {curve}")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
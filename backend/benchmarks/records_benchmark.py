@@ -0,0 +1,271 @@
+"""Compare per-row dicts with the __slots__ record classes used by the hot list pipelines.
+
+For nearby users, nearby alerts and conversation messages, builds --rows rows
+from synthetic Firestore documents twice: once as the dict literals the routes
+used to build for every document, once as the app's record classes. Reports
+memory per 100k rows (tracemalloc), build time, sort time and the time to get
+to a JSON response (top-k for nearby users, the full list for the others).
+
+    cd backend
+    python benchmarks/records_benchmark.py --rows 100000
+"""
+
+import argparse
+import gc
+import heapq
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from operator import attrgetter, itemgetter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_WARMUP", "0")
+
+import app  # noqa: E402
+
+
+class FakeSnapshot:
+    __slots__ = ("id", "reference", "_data")
+
+    def __init__(self, doc_id: str, data: Dict[str, Any]):
+        self.id = doc_id
+        self.reference = None
+        self._data = data
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self._data
+
+
+def location_docs(rows: int, rng: random.Random) -> List[FakeSnapshot]:
+    now = datetime.now(timezone.utc)
+    return [
+        FakeSnapshot(
+            f"user{i:06d}",
+            {
+                "latitude": 37.77 + rng.uniform(-0.1, 0.1),
+                "longitude": -122.41 + rng.uniform(-0.1, 0.1),
+                "accuracy": rng.choice([5, 10, 25]),
+                "timestamp": now - timedelta(seconds=rng.randrange(1800)),
+                "displayName": f"User {i}",
+                "email": f"user{i}@example.test",
+            },
+        )
+        for i in range(rows)
+    ]
+
+
+def alert_docs(rows: int, rng: random.Random) -> List[FakeSnapshot]:
+    now = datetime.now(timezone.utc)
+    return [
+        FakeSnapshot(
+            f"alert{i:06d}",
+            {
+                "userId": f"user{rng.randrange(rows):06d}",
+                "senderDisplayName": f"User {i}",
+                "message": "Water is rising on our street, two people need help.",
+                "emergencyType": rng.choice(["flood", "fire", "medical"]),
+                "status": "active",
+                "location": {"latitude": 37.77 + rng.uniform(-0.05, 0.05), "longitude": -122.41},
+                "createdAt": now - timedelta(seconds=rng.randrange(3600)),
+                "reporterCount": rng.randint(1, 4),
+            },
+        )
+        for i in range(rows)
+    ]
+
+
+def message_docs(rows: int, rng: random.Random) -> List[FakeSnapshot]:
+    now = datetime.now(timezone.utc)
+    return [
+        FakeSnapshot(
+            f"msg{i:06d}",
+            {
+                "conversationId": "conv1",
+                "senderId": "user000001",
+                "senderName": "User 1",
+                "recipientIds": ["user000002"],
+                "text": "Are you safe now? I can come over.",
+                "messageType": "text",
+                "timestamp": now - timedelta(seconds=rows - i),
+                "emotionAnalysis": {"label": "anxious", "scale": 6, "analyzedAt": now},
+            },
+        )
+        for i in range(rows)
+    ]
+
+
+# The dict literals built per document before the record classes.
+
+def user_as_dict(doc: FakeSnapshot, lat: float, lng: float) -> Dict[str, Any]:
+    record = doc.to_dict()
+    timestamp = record.get("timestamp")
+    return {
+        "userId": doc.id,
+        "displayName": record.get("displayName") or "User",
+        "latitude": float(record["latitude"]),
+        "longitude": float(record["longitude"]),
+        "distance_km": round(app.haversine(lat, lng, record["latitude"], record["longitude"]), 2),
+        "lastUpdated": timestamp.timestamp() if hasattr(timestamp, "timestamp") else None,
+        "accuracy": record.get("accuracy"),
+        "email": record.get("email"),
+    }
+
+
+def user_as_record(doc: FakeSnapshot, lat: float, lng: float) -> app._NearbyUser:
+    record = doc.to_dict()
+    timestamp = record.get("timestamp")
+    return app._NearbyUser(
+        doc.id,
+        record.get("displayName") or "User",
+        float(record["latitude"]),
+        float(record["longitude"]),
+        round(app.haversine(lat, lng, record["latitude"], record["longitude"]), 2),
+        timestamp.timestamp() if hasattr(timestamp, "timestamp") else None,
+        record.get("accuracy"),
+        record.get("email"),
+    )
+
+
+def alert_as_dict(doc: FakeSnapshot, lat: float, lng: float) -> Dict[str, Any]:
+    data = doc.to_dict()
+    alert_lat, alert_lng = app._alert_coordinates(data)
+    created_at = data.get("createdAt")
+    created_seconds = created_at.timestamp() if hasattr(created_at, "timestamp") else None
+    return {
+        "id": doc.id,
+        "userId": data.get("userId"),
+        "userName": data.get("senderDisplayName") or "User",
+        "message": data.get("message"),
+        "emergencyType": data.get("emergencyType"),
+        "status": data.get("status"),
+        "reporterCount": data.get("reporterCount", 1),
+        "mergedMessage": data.get("mergedMessage"),
+        "distance": round(app.haversine(lat, lng, alert_lat, alert_lng), 2),
+        "location": {"latitude": alert_lat, "longitude": alert_lng},
+        "createdAt": int(created_seconds * 1000) if created_seconds else None,
+        "isOwnAlert": data.get("userId") == "viewer",
+        "responses": [],
+        "aiInsights": data.get("aiInsights"),
+    }
+
+
+def alert_as_record(doc: FakeSnapshot, lat: float, lng: float) -> app._NearbyAlert:
+    data = doc.to_dict()
+    alert_lat, alert_lng = app._alert_coordinates(data)
+    return app._NearbyAlert(doc, data, alert_lat, alert_lng, app.haversine(lat, lng, alert_lat, alert_lng))
+
+
+def message_as_dict(doc: FakeSnapshot, lat: float, lng: float) -> Dict[str, Any]:
+    data = doc.to_dict()
+    emotion = dict(data["emotionAnalysis"])
+    emotion["analyzedAt"] = app._timestamp_to_ms(emotion.get("analyzedAt"))
+    return {
+        "id": doc.id,
+        "messageId": doc.id,
+        "conversationId": data.get("conversationId"),
+        "senderId": data.get("senderId"),
+        "senderName": data.get("senderName"),
+        "recipientIds": data.get("recipientIds") or [],
+        "text": data.get("text"),
+        "messageType": data.get("messageType", "text"),
+        "timestamp": app._timestamp_to_ms(data.get("timestamp")),
+        "sourceAlertId": data.get("sourceAlertId"),
+        "emotionAnalysis": emotion,
+    }
+
+
+def message_as_record(doc: FakeSnapshot, lat: float, lng: float) -> app._MessageRecord:
+    return app._MessageRecord(doc)
+
+
+Builder = Callable[[FakeSnapshot, float, float], Any]
+Case = Tuple[Callable, Builder, Builder, Callable, Callable, Callable, Optional[int]]
+# kind -> (documents, dict builder, record builder, dict sort key, record sort key, record to JSON, rows in the response)
+CASES: Dict[str, Case] = {
+    "nearby users": (
+        location_docs, user_as_dict, user_as_record,
+        itemgetter("distance_km"), attrgetter("distance_km"), lambda row: row.to_json(), 4,
+    ),
+    "nearby alerts": (
+        alert_docs, alert_as_dict, alert_as_record,
+        itemgetter("distance"), attrgetter("distance"), lambda row: row.to_json("viewer"), None,
+    ),
+    "messages": (
+        message_docs, message_as_dict, message_as_record,
+        itemgetter("timestamp"), attrgetter("timestamp_ms"), lambda row: row.to_json(), None,
+    ),
+}
+
+
+def measure(
+    docs: List[FakeSnapshot], build: Builder, key: Callable, to_json: Optional[Callable], top: Optional[int]
+) -> Dict[str, float]:
+    """Time and size one variant; ``to_json`` is None for rows that already are dicts."""
+    lat, lng = 37.77, -122.41
+    # Size and time in separate passes: tracemalloc slows allocation down several times over.
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    rows = [build(doc, lat, lng) for doc in docs]
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    del rows
+    gc.collect()
+
+    started = time.perf_counter()
+    rows = [build(doc, lat, lng) for doc in docs]
+    built = time.perf_counter()
+
+    sort_started = time.perf_counter()
+    ordered = sorted(rows, key=key)
+    sorted_at = time.perf_counter()
+
+    respond_started = time.perf_counter()
+    if top is not None:
+        selected = sorted(rows, key=key)[:top] if to_json is None else heapq.nsmallest(top, rows, key=key)
+    else:
+        selected = ordered
+    payload = selected if to_json is None else [to_json(row) for row in selected]
+    json.dumps(payload, default=str)
+    responded = time.perf_counter()
+    return {
+        "bytesPer100k": retained * 100_000 / len(docs),
+        "buildMs": (built - started) * 1000,
+        "sortMs": (sorted_at - sort_started) * 1000,
+        "responseMs": (responded - respond_started) * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000, help="rows per case")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the synthetic documents")
+    parser.add_argument("--json", dest="json_path", help="also write results to this JSON file")
+    args = parser.parse_args()
+
+    results: Dict[str, Dict[str, Dict[str, float]]] = {}
+    print(f"{'case':<15} {'rows as':<8} {'MiB/100k':>9} {'build ms':>9} {'sort ms':>9} {'response ms':>12}")
+    for name, (make_docs, as_dict, as_record, dict_key, record_key, to_json, top) in CASES.items():
+        docs = make_docs(args.rows, random.Random(args.seed))
+        results[name] = {
+            "dict": measure(docs, as_dict, dict_key, None, top),
+            "record": measure(docs, as_record, record_key, to_json, top),
+        }
+        for variant, result in results[name].items():
+            print(
+                f"{name:<15} {variant:<8} {result['bytesPer100k'] / 2**20:>9.1f} {result['buildMs']:>9.1f} "
+                f"{result['sortMs']:>9.1f} {result['responseMs']:>12.1f}"
+            )
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as handle:
+            json.dump({"rows": args.rows, "results": results}, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Compare per-token SSE framing with the coalescing writer used by /ask-stream.
+
+Replays a synthetic answer as single-token deltas at a fixed rate and reports
+frames per answer, bytes on the wire and CPU time per stream.
+
+    cd backend
+    python benchmarks/sse_benchmark.py --tokens 400 --rate 200 --streams 5
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+def token_source(tokens: int, rate: float):
+    delay = 1.0 / rate if rate > 0 else 0.0
+    for index in range(tokens):
+        if delay:
+            time.sleep(delay)
+        yield ("\n" if index % 40 == 39 else " ") + f"tok{index}"
+
+
+def per_token(tokens: int, rate: float):
+    for delta in token_source(tokens, rate):
+        yield f"data: {delta}\n\n"
+
+
+def coalesced(tokens: int, rate: float):
+    return app._sse_frames(lambda: token_source(tokens, rate))
+
+
+def measure(name, make_stream, streams):
+    frames = size = 0
+    cpu = wall = 0.0
+    for _ in range(streams):
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        for frame in make_stream():
+            frames += 1
+            size += len(frame.encode("utf-8"))
+        cpu += time.process_time() - cpu_start
+        wall += time.perf_counter() - wall_start
+    print(
+        f"{name:<10} frames/answer={frames / streams:8.1f}  bytes/answer={size / streams:9.1f}  "
+        f"cpu ms/stream={cpu * 1000 / streams:7.2f}  wall s/stream={wall / streams:6.2f}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=400, help="deltas per answer")
+    parser.add_argument("--rate", type=float, default=200.0, help="deltas per second (0 = as fast as possible)")
+    parser.add_argument("--streams", type=int, default=5, help="answers to stream per variant")
+    args = parser.parse_args()
+
+    measure("per-token", lambda: per_token(args.tokens, args.rate), args.streams)
+    measure("coalesced", lambda: coalesced(args.tokens, args.rate), args.streams)
+
+
+if __name__ == "__main__":
+    main()
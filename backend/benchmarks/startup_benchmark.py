@@ -0,0 +1,110 @@
+"""Measure `import app` time and hold it to a startup budget.
+
+Each run imports the app in a fresh interpreter (compiled bytecode already
+cached), then reports the median and worst import time, the slowest imported
+packages (from -X importtime), and the time for the first /ready call to bring
+up the clients. The exit status is 1 when the median import time exceeds
+--budget-ms or when a client SDK that should load lazily was imported eagerly.
+
+    cd backend
+    python benchmarks/startup_benchmark.py --runs 7 --budget-ms 500
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded on first use by app.py; importing any of these at module level is a regression.
+LAZY_MODULES = ("firebase_admin", "google.cloud.firestore", "groq", "httpx")
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+result = {"importMs": (imported - started) * 1000, "eager": [m for m in %r if m in sys.modules]}
+if %r:
+    response = app.app.test_client().get("/ready")
+    result["readyMs"] = (time.perf_counter() - imported) * 1000
+    result["readyStatus"] = response.status_code
+print(json.dumps(result))
+"""
+
+
+def run_probe(with_ready: bool, env: Dict[str, str]) -> Dict[str, object]:
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE % (LAZY_MODULES, with_ready)],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(env: Dict[str, str], top: int) -> List[Tuple[str, float]]:
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    packages: List[Tuple[str, float]] = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, raw_name = line[len("import time:"):].split("|")
+        # Nesting is shown as two spaces per level; keep the modules app.py imports directly.
+        depth = (len(raw_name) - len(raw_name.lstrip()) - 1) // 2
+        if depth != 1 or not cumulative.strip().isdigit():
+            continue
+        packages.append((raw_name.strip(), int(cumulative) / 1000))
+    return sorted(packages, key=lambda item: item[1], reverse=True)[:top]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to time")
+    parser.add_argument("--budget-ms", type=float, default=500.0, help="allowed median import time")
+    parser.add_argument("--top", type=int, default=8, help="slowest imported packages to list")
+    parser.add_argument("--ready", action="store_true", help="also time the first /ready call (initialises clients)")
+    args = parser.parse_args()
+
+    env = dict(os.environ, GROQ_WARMUP="0")
+    env.pop("LOCAL_BACKENDS", None)
+    run_probe(False, env)  # populate __pycache__ so every timed run measures the same thing
+
+    results = [run_probe(args.ready, env) for _ in range(args.runs)]
+    import_ms = [float(result["importMs"]) for result in results]
+    median = statistics.median(import_ms)
+    print(f"import app: median={median:.1f} ms  max={max(import_ms):.1f} ms  budget={args.budget_ms:.0f} ms")
+    if args.ready:
+        ready_ms = [float(result["readyMs"]) for result in results]
+        print(f"first /ready: median={statistics.median(ready_ms):.1f} ms  status={results[-1]['readyStatus']}")
+
+    print("slowest imports (cumulative ms):")
+    for name, cumulative_ms in slowest_imports(env, args.top):
+        print(f"  {name:<40} {cumulative_ms:8.1f}")
+
+    eager = sorted({module for result in results for module in result["eager"]})
+    failed = False
+    if eager:
+        print(f"FAIL: imported eagerly: {', '.join(eager)}")
+        failed = True
+    if median > args.budget_ms:
+        print(f"FAIL: median import time {median:.1f} ms exceeds the {args.budget_ms:.0f} ms budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Gunicorn settings picked up automatically from the backend directory."""
+
+import glob
+import os
+import subprocess
+import sys
+import threading
+import time
+
+_location_index_updater = None
+_updater_stop = threading.Event()
+_updater_lock = threading.Lock()
+# Restart delays for a crashed updater double up to this cap; a run this long resets them.
+_UPDATER_MAX_BACKOFF_SECONDS = 60.0
+
+
+def on_starting(server):
+    # Metric snapshots from a previous run would otherwise be summed into the new counters.
+    metrics_dir = os.environ.get("METRICS_DIR")
+    if metrics_dir:
+        for path in glob.glob(os.path.join(metrics_dir, "*.json")):
+            os.remove(path)
+
+
+def _start_location_index_updater():
+    return subprocess.Popen(
+        [sys.executable, "-m", "flask", "--app", "app", "location-index"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+
+
+def _supervise_location_index_updater(server):
+    """Restart the updater whenever it exits, backing off while it keeps crashing."""
+    global _location_index_updater
+    backoff = 1.0
+    started = time.monotonic()
+    while not _updater_stop.wait(1.0):
+        code = _location_index_updater.poll()
+        if code is None:
+            continue
+        if time.monotonic() - started >= _UPDATER_MAX_BACKOFF_SECONDS:
+            backoff = 1.0
+        server.log.warning("Location index updater exited with %s; restarting in %.0fs", code, backoff)
+        if _updater_stop.wait(backoff):
+            return
+        backoff = min(backoff * 2, _UPDATER_MAX_BACKOFF_SECONDS)
+        started = time.monotonic()
+        with _updater_lock:
+            # on_exit may have run while we slept; it must see every process we start.
+            if _updater_stop.is_set():
+                return
+            _location_index_updater = _start_location_index_updater()
+
+
+def when_ready(server):
+    # One process per instance owns the shared location index; the workers only read it.
+    global _location_index_updater
+    if os.environ.get("LOCATION_INDEX_ENABLED") == "1" and os.environ.get("LOCATION_INDEX_UPDATER", "1") == "1":
+        _location_index_updater = _start_location_index_updater()
+        threading.Thread(
+            target=_supervise_location_index_updater, args=(server,), name="location-index-supervisor", daemon=True
+        ).start()
+
+
+def on_exit(server):
+    with _updater_lock:
+        _updater_stop.set()
+        updater = _location_index_updater
+    if updater is not None and updater.poll() is None:
+        updater.terminate()
+        try:
+            updater.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.log.warning("Location index updater did not stop within 10s; killing it")
+            updater.kill()
+            updater.wait()
+
+
+def post_worker_init(worker):
+    # Each worker builds its own Groq connection pool after fork; open it before traffic arrives.
+    from app import GROQ_WARMUP, warm_groq_client
+
+    if GROQ_WARMUP:
+        threading.Thread(target=warm_groq_client, name="groq-warmup", daemon=True).start()
+
+
+# With in-memory local backends, load and seed the app once in the master so every
+# worker forks from the same dataset (writes made during a run stay worker-local).
+preload_app = os.environ.get("LOCAL_BACKENDS") == "1"
@@ -0,0 +1,551 @@
+"""In-memory stand-ins for Firestore, Groq and FCM.
+
+These implement the subset of each client that app.py uses, so the backend can
+run (and be benchmarked) without Firebase credentials or a Groq API key:
+
+    import app
+    from local_backends import InMemoryFirestore, ScriptedGroq, PushSink, fake_token_verifier
+
+    app.configure_backends(
+        firestore=InMemoryFirestore(),
+        groq_client=ScriptedGroq(latency=0.2),
+        push_sender=PushSink(),
+        token_verifier=fake_token_verifier,
+    )
+
+Queries support where (==, !=, <, <=, >, >=, in, array_contains), order_by,
+limit, offset and start_after; writes resolve SERVER_TIMESTAMP, Increment,
+ArrayUnion, ArrayRemove and DELETE_FIELD. Transactions run under a single
+store-wide lock, which is stricter than Firestore but fine for a fake.
+"""
+
+import copy
+import math
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from firebase_admin import firestore as admin_firestore
+from google.cloud.firestore_v1 import transforms
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _resolve(value: Any, current: Any) -> Any:
+    if value is admin_firestore.SERVER_TIMESTAMP:
+        return _now()
+    if isinstance(value, transforms.Increment):
+        return (current or 0) + value.value
+    if isinstance(value, transforms.ArrayUnion):
+        merged = list(current or [])
+        for item in value.values:
+            if item not in merged:
+                merged.append(item)
+        return merged
+    if isinstance(value, transforms.ArrayRemove):
+        return [item for item in (current or []) if item not in value.values]
+    if isinstance(value, dict):
+        base = current if isinstance(current, dict) else {}
+        return {key: _resolve(item, base.get(key)) for key, item in value.items()}
+    return value
+
+
+class InMemorySnapshot:
+    def __init__(self, reference: "InMemoryDocumentReference", data: Optional[Dict[str, Any]]):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field: str) -> Any:
+        return (self._data or {}).get(field)
+
+
+class InMemoryDocumentReference:
+    def __init__(self, store: "InMemoryFirestore", path: Tuple[str, ...]):
+        self._store = store
+        self._path = path
+        self.id = path[-1]
+
+    @property
+    def path(self) -> str:
+        return "/".join(self._path)
+
+    def collection(self, name: str) -> "InMemoryCollectionReference":
+        return InMemoryCollectionReference(self._store, self._path + (name,))
+
+    def get(self, *args, **kwargs) -> InMemorySnapshot:
+        with self._store.lock:
+            self._store.count("get")
+            return InMemorySnapshot(self, copy.deepcopy(self._store.docs.get(self._path)))
+
+    def set(self, data: Dict[str, Any], merge: bool = False) -> None:
+        with self._store.lock:
+            self._store.count("set")
+            base = dict(self._store.docs.get(self._path) or {}) if merge else {}
+            for key, value in data.items():
+                if value is admin_firestore.DELETE_FIELD:
+                    base.pop(key, None)
+                else:
+                    base[key] = _resolve(value, base.get(key))
+            self._store.docs[self._path] = base
+
+    def create(self, data: Dict[str, Any]) -> None:
+        with self._store.lock:
+            if self._path in self._store.docs:
+                raise ValueError(f"Document already exists: {self.path}")
+            self.set(data)
+
+    def update(self, data: Dict[str, Any]) -> None:
+        with self._store.lock:
+            if self._path not in self._store.docs:
+                raise KeyError(f"No document to update: {self.path}")
+            self.set(data, merge=True)
+
+    def delete(self) -> None:
+        with self._store.lock:
+            self._store.count("delete")
+            self._store.docs.pop(self._path, None)
+
+
+class InMemoryQuery:
+    def __init__(
+        self,
+        store: "InMemoryFirestore",
+        path: Tuple[str, ...],
+        filters: Iterable[Tuple[str, str, Any]] = (),
+        orders: Iterable[Tuple[str, str]] = (),
+        limit: Optional[int] = None,
+        offset: int = 0,
+        cursor: Optional[InMemorySnapshot] = None,
+    ):
+        self._store = store
+        self._path = path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._offset = offset
+        self._cursor = cursor
+
+    def _copy(self, **overrides) -> "InMemoryQuery":
+        params = {
+            "filters": self._filters,
+            "orders": self._orders,
+            "limit": self._limit,
+            "offset": self._offset,
+            "cursor": self._cursor,
+        }
+        params.update(overrides)
+        return InMemoryQuery(self._store, self._path, **params)
+
+    def where(self, field: str, op: str, value: Any) -> "InMemoryQuery":
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field: str, direction: str = "ASCENDING") -> "InMemoryQuery":
+        return self._copy(orders=self._orders + ((field, direction),))
+
+    def limit(self, count: int) -> "InMemoryQuery":
+        return self._copy(limit=count)
+
+    def offset(self, count: int) -> "InMemoryQuery":
+        return self._copy(offset=count)
+
+    def start_after(self, snapshot: InMemorySnapshot) -> "InMemoryQuery":
+        return self._copy(cursor=snapshot)
+
+    @staticmethod
+    def _matches(data: Dict[str, Any], field: str, op: str, value: Any) -> bool:
+        current = data.get(field)
+        if op == "array_contains":
+            return isinstance(current, list) and value in current
+        if op == "in":
+            return current in value
+        if current is None:
+            return False
+        comparisons: Dict[str, Callable[[Any, Any], bool]] = {
+            "==": lambda a, b: a == b,
+            "!=": lambda a, b: a != b,
+            "<": lambda a, b: a < b,
+            "<=": lambda a, b: a <= b,
+            ">": lambda a, b: a > b,
+            ">=": lambda a, b: a >= b,
+        }
+        if op not in comparisons:
+            raise ValueError(f"Unsupported operator: {op}")
+        try:
+            return comparisons[op](current, value)
+        except TypeError:
+            return False
+
+    def _effective_orders(self) -> List[Tuple[str, str]]:
+        # Firestore implicitly orders by the range-filtered field first.
+        orders = list(self._orders)
+        ordered_fields = {field for field, _ in orders}
+        for field, op, _ in self._filters:
+            if op in ("<", "<=", ">", ">=") and field not in ordered_fields:
+                orders.insert(0, (field, "ASCENDING"))
+                ordered_fields.add(field)
+        return orders
+
+    def count(self, alias: Optional[str] = None) -> "InMemoryAggregationQuery":
+        return InMemoryAggregationQuery(self, alias or "count")
+
+    def _rows(self) -> List[Tuple[Tuple[str, ...], Dict[str, Any]]]:
+        depth = len(self._path) + 1
+        with self._store.lock:
+            self._store.count("query")
+            rows = [
+                (path, copy.deepcopy(data))
+                for path, data in self._store.docs.items()
+                if len(path) == depth and path[:-1] == self._path
+            ]
+        for field, op, value in self._filters:
+            rows = [row for row in rows if self._matches(row[1], field, op, value)]
+
+        orders = self._effective_orders()
+        for field, direction in reversed(orders):
+            # Documents missing an order_by field are excluded, as in Firestore.
+            rows = [row for row in rows if row[1].get(field) is not None]
+            rows.sort(key=lambda row: row[1][field], reverse=direction == admin_firestore.Query.DESCENDING)
+
+        if self._cursor is not None:
+            ids = [path[-1] for path, _ in rows]
+            if self._cursor.id in ids:
+                rows = rows[ids.index(self._cursor.id) + 1:]
+            elif orders:
+                field, direction = orders[0]
+                pivot = (self._cursor.to_dict() or {}).get(field)
+                if direction == admin_firestore.Query.DESCENDING:
+                    rows = [row for row in rows if row[1][field] < pivot]
+                else:
+                    rows = [row for row in rows if row[1][field] > pivot]
+
+        rows = rows[self._offset:]
+        if self._limit is not None:
+            rows = rows[: self._limit]
+        return rows
+
+    def stream(self, *args, **kwargs) -> Iterable[InMemorySnapshot]:
+        rows = self._rows()
+        with self._store.lock:
+            self._store.count("read", len(rows))
+        for path, data in rows:
+            yield InMemorySnapshot(InMemoryDocumentReference(self._store, path), data)
+
+    def get(self, *args, **kwargs) -> List[InMemorySnapshot]:
+        return list(self.stream())
+
+
+class InMemoryAggregationQuery:
+    """``query.count()``: like Firestore, billed as one read per 1000 matches (at least one)."""
+
+    def __init__(self, query: InMemoryQuery, alias: str):
+        self._query = query
+        self._alias = alias
+
+    def get(self, *args, **kwargs) -> List[List[SimpleNamespace]]:
+        total = len(self._query._rows())
+        with self._query._store.lock:
+            self._query._store.count("read", max(1, math.ceil(total / 1000)))
+        return [[SimpleNamespace(alias=self._alias, value=total)]]
+
+
+class InMemoryCollectionReference(InMemoryQuery):
+    def __init__(self, store: "InMemoryFirestore", path: Tuple[str, ...]):
+        super().__init__(store, path)
+        self.id = path[-1]
+
+    def document(self, document_id: Optional[str] = None) -> InMemoryDocumentReference:
+        return InMemoryDocumentReference(self._store, self._path + (document_id or uuid.uuid4().hex[:20],))
+
+    def add(self, data: Dict[str, Any]) -> Tuple[datetime, InMemoryDocumentReference]:
+        reference = self.document()
+        reference.set(data)
+        return _now(), reference
+
+
+class InMemoryWriteBatch:
+    """Write batch (and transaction) that applies its queued writes on commit."""
+
+    def __init__(self, store: "InMemoryFirestore"):
+        self._store = store
+        self._writes: List[Callable[[], None]] = []
+
+    def set(self, reference, data, merge=False) -> None:
+        self._writes.append(lambda: reference.set(data, merge=merge))
+
+    def create(self, reference, data) -> None:
+        self._writes.append(lambda: reference.create(data))
+
+    def update(self, reference, data) -> None:
+        self._writes.append(lambda: reference.update(data))
+
+    def delete(self, reference) -> None:
+        self._writes.append(reference.delete)
+
+    def __len__(self) -> int:
+        return len(self._writes)
+
+    def commit(self) -> List[Any]:
+        with self._store.lock:
+            self._store.count("commit")
+            for write in self._writes:
+                write()
+        results = [SimpleNamespace(update_time=_now()) for _ in self._writes]
+        self._writes = []
+        return results
+
+
+class InMemoryFirestore:
+    """Thread-safe dict-backed Firestore client keyed by document path tuples."""
+
+    def __init__(self):
+        self.docs: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+        self.lock = threading.RLock()
+        self.operations: Dict[str, int] = {}
+
+    def count(self, operation: str, amount: int = 1) -> None:
+        self.operations[operation] = self.operations.get(operation, 0) + amount
+
+    def collection(self, name: str) -> InMemoryCollectionReference:
+        return InMemoryCollectionReference(self, (name,))
+
+    def batch(self) -> InMemoryWriteBatch:
+        return InMemoryWriteBatch(self)
+
+    def get_all(self, references, *args, **kwargs) -> Iterable[InMemorySnapshot]:
+        for reference in references:
+            yield reference.get()
+
+    def run_transaction(self, callback: Callable[[InMemoryWriteBatch], Any]) -> Any:
+        """Run ``callback(transaction)`` atomically; reads inside see committed data only."""
+        with self.lock:
+            transaction = InMemoryWriteBatch(self)
+            result = callback(transaction)
+            transaction.commit()
+            return result
+
+
+def _default_responder(request: Dict[str, Any]) -> str:
+    system = " ".join(m["content"] for m in request.get("messages", []) if m.get("role") == "system").lower()
+    if "json" in system:
+        return (
+            '{"summary": "Scripted analysis.", "severity": "HIGH", "emotion": "calm", '
+            '"confidence": 0.5, "recommendations": ["Stay safe."]}'
+        )
+    return "This is a scripted answer from the local Groq stand-in. Stay calm and call emergency services."
+
+
+class _ScriptedCompletions:
+    def __init__(self, owner: "ScriptedGroq"):
+        self._owner = owner
+
+    def create(self, **kwargs):
+        owner = self._owner
+        with owner.lock:
+            owner.calls.append(kwargs)
+            fail = owner.failures > 0
+            if fail:
+                owner.failures -= 1
+        time.sleep(owner.latency)
+        if fail:
+            raise owner.error
+        text = owner.responder(kwargs)
+        prompt_tokens = sum(len(message.get("content") or "") for message in kwargs.get("messages", [])) // 4
+        completion_tokens = max(1, len(text) // 4)
+        usage = SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        )
+        if kwargs.get("stream"):
+            return self._stream(text, usage)
+        return SimpleNamespace(
+            model=kwargs.get("model"),
+            choices=[SimpleNamespace(message=SimpleNamespace(content=text), finish_reason="stop")],
+            usage=usage,
+        )
+
+    def _stream(self, text: str, usage):
+        words = text.split(" ")
+        for index, word in enumerate(words):
+            if index and self._owner.token_latency:
+                time.sleep(self._owner.token_latency)
+            delta = SimpleNamespace(content=word if index == 0 else " " + word)
+            last = index == len(words) - 1
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(delta=delta, finish_reason="stop" if last else None)],
+                x_groq=SimpleNamespace(usage=usage) if last else None,
+            )
+
+
+class _ScriptedModels:
+    def list(self, **kwargs):
+        return SimpleNamespace(data=[])
+
+
+class ScriptedGroq:
+    """Groq client stub with fixed latency and a pluggable ``responder(request) -> text``.
+
+    Set ``failures`` to make the next N calls raise ``error``.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        token_latency: float = 0.0,
+        responder: Optional[Callable[[Dict[str, Any]], str]] = None,
+    ):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.responder = responder or _default_responder
+        self.calls: List[Dict[str, Any]] = []
+        self.failures = 0
+        self.error: Exception = RuntimeError("Scripted Groq failure")
+        self.lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=_ScriptedCompletions(self))
+        self.models = _ScriptedModels()
+
+
+class PushSink:
+    """FCM ``messaging.send`` replacement that records messages instead of delivering them.
+
+    Tokens listed in ``invalid_tokens`` raise an unregistered-token error like FCM does.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent: List[Any] = []
+        self.invalid_tokens = set()
+        self.lock = threading.Lock()
+
+    def __call__(self, message) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        if message.token in self.invalid_tokens:
+            raise ValueError("Requested entity was not found (unregistered)")
+        with self.lock:
+            self.sent.append(message)
+            return f"projects/local/messages/{len(self.sent)}"
+
+
+def fake_token_verifier(id_token: str) -> Dict[str, Any]:
+    """Treat the bearer token as the uid; ``admin:<uid>`` grants the admin claim."""
+    admin = id_token.startswith("admin:")
+    uid = id_token.split(":", 1)[1] if admin else id_token
+    return {"uid": uid, "name": uid, "email": f"{uid}@example.test", "admin": admin}
+
+
+EMERGENCY_TYPES = ("medical", "fire", "flood", "crime", "general")
+ASK_QUESTIONS = (
+    "What do I do if someone is bleeding heavily?",
+    "How do I perform CPR on an adult?",
+    "What are the signs of a stroke?",
+    "How should I treat a minor burn?",
+)
+
+
+def offset_point(rng: random.Random, lat: float, lng: float, radius_km: float) -> Tuple[float, float]:
+    """Uniformly random point within ``radius_km`` of (lat, lng)."""
+    distance = radius_km * math.sqrt(rng.random())
+    bearing = rng.random() * 2 * math.pi
+    d_lat = distance * math.cos(bearing) / 111.0
+    d_lng = distance * math.sin(bearing) / (111.0 * max(0.1, math.cos(math.radians(lat))))
+    return lat + d_lat, lng + d_lng
+
+
+def seeded_user_id(index: int) -> str:
+    return f"user{index:05d}"
+
+
+def seeded_positions(users: int, lat: float, lng: float, radius_km: float, seed: int) -> Dict[str, Tuple[float, float]]:
+    """Home positions of the users ``seed_dataset`` creates; deterministic for the same arguments."""
+    rng = random.Random(seed)
+    return {seeded_user_id(index): offset_point(rng, lat, lng, radius_km) for index in range(users)}
+
+
+class SeededWorld:
+    def __init__(self, positions: Dict[str, Tuple[float, float]]):
+        self.positions = positions
+        self.users: List[str] = list(positions)
+        self.alerts: List[str] = []
+        self.conversations: List[Tuple[str, str]] = []
+        self.chat_users: List[str] = []
+
+
+def seed_dataset(
+    flask_app,
+    *,
+    users: int = 200,
+    alerts: int = 50,
+    conversations: int = 50,
+    messages: int = 10,
+    chat_users: int = 20,
+    chat_turns: int = 20,
+    lat: float = 37.7749,
+    lng: float = -122.4194,
+    radius_km: float = 8.0,
+    seed: int = 1,
+) -> SeededWorld:
+    """Create users, live locations, device tokens, alerts, conversations and /ask history.
+
+    Everything goes through the API with the test client, so documents have exactly
+    the shape the routes write. Auth assumes ``fake_token_verifier`` is installed.
+    """
+    world = SeededWorld(seeded_positions(users, lat, lng, radius_km, seed))
+    rng = random.Random(seed + 1)
+    client = flask_app.test_client()
+
+    def headers(uid: str) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {uid}"}
+
+    for uid, (user_lat, user_lng) in world.positions.items():
+        client.post("/api/users/sync", json={"displayName": uid}, headers=headers(uid))
+        client.post("/api/location", json={"latitude": user_lat, "longitude": user_lng, "accuracy": 10}, headers=headers(uid))
+        client.post("/api/devices/register", json={"token": f"fcm-{uid}", "platform": "web"}, headers=headers(uid))
+
+    for _ in range(alerts if world.users else 0):
+        uid = rng.choice(world.users)
+        user_lat, user_lng = world.positions[uid]
+        response = client.post(
+            "/api/send-sos",
+            json={
+                "latitude": user_lat,
+                "longitude": user_lng,
+                "message": "Need help, someone is injured.",
+                "emergencyType": rng.choice(EMERGENCY_TYPES),
+            },
+            headers=headers(uid),
+        )
+        alert_id = (response.get_json(silent=True) or {}).get("alertId")
+        if alert_id and alert_id not in world.alerts:
+            world.alerts.append(alert_id)
+
+    for _ in range(conversations if len(world.users) > 1 else 0):
+        owner, peer = rng.sample(world.users, 2)
+        response = client.post("/api/conversations", json={"participantId": peer}, headers=headers(owner))
+        conversation_id = ((response.get_json(silent=True) or {}).get("conversation") or {}).get("id")
+        if not conversation_id:
+            continue
+        world.conversations.append((conversation_id, owner))
+        for turn in range(messages):
+            client.post(
+                f"/api/conversations/{conversation_id}/messages",
+                json={"text": f"Message {turn} about the incident."},
+                headers=headers(owner if turn % 2 == 0 else peer),
+            )
+
+    world.chat_users = world.users[:chat_users]
+    for uid in world.chat_users:
+        for turn in range(chat_turns):
+            client.post("/ask", json={"question": ASK_QUESTIONS[turn % len(ASK_QUESTIONS)]}, headers=headers(uid))
+    return world
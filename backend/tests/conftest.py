@@ -0,0 +1,46 @@
+"""Shared fixtures: the Flask app wired to the in-memory backends from ``local_backends``."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_WARMUP", "0")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+
+import app as app_module  # noqa: E402
+from local_backends import InMemoryFirestore, PushSink, ScriptedGroq, fake_token_verifier  # noqa: E402
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    store = InMemoryFirestore()
+    groq_client = ScriptedGroq()
+    app_module.configure_backends(
+        firestore=store,
+        groq_client=groq_client,
+        push_sender=PushSink(),
+        token_verifier=fake_token_verifier,
+    )
+    monkeypatch.setattr(app_module, "ASK_CACHE_ENABLED", True)
+    monkeypatch.setattr(
+        app_module,
+        "_ask_cache",
+        app_module._AskResponseCache(
+            app_module.ASK_CACHE_MAX_ENTRIES,
+            app_module.ASK_CACHE_TTL_SECONDS,
+            app_module.ASK_CACHE_SIMILARITY_THRESHOLD,
+        ),
+    )
+    yield store, groq_client
+    app_module._chat_writer.flush()
+
+
+@pytest.fixture
+def client(backends):
+    return app_module.app.test_client()
+
+
+def auth(uid: str):
+    return {"Authorization": f"Bearer {uid}"}
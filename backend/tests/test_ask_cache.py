@@ -0,0 +1,82 @@
+import pytest
+
+import app as app_module
+from conftest import auth
+
+
+def _echo_system_prompt(request):
+    """Answer with every system message so the test can see what context reached the model."""
+    system = [message["content"] for message in request["messages"] if message["role"] == "system"]
+    return "Apply pressure to the wound.\n" + "\n".join(system[1:])
+
+
+def test_cached_answer_does_not_leak_profile_between_users(backends, client):
+    _, groq_client = backends
+    groq_client.responder = _echo_system_prompt
+    question = "What do I do if someone is bleeding heavily?"
+
+    first = client.post("/ask", json={"question": question}, headers=auth("alice")).get_json()
+    app_module._chat_writer.flush()
+    second = client.post("/ask", json={"question": question}, headers=auth("bob")).get_json()
+
+    assert "cached" not in first
+    assert second["cached"] == "exact"
+    assert len(groq_client.calls) == 1
+    for payload in (first, second):
+        assert "alice" not in payload["response"]
+        assert "Authenticated user profile" not in payload["response"]
+
+
+def test_streamed_answer_is_cached_without_profile(backends, client):
+    _, groq_client = backends
+    groq_client.responder = _echo_system_prompt
+    question = "How do I perform CPR on an adult?"
+
+    client.post("/ask-stream", json={"question": question}, headers=auth("alice")).get_data()
+    app_module._chat_writer.flush()
+    replayed = client.post("/ask-stream", json={"question": question}, headers=auth("bob")).get_data(as_text=True)
+
+    assert len(groq_client.calls) == 1
+    assert "Apply pressure" in replayed
+    assert "alice" not in replayed
+
+
+def _similarity_cache(threshold=0.5):
+    return app_module._AskResponseCache(100, 3600, threshold)
+
+
+def test_default_cache_serves_exact_repeats_only(backends):
+    cache = app_module._ask_cache
+    cache.store("How do I perform CPR on an adult?", "Push hard and fast.", model="m", latency_ms=10)
+
+    assert cache.lookup("how do i perform cpr on an adult")[1] == "exact"
+    assert cache.lookup("How should I perform CPR on an adult?") == (None, None)
+
+
+def test_similar_tier_serves_questions_that_differ_in_filler_words():
+    cache = _similarity_cache()
+    cache.store("What do I do if someone is bleeding heavily?", "Apply pressure.", model="m", latency_ms=10)
+
+    entry, tier = cache.lookup("What should I do if someone is bleeding heavily")
+
+    assert tier == "similar"
+    assert entry["answer"] == "Apply pressure."
+
+
+@pytest.mark.parametrize(
+    "stored, asked",
+    [
+        (
+            "How many chest compressions per minute should I give when doing CPR on an infant",
+            "How many chest compressions per minute should I give when doing CPR on an adult",
+        ),
+        ("My child swallowed bleach, what should I do?", "My child swallowed pills, what should I do?"),
+        ("What should I do if the wound is bleeding?", "What should I do if the wound is not bleeding?"),
+        ("Should I move him if he is breathing?", "Should I move him if he isn't breathing?"),
+    ],
+)
+def test_similar_tier_never_serves_a_different_medical_question(stored, asked):
+    cache = _similarity_cache()
+    cache.store(stored, "stored answer", model="m", latency_ms=10)
+
+    assert cache.lookup(asked) == (None, None)
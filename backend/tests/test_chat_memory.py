@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta, timezone
+
+import app as app_module
+from conftest import auth
+
+
+def _seed_turns(store, uid, count, start=0):
+    chats = store.collection("users").document(uid).collection("chats")
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for index in range(start, start + count):
+        chats.add(
+            {
+                "question": f"question {index}",
+                "response": f"answer {index}",
+                "timestamp": base + timedelta(minutes=index),
+            }
+        )
+
+
+def _memory(store, uid):
+    return store.collection("users").document(uid).collection("chatMemory").document("summary").get().to_dict() or {}
+
+
+def _summary_calls(groq_client):
+    return [call for call in groq_client.calls if "running summary" in call["messages"][-1]["content"]]
+
+
+def test_ask_does_not_summarize_inline(backends, client):
+    store, groq_client = backends
+    _seed_turns(store, "alice", 30)
+
+    response = client.post("/ask", json={"question": "Is it still bleeding?"}, headers=auth("alice"))
+
+    assert response.status_code == 200
+    assert len(groq_client.calls) == 1
+    assert not _summary_calls(groq_client)
+
+
+def test_summary_cursor_survives_a_failed_attempt(backends):
+    store, groq_client = backends
+    batch = app_module.ASK_SUMMARY_BATCH_TURNS
+    window = app_module.ASK_HISTORY_TURNS + batch
+    _seed_turns(store, "alice", window)
+
+    groq_client.failures = 1
+    try:
+        app_module.summarize_pending_chats("alice")
+    except Exception:
+        pass
+    assert "summarizedThrough" not in _memory(store, "alice")
+
+    # Turns keep arriving while the summary is behind; none of them may be skipped.
+    _seed_turns(store, "alice", 3 * batch, start=window)
+    folded = app_module.summarize_pending_chats("alice")
+
+    assert window + 3 * batch - folded < window
+    summarized = [call["messages"][-1]["content"] for call in _summary_calls(groq_client)]
+    for index in range(folded):
+        assert any(f"User: question {index}\n" in prompt for prompt in summarized)
+    memory = app_module.load_chat_memory("alice")
+    assert memory["turns"][0]["question"] == f"question {folded}"
+
+
+def test_unavailable_groq_is_reported_before_memory_is_read(backends, client, monkeypatch):
+    store, groq_client = backends
+    _seed_turns(store, "alice", 30)
+    monkeypatch.setattr(app_module, "load_chat_memory", lambda uid: (_ for _ in ()).throw(AssertionError(uid)))
+    monkeypatch.setattr(app_module, "groq_available", lambda: False)
+
+    response = client.post("/ask", json={"question": "Is it still bleeding?"}, headers=auth("alice"))
+
+    assert response.status_code == 503
+    assert not groq_client.calls
+
+
+def test_cached_answer_is_served_to_users_with_history(backends, client):
+    store, groq_client = backends
+    question = "How should I treat a minor burn?"
+    client.post("/ask", json={"question": question}, headers=auth("bob"))
+    app_module._chat_writer.flush()
+    _seed_turns(store, "alice", 4)
+
+    cached = client.post("/ask", json={"question": question}, headers=auth("alice")).get_json()
+    follow_up = client.post("/ask", json={"question": "Should I cover it?"}, headers=auth("alice")).get_json()
+
+    assert cached["cached"] == "exact"
+    assert "cached" not in follow_up
+    assert len(groq_client.calls) == 2
@@ -0,0 +1,57 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+import app as app_module
+from conftest import auth
+
+
+@pytest.fixture
+def metrics(backends, monkeypatch):
+    store, _ = backends
+    registry = app_module._Metrics("", 60)
+    monkeypatch.setattr(app_module, "METRICS_ENABLED", True)
+    monkeypatch.setattr(app_module, "_metrics", registry)
+    app_module.configure_backends(firestore=app_module._InstrumentedFirestore(store))
+    return registry
+
+
+def _operations(registry):
+    counts = {}
+    for key, value in registry.dump()["firestore_operations_total"].items():
+        labels = dict(json.loads(key))
+        counts[(labels["op"], labels["collection"])] = counts.get((labels["op"], labels["collection"]), 0) + value
+    return counts
+
+
+def test_reads_through_snapshot_references_are_measured(backends, metrics, client):
+    store, _ = backends
+    for alert_id in ("one", "two"):
+        store.collection("alerts").document(alert_id).set(
+            {
+                "status": "active",
+                "userId": "reporter",
+                "createdAt": datetime.now(timezone.utc),
+                "location": {"latitude": 37.77, "longitude": -122.41},
+                "geohash": app_module._geohash(37.77, -122.41),
+            }
+        )
+
+    response = client.post("/api/alerts/nearby", json={"latitude": 37.77, "longitude": -122.41}, headers=auth("viewer"))
+
+    assert response.status_code == 200
+    # One responses query per alert, issued through snapshot.reference.
+    assert _operations(metrics)[("query", "responses")] == 2
+
+
+def test_measured_snapshots_work_as_query_cursors(backends, metrics):
+    chats = app_module.get_db().collection("users").document("u").collection("chats")
+    for index in range(3):
+        chats.document(f"c{index}").set({"timestamp": index})
+
+    first = list(chats.order_by("timestamp").limit(1).stream())
+    rest = list(chats.order_by("timestamp").start_after(first[-1]).stream())
+
+    assert [snapshot.id for snapshot in rest] == ["c1", "c2"]
+    assert isinstance(first[0].reference, app_module._MeasuredDocument)
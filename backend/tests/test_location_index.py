@@ -0,0 +1,125 @@
+import struct
+from datetime import datetime, timezone
+
+import pytest
+
+import app as app_module
+
+
+@pytest.fixture(autouse=True)
+def index_enabled(monkeypatch):
+    monkeypatch.setattr(app_module, "LOCATION_INDEX_ENABLED", True)
+
+
+def _location(lat, lng, name):
+    return {
+        "latitude": lat,
+        "longitude": lng,
+        "accuracy": 5,
+        "timestamp": datetime.now(timezone.utc),
+        "displayName": name,
+        "email": f"{name}@example.test",
+    }
+
+
+def _writer(tmp_path, capacity=16):
+    writer = app_module._LocationIndexWriter(str(tmp_path / "locations.idx"), capacity)
+    writer.heartbeat()
+    return writer
+
+
+def test_seqlock_round_trip(tmp_path):
+    writer = _writer(tmp_path)
+    writer.apply(
+        upserts=[
+            ("near", _location(37.7750, -122.4190, "Near")),
+            ("far", _location(37.8000, -122.4190, "Far")),
+            ("viewer", _location(37.7749, -122.4194, "Viewer")),
+        ]
+    )
+    reader = app_module._LocationIndexReader(str(tmp_path / "locations.idx"))
+
+    rows = reader.nearest(37.7749, -122.4194, "viewer", 5, 1800)
+
+    assert [row.user_id for row in rows] == ["near", "far"]
+    assert rows[0].display_name == "Near"
+    assert rows[0].email == "Near@example.test"
+    assert rows[0].accuracy == 5
+    assert reader.snapshot()["hits"] == 1
+
+    writer.apply(removals=["near"])
+    assert [row.user_id for row in reader.nearest(37.7749, -122.4194, "viewer", 5, 1800)] == ["far"]
+
+
+def test_torn_read_is_retried(tmp_path, monkeypatch):
+    writer = _writer(tmp_path)
+    writer.apply(upserts=[("mover", _location(37.7750, -122.4190, "Mover"))])
+    reader = app_module._LocationIndexReader(str(tmp_path / "locations.idx"))
+    seq_reads = []
+
+    class TornStruct:
+        """``struct`` whose second sequence read lands after a concurrent write."""
+
+        def __getattr__(self, name):
+            return getattr(struct, name)
+
+        def unpack_from(self, fmt, buffer, offset=0):
+            if fmt == "<Q" and offset == app_module._LOCATION_INDEX_SEQ_OFFSET:
+                seq_reads.append(offset)
+                if len(seq_reads) == 2:
+                    writer.apply(upserts=[("mover", _location(37.9000, -122.4190, "Mover"))])
+            return struct.unpack_from(fmt, buffer, offset)
+
+    monkeypatch.setattr(app_module, "struct", TornStruct())
+    rows = reader.nearest(37.7749, -122.4194, "", 5, 1800)
+
+    assert reader.snapshot()["retries"] == 1
+    assert [row.latitude for row in rows] == [37.9]
+
+
+def test_odd_sequence_is_never_read(tmp_path):
+    writer = _writer(tmp_path)
+    writer.apply(upserts=[("user", _location(37.7750, -122.4190, "User"))])
+    reader = app_module._LocationIndexReader(str(tmp_path / "locations.idx"))
+    # Leave the sequence odd, as a writer that is mid-batch does.
+    struct.pack_into("<Q", writer._mm, app_module._LOCATION_INDEX_SEQ_OFFSET, writer._seq + 1)
+
+    assert reader.nearest(37.7749, -122.4194, "", 5, 1800) is None
+    assert reader.snapshot()["fallbacks"] == 1
+
+
+def test_remap_keeps_the_old_mapping_open(tmp_path):
+    path = str(tmp_path / "locations.idx")
+    writer = _writer(tmp_path, capacity=8)
+    writer.apply(upserts=[("user", _location(37.7750, -122.4190, "User"))])
+    reader = app_module._LocationIndexReader(path)
+    assert reader.nearest(37.7749, -122.4194, "", 5, 1800)
+    _, in_use, _ = reader._map()
+
+    # The updater restarts with a larger table while a request still holds the old mapping.
+    writer._mm.close()
+    app_module.os.close(writer._fd)
+    replacement = _writer(tmp_path, capacity=32)
+    replacement.apply(upserts=[("user", _location(37.7750, -122.4190, "User"))])
+
+    assert [row.user_id for row in reader.nearest(37.7749, -122.4194, "", 5, 1800)] == ["user"]
+    assert reader._map()[1] is not in_use
+    assert not in_use.closed
+
+
+def test_smaller_capacity_does_not_shrink_a_mapped_file(tmp_path):
+    path = str(tmp_path / "locations.idx")
+    writer = _writer(tmp_path, capacity=4096)
+    writer.apply(upserts=[("user", _location(37.7750, -122.4190, "User"))])
+    reader = app_module._LocationIndexReader(path)
+    _, in_use, _ = reader._map()
+
+    writer._mm.close()
+    app_module.os.close(writer._fd)
+    replacement = _writer(tmp_path, capacity=8)
+    replacement.apply(upserts=[("user", _location(37.7750, -122.4190, "User"))])
+
+    # Checked before touching the old mapping: a shrunk file would SIGBUS the test run.
+    assert app_module.os.path.getsize(path) >= len(in_use)
+    assert in_use[len(in_use) - 1] == 0
+    assert [row.user_id for row in reader.nearest(37.7749, -122.4194, "", 5, 1800)] == ["user"]
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta, timezone
+
+import app as app_module
+from conftest import auth
+
+HERE = {"latitude": 37.77, "longitude": -122.41}
+
+
+def _add_alert(store, alert_id, created_at, *, geohash=True):
+    data = {"status": "active", "userId": "reporter", "createdAt": created_at, "location": dict(HERE)}
+    if geohash:
+        data["geohash"] = app_module._geohash(HERE["latitude"], HERE["longitude"])
+    store.collection("alerts").document(alert_id).set(data)
+
+
+def _nearby_ids(client, **payload):
+    response = client.post("/api/alerts/nearby", json={**HERE, **payload}, headers=auth("viewer"))
+    assert response.status_code == 200
+    return [alert["id"] for alert in response.get_json()["alerts"]]
+
+
+def test_stale_alerts_are_not_read(backends, client):
+    store, _ = backends
+    now = datetime.now(timezone.utc)
+    _add_alert(store, "fresh", now)
+    _add_alert(store, "stale", now - timedelta(days=2))
+    reads_before = store.operations.get("read", 0)
+
+    assert _nearby_ids(client) == ["fresh"]
+    # Only the fresh alert is read; the stale one is filtered out by the query.
+    assert store.operations["read"] - reads_before == 1
+
+
+def test_radius_is_clamped(backends, client, monkeypatch):
+    radii = []
+    real_ranges = app_module._geohash_ranges
+    monkeypatch.setattr(app_module, "_geohash_ranges", lambda lat, lng, km: radii.append(km) or real_ranges(lat, lng, km))
+
+    _nearby_ids(client, radius=1e9)
+
+    assert radii == [app_module.NEARBY_ALERT_MAX_RADIUS_KM]
+
+
+def test_maintenance_backfills_geohashes_once(backends, client):
+    store, _ = backends
+    _add_alert(store, "legacy", datetime.now(timezone.utc), geohash=False)
+    assert _nearby_ids(client) == []
+
+    assert app_module.run_alert_lifecycle()["geohashBackfilled"] == 1
+    assert app_module.run_alert_lifecycle()["geohashBackfilled"] is None
+    assert _nearby_ids(client) == ["legacy"]
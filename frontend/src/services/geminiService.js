@@ -49,21 +49,27 @@ export const askGeminiStream = async (question, onChunkReceived) => {
 
     const reader = response.body.getReader();
     const decoder = new TextDecoder();
+    let buffer = '';
     // eslint-disable-next-line no-constant-condition
     while (true) {
       const { done, value } = await reader.read();
       
       if (done) break;
       
-      const chunk = decoder.decode(value);
-      const lines = chunk.split('\n');
+      buffer += decoder.decode(value, { stream: true });
+      // Events end with a blank line and may be split across reads.
+      const events = buffer.split('\n\n');
+      buffer = events.pop();
       
-      for (const line of lines) {
-        if (line.startsWith('data: ')) {
-          const data = line.slice(6);
-          if (data.trim()) {
-            onChunkReceived(data);
-          }
+      for (const event of events) {
+        // Multi-line payloads arrive as several data: lines; comment lines are heartbeats.
+        const dataLines = event
+          .split('\n')
+          .filter(line => line.startsWith('data:'))
+          .map(line => line.slice(line.startsWith('data: ') ? 6 : 5));
+        const data = dataLines.join('\n');
+        if (dataLines.length && data) {
+          onChunkReceived(data);
         }
       }
     }
@@ -73,13 +79,65 @@ export const askGeminiStream = async (question, onChunkReceived) => {
   }
 }
 
+// Chat history loaded so far, oldest first. /chats pages newest-first and each page is
+// chronological, so the newest page is loaded once, older pages only on scroll-back, and
+// later visits fetch just the chats after latestTimestamp (a 304 when nothing changed).
+const CHAT_HISTORY_PAGE_SIZE = 50;
+let chatHistoryCache = null;
+
+const fetchChatPage = (params, etag) => api.get('/chats', {
+  params: { limit: CHAT_HISTORY_PAGE_SIZE, ...params },
+  headers: etag ? { 'If-None-Match': etag } : {},
+  validateStatus: (status) => (status >= 200 && status < 300) || status === 304
+});
+
+const loadNewestChats = async (uid) => {
+  const response = await fetchChatPage({});
+  const page = response.data;
+  chatHistoryCache = {
+    uid,
+    history: page.history || [],
+    nextCursor: page.hasMore ? page.nextCursor : null,
+    latestTimestamp: page.latestTimestamp,
+    sinceEtag: null
+  };
+};
+
 export const getChatHistory = async () => {
-  try {
-    const response = await api.get('/chats');
-    return response.data.history;
-  } catch (error) {
-    throw error;
+  const uid = auth && auth.currentUser ? auth.currentUser.uid : null;
+  if (!chatHistoryCache || chatHistoryCache.uid !== uid || chatHistoryCache.latestTimestamp == null) {
+    await loadNewestChats(uid);
+    return chatHistoryCache.history.slice();
   }
+
+  const since = chatHistoryCache.latestTimestamp;
+  const response = await fetchChatPage({ since }, chatHistoryCache.sinceEtag);
+  if (response.status !== 304) {
+    const page = response.data;
+    if (page.hasMore) {
+      // More new chats than one page: start over from the newest page instead of leaving a gap.
+      await loadNewestChats(uid);
+      return chatHistoryCache.history.slice();
+    }
+    chatHistoryCache.history = chatHistoryCache.history.concat(page.history || []);
+    chatHistoryCache.latestTimestamp = page.latestTimestamp;
+    // The ETag is only valid for the same since value; a new latestTimestamp needs a fresh one.
+    chatHistoryCache.sinceEtag = page.latestTimestamp === since ? response.headers.etag : null;
+  }
+  return chatHistoryCache.history.slice();
+};
+
+export const hasOlderChatHistory = () => Boolean(chatHistoryCache && chatHistoryCache.nextCursor);
+
+// Fetches the page before the oldest loaded chat and returns it, oldest first.
+export const loadOlderChatHistory = async () => {
+  if (!hasOlderChatHistory()) return [];
+  const response = await fetchChatPage({ before: chatHistoryCache.nextCursor });
+  const page = response.data;
+  const older = page.history || [];
+  chatHistoryCache.history = older.concat(chatHistoryCache.history);
+  chatHistoryCache.nextCursor = page.hasMore ? page.nextCursor : null;
+  return older;
 };
 
 export const analyzeEmotion = async (text, options = {}) => {